@@ -1,14 +1,21 @@
 from gevent import monkey
 monkey.patch_all()
 
+from config import Config
+if Config.DB_GREEN:
+    from .db_pool import make_psycopg_green
+    make_psycopg_green()
+
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_socketio import SocketIO
+from socketio import RedisManager
 from flask_caching import Cache
 from threading import Lock, Thread, Event
 from typing import Dict, List, Tuple
-from config import Config
+from .db_pool import engine_options
+from .metrics import set_emit_size
 import logging
 from logging.handlers import RotatingFileHandler
 
@@ -21,9 +28,47 @@ login_manager = LoginManager()
 socketio = SocketIO()
 user_sessions = {}
 
+def socketio_options() -> Tuple[str, dict]:
+    # Packet encoding (Config.SOCKETIO_SERIALIZER): with msgpack the websocket frames are binary and the message
+    # queue publishes msgpack as well, instead of JSON; without the msgpack package both stay JSON
+    if Config.SOCKETIO_SERIALIZER != 'msgpack':
+        return 'default', {}
+    try:
+        import msgpack
+    except ImportError:
+        logging.getLogger(__name__).warning("SOCKETIO_SERIALIZER=msgpack but msgpack is not installed, Socket.IO packets stay JSON")
+        return 'default', {}
+
+    class MsgpackCodec:
+        # Stands in for the json module of the Redis message queue manager
+        @staticmethod
+        def dumps(data) -> bytes:
+            return msgpack.packb(data)
+
+        @staticmethod
+        def loads(message:bytes):
+            return msgpack.unpackb(message)
+
+    options = {'serializer': 'msgpack'}
+    if Config.SOCKETIO_MESSAGE_QUEUE and Config.SOCKETIO_MESSAGE_QUEUE.startswith(('redis://', 'rediss://')):
+        options['client_manager'] = RedisManager(Config.SOCKETIO_MESSAGE_QUEUE, channel='flask-socketio', json=MsgpackCodec)
+    return 'msgpack', options
+
+def packet_size(serializer:str):
+    # Size of the EVENT packet the serializer writes for an emit (the sampled socketio_emitted_bytes_total)
+    from socketio import packet, msgpack_packet
+    packet_class = msgpack_packet.MsgPackPacket if serializer == 'msgpack' else packet.Packet
+    return lambda event, payload: len(packet_class(packet.EVENT, data=[event, payload]).encode())
+
+socketio_serializer, socketio_serializer_options = socketio_options()
+set_emit_size(packet_size(socketio_serializer))
+
 def create_app()->Tuple[Flask,Cache,logging.Logger]:
     app = Flask(__name__)
     app.config.from_object(Config)
+    options = engine_options(Config.SQLALCHEMY_DATABASE_URI)
+    if options is not None:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
     cache = Cache(app=app)
     # Call init_app() method for SQLAlchemy, Flask Login Manager, WebSocket
     cache.init_app(app)
@@ -31,10 +76,11 @@ def create_app()->Tuple[Flask,Cache,logging.Logger]:
     login_manager.init_app(app)
     socketio.init_app(
         app=app,
-        message_queue='redis://redis:6379/1',
+        message_queue=Config.SOCKETIO_MESSAGE_QUEUE or None,
         debug=True,
-        logger=True,
-        engineio_logger=True
+        logger=Config.SOCKETIO_LOGGING,
+        engineio_logger=Config.SOCKETIO_LOGGING,
+        **socketio_serializer_options
     )
     login_manager.login_view = 'main.login'
 
@@ -59,3 +105,16 @@ app, redis_client, logger = create_app()
 
 from .routes import main as main_blueprint
 app.register_blueprint(main_blueprint)
+
+if Config.QUERY_PROFILING:
+    from .query_profiler import install_request_profiling
+    install_request_profiling(app)
+
+if Config.ROLLUP_COMPACTION:
+    from .rollups import compaction_loop
+    socketio.start_background_task(compaction_loop, app, socketio.sleep)
+
+if Config.KPI_STREAMING:
+    from .streaming import start_streaming
+    from .routes import dashboard_poller, alert_poller
+    stream_processor = start_streaming(app, socketio, dashboard_poller, alert_poller)
@@ -0,0 +1,221 @@
+from .dataModel import AlertHistory, db
+from .conditions import NORMAL, SEVERITY, classify, payloads_from_codes
+from .metrics import Counter, registry
+from threading import Lock
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+import time
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Alert state machine for 'patient_notification' (Config.ALERT_TRANSITIONS)
+# =========================================================================
+# Instead of sending the full payload of every flagged device on every tick, the critical-condition poller keeps
+# the message codes (conditions.classify) each notification page shows per device and sends frames only when
+# they change:
+#   alert:     the whole payload (coloured by the committed codes) plus {'type': 'alert', 'device_id'}
+#   clear:     {'type': 'clear', 'device_id', 'device_owner'}: every vital is back to normal, the page drops the patient
+#   heartbeat: {'type': 'heartbeat', 'device_id', 'device_owner', 'values': [temperature, heart rate, SpO2]} every
+#              heartbeat_interval seconds for a device with an active alert, so the page's values stay current
+# Escalations (a vital moving to a worse severity class) are committed on the tick that sees them. Anything
+# else (improving, or another message of the same class) needs hysteresis: the value must sit inside its new
+# class by at least the vital's band, and keep doing so for min_dwell seconds, so a patient hovering around a
+# threshold no longer flips the page on every tick. A computed device without a payload (no reading of its
+# alert window crossed a threshold) proposes all-normal. Every committed change is handed to record(), which
+# keeps the alert_history table.
+
+alert_transitions = registry.register(Counter(
+    'alert_transitions_total', 'Committed alert state changes of the critical-condition poller, by new severity.', ['severity']
+))
+
+Codes = Tuple[int, int, int] # temperature, heart rate and SpO2 message codes
+ALL_NORMAL:Codes = (NORMAL, NORMAL, NORMAL)
+
+class AlertTransition(NamedTuple):
+    device_id:str
+    device_owner:str
+    from_severity:Optional[int] # None: the first state seen for the device
+    to_severity:int
+    codes:Codes
+    values:Tuple[float, float, float]
+
+class DeviceAlert:
+    __slots__ = ('owner', 'codes', 'values', 'candidate', 'since', 'sent')
+
+    def __init__(self, owner:Optional[str], codes:Codes, values:Tuple[float, float, float], now:float):
+        self.owner = owner
+        self.codes = codes # what the notification pages show
+        self.values = values
+        self.candidate:Optional[Codes] = None # an improvement waiting for its dwell time
+        self.since = now
+        self.sent = now # last frame (alert or heartbeat)
+
+def _severity(codes:Codes) -> int:
+    return int(SEVERITY[list(codes)].max())
+
+class AlertStateMachine:
+    """
+    Drop-in for the DeltaTracker of a FleetPoller (snapshot_frames, delta_frames, retain).
+    record(transitions) stores the committed changes (history_recorder); clock is monotonic seconds.
+    """
+
+    def __init__(
+        self,
+        bands:Tuple[float, float, float],
+        min_dwell:float,
+        heartbeat_interval:float,
+        record:Optional[Callable[[List[AlertTransition]], None]]=None,
+        clock:Callable[[], float]=time.monotonic
+    ):
+        self.bands = np.array(bands, dtype=float)
+        self.min_dwell = min_dwell
+        self.heartbeat_interval = heartbeat_interval
+        self.record = record
+        self.clock = clock
+        self.states:Dict[str, DeviceAlert] = {}
+        self.lock = Lock()
+
+    def alert_frames(self, items:List[Tuple[str, DeviceAlert]]) -> Dict[str, dict]:
+        if not items:
+            return {}
+        values = np.array([state.values for _, state in items], dtype=float)
+        codes = np.array([state.codes for _, state in items], dtype=int)
+        batch = payloads_from_codes([state.owner for _, state in items], values[:, 0], values[:, 1], values[:, 2], codes[:, 0], codes[:, 1], codes[:, 2])
+        return {device_id: dict(payload, type='alert', device_id=device_id) for (device_id, _), payload in zip(items, batch)}
+
+    def snapshot_frames(self, device_ids:Iterable[str], load:Callable[[List[str]], Dict[str, dict]]) -> Dict[str, dict]:
+        # Active alerts for a page that just subscribed; devices without a state are loaded but left to the next tick
+        # to observe, so the other pages watching them get their first alert too
+        device_ids = list(device_ids)
+        with self.lock:
+            active = [(device_id, self.states[device_id]) for device_id in device_ids if device_id in self.states and self.states[device_id].codes != ALL_NORMAL]
+            missing = [device_id for device_id in device_ids if device_id not in self.states]
+        frames = self.alert_frames(active)
+        for device_id, payload in (load(missing) if missing else {}).items():
+            frames[device_id] = dict(payload, type='alert', device_id=device_id)
+        return frames
+
+    def delta_frames(self, payloads:Dict[str, dict], computed:Optional[Iterable[str]]=None) -> Dict[str, dict]:
+        """
+        Frames for the devices a tick computed (computed, default: the devices with a payload); payloads holds the
+        flagged ones.
+        """
+        device_ids = list(payloads) if computed is None else list(computed)
+        if not device_ids:
+            return {}
+        flagged = [device_id for device_id in device_ids if device_id in payloads]
+        values = np.array([
+            [payloads[device_id][key]['value'] for key in ('temperature_metadata', 'heartrate_metadata', 'spo2_metadata')]
+            for device_id in flagged
+        ], dtype=float).reshape(-1, 3)
+        # Raw codes, and the codes at the edges of each vital's band
+        raw, low, high = [
+            np.column_stack([codes['temperature_message'], codes['heartrate_message'], codes['spo2_message']]).astype(int).reshape(-1, 3)
+            for codes in (classify(*(values + shift).T) for shift in (0, -self.bands, self.bands))
+        ]
+        observed:Dict[str, Tuple[Codes, Tuple[bool, bool, bool], Optional[Tuple[float, float, float]]]] = {
+            device_id: (tuple(raw[i].tolist()), tuple((low[i] == raw[i]) & (high[i] == raw[i])), tuple(values[i].tolist()))
+            for i, device_id in enumerate(flagged)
+        }
+
+        now = self.clock()
+        frames:Dict[str, dict] = {}
+        alerts:List[Tuple[str, DeviceAlert]] = []
+        transitions:List[AlertTransition] = []
+        with self.lock:
+            for device_id in device_ids:
+                codes, settled, values_seen = observed.get(device_id, (ALL_NORMAL, (True, True, True), None))
+                owner = payloads[device_id]['device_owner'] if device_id in payloads else None
+                state = self.states.get(device_id)
+                if state is None:
+                    # First sight: nothing shown yet, so nothing to hold back
+                    state = self.states[device_id] = DeviceAlert(owner, codes, values_seen or (-1.0, -1.0, -1.0), now)
+                    if codes != ALL_NORMAL:
+                        alerts.append((device_id, state))
+                        transitions.append(AlertTransition(device_id, owner, None, _severity(codes), codes, state.values))
+                    continue
+                state.owner = owner or state.owner
+                if values_seen is not None:
+                    state.values = values_seen
+
+                # Escalations right away; other changes only once settled beyond the band
+                immediate = tuple(new if SEVERITY[new] > SEVERITY[old] else old for old, new in zip(state.codes, codes))
+                target = tuple(new if SEVERITY[new] > SEVERITY[old] or ok else old for old, new, ok in zip(state.codes, codes, settled))
+                if target == immediate:
+                    state.candidate = None
+                    committed = immediate
+                else:
+                    if target != state.candidate:
+                        state.candidate, state.since = target, now
+                    committed = target if now - state.since >= self.min_dwell else immediate
+                    if committed == target:
+                        state.candidate = None
+
+                if committed != state.codes:
+                    transitions.append(AlertTransition(device_id, state.owner, _severity(state.codes), _severity(committed), committed, state.values))
+                    state.codes = committed
+                    state.sent = now
+                    if committed == ALL_NORMAL:
+                        frames[device_id] = {'type': 'clear', 'device_id': device_id, 'device_owner': state.owner}
+                    else:
+                        alerts.append((device_id, state))
+                elif state.codes != ALL_NORMAL and now - state.sent >= self.heartbeat_interval:
+                    state.sent = now
+                    frames[device_id] = {'type': 'heartbeat', 'device_id': device_id, 'device_owner': state.owner, 'values': list(state.values)}
+            frames.update(self.alert_frames(alerts))
+
+        for transition in transitions:
+            alert_transitions.inc(severity=str(transition.to_severity))
+        if transitions and self.record is not None:
+            self.record(transitions)
+        return frames
+
+    @staticmethod
+    def coalesce(queued:dict, newer:dict) -> dict:
+        # A newer frame for a device whose previous frame is still queued (outbound.py): a heartbeat only
+        # refreshes the values of a queued alert, anything else replaces it
+        if newer.get('type') != 'heartbeat' or 'temperature_metadata' not in queued:
+            return newer
+        merged = dict(queued)
+        for key, value in zip(('temperature_metadata', 'heartrate_metadata', 'spo2_metadata'), newer['values']):
+            merged[key] = dict(queued[key], value=value)
+        return merged
+
+    def retain(self, device_ids:Iterable[str]):
+        # Forget devices nobody watches any more; an active alert is sent again on their next tick
+        keep = set(device_ids)
+        with self.lock:
+            for device_id in [device_id for device_id in self.states if device_id not in keep]:
+                del self.states[device_id]
+
+def history_recorder(app) -> Callable[[List[AlertTransition]], None]:
+    # Appends the committed transitions to alert_history; a failed write is logged, the frames still go out
+    def record(transitions:List[AlertTransition]):
+        created_at = datetime.now()
+        with app.app_context():
+            try:
+                db.session.add_all([
+                    AlertHistory(
+                        device_id=transition.device_id,
+                        device_owner=transition.device_owner,
+                        from_severity=transition.from_severity,
+                        to_severity=transition.to_severity,
+                        temperature_code=transition.codes[0],
+                        heart_rate_code=transition.codes[1],
+                        spo2_code=transition.codes[2],
+                        temperature=transition.values[0],
+                        heart_rate=transition.values[1],
+                        spo2=transition.values[2],
+                        created_at=created_at
+                    )
+                    for transition in transitions
+                ])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not record {len(transitions)} alert transitions: {str(e)}")
+            finally:
+                db.session.remove()
+    return record
@@ -0,0 +1,130 @@
+from config import HealthConditions
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+# Critical-condition classification
+# =================================
+# Shared by the database poller (routes.critical_condition_payloads) and the Kafka streaming path (streaming.py),
+# so both emit exactly the same 'patient_notification' payload for the same vitals.
+# Devices are classified as a batch: the vitals are columnar arrays (one entry per device), every threshold of
+# HealthConditions is applied with one vectorized comparison over the whole batch, and np.select picks the
+# colour/message code of each vital by priority (critical before mild before hypothermia before normal).
+
+# Codes index into COLOURS / the message tables below
+NORMAL, MILD, CRITICAL, HYPOTHERMIA = 0, 1, 2, 3
+
+def _colours() -> np.ndarray:
+    critical, mild, hypothermia, normal = HealthConditions.Colours()
+    colours = np.empty(4, dtype=object)
+    colours[[NORMAL, MILD, CRITICAL, HYPOTHERMIA]] = [normal, mild, critical, hypothermia]
+    return colours
+
+def _messages(keys:List[str]) -> np.ndarray:
+    messages = HealthConditions.Messages()
+    table = np.empty(len(keys), dtype=object)
+    table[:] = [messages[key] for key in keys]
+    return table
+
+COLOURS = _colours()
+TEMPERATURE_MESSAGES = _messages(['normal_temp', 'mild_temp', 'critical_temp', 'hypothermia']) # indexed by colour code
+HEART_RATE_MESSAGES = _messages(['normal_hr', 'mild_hr', 'critical_hr', 'below_thresh_hr'])
+SPO2_MESSAGES = _messages(['normal_spo2', 'mild_spo2', 'critical_spo2'])
+BELOW_THRESHOLD = 3 # heart rate message code for a reading under the natural threshold (coloured critical)
+SEVERITY = np.array([NORMAL, MILD, CRITICAL, CRITICAL]) # colour code -> severity class (hypothermia is critical)
+
+def flagged_mask(temperature:np.ndarray, heart_rate:np.ndarray, spo2:np.ndarray) -> np.ndarray:
+    # Readings that make a device show up on the notification page (NaN never flags)
+    _, temp_hypothermi, temp_mild, _ = HealthConditions.Temperature()
+    _, hr_mild, _ = HealthConditions.HeartRate()
+    _, spo2_mild, _ = HealthConditions.SpO2()
+    return (temperature < temp_hypothermi) | (temperature > temp_mild) | (heart_rate >= hr_mild) | (spo2 <= spo2_mild)
+
+def is_flagged(temperature:Optional[float], heart_rate:Optional[int], spo2:Optional[int]) -> bool:
+    vitals = [np.array([np.nan if value is None else float(value)]) for value in (temperature, heart_rate, spo2)]
+    return bool(flagged_mask(*vitals)[0])
+
+def classify(temperature:np.ndarray, heart_rate:np.ndarray, spo2:np.ndarray) -> Dict[str, np.ndarray]:
+    """Colour and message codes of the three vitals for every device of the batch."""
+    temp_normal, temp_hypothermi, temp_mild, temp_critical = HealthConditions.Temperature()
+    hr_natural, hr_mild, hr_critical = HealthConditions.HeartRate()
+    spo2_natural, spo2_mild, spo2_critical = HealthConditions.SpO2()
+
+    critical_temp = temperature >= temp_critical
+    mild_temp = (temperature >= temp_mild) & (temperature < temp_critical)
+    hypothermia = temperature < temp_hypothermi
+    critical_hr = heart_rate >= hr_critical
+    mild_hr = (heart_rate >= hr_mild) & (heart_rate < hr_critical)
+    below_thresh_hr = heart_rate < hr_natural
+    critical_spo2 = spo2 <= spo2_critical
+    mild_spo2 = (spo2 > spo2_critical) & (spo2 <= spo2_mild)
+    normal_spo2 = spo2 > spo2_mild
+
+    spo2_code = np.select([critical_spo2, mild_spo2, normal_spo2], [CRITICAL, MILD, NORMAL], NORMAL)
+    temperature_code = np.select([critical_temp, mild_temp, hypothermia], [CRITICAL, MILD, HYPOTHERMIA], NORMAL)
+    heart_rate_message = np.select([critical_hr, mild_hr, below_thresh_hr], [CRITICAL, MILD, BELOW_THRESHOLD], NORMAL)
+    return {
+        'temperature_colour': temperature_code,
+        'temperature_message': temperature_code,
+        'heartrate_colour': np.where(heart_rate_message == BELOW_THRESHOLD, CRITICAL, heart_rate_message),
+        'heartrate_message': heart_rate_message,
+        'spo2_colour': spo2_code,
+        'spo2_message': spo2_code
+    }
+
+def severity(temperature:np.ndarray, heart_rate:np.ndarray, spo2:np.ndarray) -> np.ndarray:
+    """Severity class (NORMAL, MILD or CRITICAL) per device: the worst colour of its three vitals."""
+    codes = classify(np.asarray(temperature, dtype=float), np.asarray(heart_rate, dtype=float), np.asarray(spo2, dtype=float))
+    return np.maximum.reduce([SEVERITY[codes['temperature_colour']], SEVERITY[codes['heartrate_colour']], SEVERITY[codes['spo2_colour']]])
+
+def device_means(device_ids:Sequence[str], temperature:Sequence, heart_rate:Sequence, spo2:Sequence, missing:float=-1.0) -> 'pd.DataFrame':
+    """
+    Per-device means (rounded to 2 decimals) of columnar readings with a single group-by.
+    Missing vitals count as `missing`, as the per-device averages of monitor_critical_condition always did.
+    """
+    # Only the raw-reading fallback of the alert poller needs pandas; imported here to keep it out of worker startup
+    import pandas as pd
+    frame = pd.DataFrame({
+        'device_id': device_ids,
+        'temperature': pd.to_numeric(pd.Series(temperature, dtype=object), errors='coerce'),
+        'heart_rate': pd.to_numeric(pd.Series(heart_rate, dtype=object), errors='coerce'),
+        'spo2': pd.to_numeric(pd.Series(spo2, dtype=object), errors='coerce')
+    }).fillna({'temperature': missing, 'heart_rate': missing, 'spo2': missing})
+    return frame.groupby('device_id', sort=False).mean().round(2)
+
+def critical_condition_payloads_batch(owner_names:Sequence[str], temperature:np.ndarray, heart_rate:np.ndarray, spo2:np.ndarray) -> List[dict]:
+    temperature = np.asarray(temperature, dtype=float)
+    heart_rate = np.asarray(heart_rate, dtype=float)
+    spo2 = np.asarray(spo2, dtype=float)
+    codes = classify(temperature, heart_rate, spo2)
+    return payloads_from_codes(owner_names, temperature, heart_rate, spo2, codes['temperature_message'], codes['heartrate_message'], codes['spo2_message'])
+
+def payloads_from_codes(
+    owner_names:Sequence[str], temperature:np.ndarray, heart_rate:np.ndarray, spo2:np.ndarray,
+    temperature_code:np.ndarray, heart_rate_code:np.ndarray, spo2_code:np.ndarray
+) -> List[dict]:
+    """Payloads showing the given message codes (e.g. the ones an alert state machine committed to) with the given values."""
+    temperature_code = np.asarray(temperature_code, dtype=int)
+    heart_rate_code = np.asarray(heart_rate_code, dtype=int)
+    spo2_code = np.asarray(spo2_code, dtype=int)
+    columns = zip(
+        owner_names, np.asarray(temperature, dtype=float).tolist(), np.asarray(heart_rate, dtype=float).tolist(), np.asarray(spo2, dtype=float).tolist(),
+        COLOURS[temperature_code].tolist(), TEMPERATURE_MESSAGES[temperature_code].tolist(),
+        COLOURS[np.where(heart_rate_code == BELOW_THRESHOLD, CRITICAL, heart_rate_code)].tolist(), HEART_RATE_MESSAGES[heart_rate_code].tolist(),
+        COLOURS[spo2_code].tolist(), SPO2_MESSAGES[spo2_code].tolist()
+    )
+    # General KPI data (for the circle widget to update colors)
+    return [
+        {
+            'device_owner': owner_name,
+            'temperature_metadata': {"value": temp_value, "color": temp_colour, "message": temp_message},
+            'heartrate_metadata': {"value": hr_value, "color": hr_colour, "message": hr_message},
+            'spo2_metadata': {"value": spo2_value, "color": spo2_colour, "message": spo2_message}
+        }
+        for (
+            owner_name, temp_value, hr_value, spo2_value,
+            temp_colour, temp_message, hr_colour, hr_message, spo2_colour, spo2_message
+        ) in columns
+    ]
+
+def critical_condition_payload(owner_name:str, temperature:float, heart_rate:float, spo2:float) -> dict:
+    return critical_condition_payloads_batch([owner_name], [temperature], [heart_rate], [spo2])[0]
@@ -0,0 +1,111 @@
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Delta protocol for 'update_patient_data'
+# ========================================
+# A dashboard first gets a full snapshot of every device it subscribes to, afterwards only what changed:
+#   snapshot: the whole payload plus {'type': 'snapshot', 'device_id', 'seq'}
+#   delta:    {'type': 'delta', 'device_id', 'device_owner', 'seq', 'base'} plus only the changed parts:
+#             'avg_temp', 'personal_traits', 'medical_history' and/or 'graph' (see graph_delta)
+# Sequence numbers are per device and shared by every room watching it, so a delta is computed once per tick
+# and fanned out as is. A client applies a delta only when 'base' equals the last sequence number it holds;
+# otherwise it asks for a resync ('resync_patient_data') and gets a fresh snapshot.
+# Ticks that change nothing for a device send nothing at all.
+
+SERIES = ('x', 'y_heart_rate', 'y_spo2')
+STATIC_FIELDS = ('avg_temp', 'personal_traits', 'medical_history')
+
+def graph_delta(old:dict, new:dict) -> Optional[dict]:
+    """
+    Change between two graph_data dicts as {'drop', 'keep', 'x', 'y_heart_rate', 'y_spo2'}: the client drops the
+    first `drop` buckets (slid out of the window), keeps the next `keep` and appends the buckets of the delta.
+    None when the series are identical.
+    """
+    old_x, new_x = old['x'], new['x']
+    drop = 0
+    if new_x:
+        while drop < len(old_x) and old_x[drop] < new_x[0]:
+            drop += 1
+    else:
+        drop = len(old_x)
+    keep = 0
+    limit = min(len(old_x) - drop, len(new_x))
+    while keep < limit and all(old[name][drop + keep] == new[name][keep] for name in SERIES):
+        keep += 1
+    if drop == 0 and keep == len(old_x) == len(new_x):
+        return None
+    delta = {'drop': drop, 'keep': keep}
+    for name in SERIES:
+        delta[name] = new[name][keep:]
+    return delta
+
+def apply_graph_delta(graph:dict, delta:dict) -> dict:
+    # What the dashboard page does with a 'graph' delta (used to check the protocol)
+    applied = dict(graph)
+    for name in SERIES:
+        applied[name] = graph[name][delta['drop']:delta['drop'] + delta['keep']] + delta[name]
+    return applied
+
+class DeltaTracker:
+    """Last payload and sequence number sent per device."""
+
+    def __init__(self):
+        self.states:Dict[str, Tuple[int, dict]] = {} # device id -> (seq, payload)
+        self.lock = Lock()
+
+    def snapshot(self, device_id:str) -> Optional[dict]:
+        state = self.states.get(device_id)
+        if state is None:
+            return None
+        seq, payload = state
+        return dict(payload, type='snapshot', device_id=device_id, seq=seq)
+
+    def snapshot_frames(self, device_ids:Iterable[str], load:Callable[[List[str]], Dict[str, dict]]) -> Dict[str, dict]:
+        # Snapshots of the state the next deltas are based on; devices without a state are loaded first
+        device_ids = list(device_ids)
+        with self.lock:
+            missing = [device_id for device_id in device_ids if device_id not in self.states]
+        loaded = load(missing) if missing else {}
+        with self.lock:
+            for device_id, payload in loaded.items():
+                if device_id not in self.states: # a tick may have got there first
+                    self.states[device_id] = (1, payload)
+            return {device_id: self.snapshot(device_id) for device_id in device_ids if device_id in self.states}
+
+    def delta_frames(self, payloads:Dict[str, dict], computed:Optional[Iterable[str]]=None) -> Dict[str, dict]:
+        """Frames for freshly computed payloads: a snapshot for new devices, a delta for changed ones (computed is unused)."""
+        frames:Dict[str, dict] = {}
+        with self.lock:
+            for device_id, payload in payloads.items():
+                state = self.states.get(device_id)
+                if state is None:
+                    self.states[device_id] = (1, payload)
+                    frames[device_id] = self.snapshot(device_id)
+                    continue
+                seq, previous = state
+                changes = {field: payload[field] for field in STATIC_FIELDS if payload[field] != previous[field]}
+                graph = graph_delta(previous['graph_data'], payload['graph_data'])
+                if graph is not None:
+                    changes['graph'] = graph
+                if not changes:
+                    continue
+                self.states[device_id] = (seq + 1, payload)
+                frames[device_id] = dict(
+                    changes, type='delta', device_id=device_id, device_owner=payload['device_owner'], seq=seq + 1, base=seq
+                )
+        return frames
+
+    def coalesce(self, queued:dict, newer:dict) -> dict:
+        # A newer frame for a device whose previous frame is still queued (outbound.py): the page never saw the
+        # queued one, so a delta becomes the snapshot of the current state
+        if newer['type'] == 'snapshot':
+            return newer
+        with self.lock:
+            return self.snapshot(newer['device_id']) or newer
+
+    def retain(self, device_ids:Iterable[str]):
+        # Forget devices nobody watches any more; they start over with a snapshot
+        keep = set(device_ids)
+        with self.lock:
+            for device_id in [device_id for device_id in self.states if device_id not in keep]:
+                del self.states[device_id]
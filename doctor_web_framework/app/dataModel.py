@@ -43,12 +43,95 @@ class Owner(db.Model):
 
 class DeviceRecords(db.Model):
     __tablename__ = 'health_data_records'
+    __table_args__ = (
+        # Serves the per-device freshness range scans of the KPI and alert loops; unique, so that redelivered
+        # readings are skipped by the ingest worker's upserts (postgres/migrations/003)
+        db.Index('ix_health_data_records_device_id_timestamp', 'device_id', 'timestamp', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     device_id = db.Column(db.String(50), db.ForeignKey('devices.device_id'))
     heart_rate = db.Column(db.Integer)
     temperature = db.Column(db.Numeric(precision=10, scale=2), nullable=False)
     spo2 = db.Column(db.Integer)
-    timestamp = db.Column(db.String(20))
+    timestamp = db.Column(db.DateTime)
+
+class RollupColumns:
+    # Pre-aggregated readings of one device over one bucket (min/max/sum/count per vital; mean = sum / count)
+    device_id = db.Column(db.String(50), primary_key=True)
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    readings = db.Column(db.Integer, nullable=False)
+    hr_min = db.Column(db.Integer)
+    hr_max = db.Column(db.Integer)
+    hr_sum = db.Column(db.BigInteger)
+    hr_count = db.Column(db.Integer)
+    spo2_min = db.Column(db.Integer)
+    spo2_max = db.Column(db.Integer)
+    spo2_sum = db.Column(db.BigInteger)
+    spo2_count = db.Column(db.Integer)
+    temp_min = db.Column(db.Numeric)
+    temp_max = db.Column(db.Numeric)
+    temp_sum = db.Column(db.Numeric) # unscaled, so rollup sums stay exact
+    temp_count = db.Column(db.Integer)
+
+    @property
+    def hr_mean(self):
+        return self.hr_sum / self.hr_count if self.hr_count else None
+
+    @property
+    def spo2_mean(self):
+        return self.spo2_sum / self.spo2_count if self.spo2_count else None
+
+    @property
+    def temp_mean(self):
+        return self.temp_sum / self.temp_count if self.temp_count else None
+
+class DeviceRollup1m(RollupColumns, db.Model):
+    __tablename__ = 'health_data_rollup_1m'
+
+class DeviceRollup2m(RollupColumns, db.Model):
+    __tablename__ = 'health_data_rollup_2m'
+
+class RollupWatermark(db.Model):
+    # Every bucket that ends at or before compacted_until is final in the rollup table
+    __tablename__ = 'rollup_watermarks'
+    rollup_table = db.Column(db.String(50), primary_key=True)
+    compacted_until = db.Column(db.DateTime, nullable=False)
+    compacted_id = db.Column(db.BigInteger) # highest health_data_records id folded in; later ones may be late readings
+
+class DeviceLatestState(db.Model):
+    # One row per device, upserted by the ingest worker with every batch of its readings (app/latest_state.py)
+    __tablename__ = 'device_latest_state'
+    device_id = db.Column(db.String(50), primary_key=True)
+    last_timestamp = db.Column(db.DateTime, nullable=False) # the last reading
+    heart_rate = db.Column(db.Integer)
+    temperature = db.Column(db.Numeric(precision=10, scale=2))
+    spo2 = db.Column(db.Integer)
+    window_readings = db.Column(db.Integer, nullable=False) # readings in the alert window ending at the last one
+    temp_mean = db.Column(db.Float)
+    hr_mean = db.Column(db.Float)
+    spo2_mean = db.Column(db.Float)
+    severity = db.Column(db.SmallInteger, nullable=False) # conditions.NORMAL / MILD / CRITICAL of the means
+    flagged_until = db.Column(db.DateTime) # the last reading that crossed a notification threshold
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+class AlertHistory(db.Model):
+    # Committed changes of the critical-condition alert state machine (app/alert_state.py)
+    __tablename__ = 'alert_history'
+    __table_args__ = (
+        db.Index('ix_alert_history_device_id', 'device_id', 'created_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(50), nullable=False)
+    device_owner = db.Column(db.String(100)) # owner name shown on the notification page
+    from_severity = db.Column(db.SmallInteger) # conditions.NORMAL / MILD / CRITICAL, NULL for the first state seen
+    to_severity = db.Column(db.SmallInteger, nullable=False)
+    temperature_code = db.Column(db.SmallInteger, nullable=False) # conditions message codes now shown
+    heart_rate_code = db.Column(db.SmallInteger, nullable=False)
+    spo2_code = db.Column(db.SmallInteger, nullable=False)
+    temperature = db.Column(db.Float) # the alert-window means at the change
+    heart_rate = db.Column(db.Float)
+    spo2 = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, nullable=False)
 
 class PatientMessage(db.Model):
     __tablename__ = 'patient_messages'
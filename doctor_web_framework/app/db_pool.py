@@ -0,0 +1,112 @@
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from collections import deque
+from threading import Lock
+from typing import Dict, Optional
+from config import Config
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cooperative Postgres access under gevent
+# ========================================
+# psycopg2 is a C driver: monkey.patch_all() does not reach its sockets, so every query used to block the
+# whole gevent hub (every doctor's Socket.IO traffic, the pollers, the stream consumer) until Postgres answered.
+# With a wait callback installed psycopg2 runs each query in non-blocking mode and hands the socket back to
+# the callback whenever it would block; the callback yields to the hub with gevent's wait_read/wait_write.
+# This is the callback psycogreen ships (psycogreen.gevent.patch_psycopg), kept here to avoid the dependency.
+#
+# Connections come from a QueuePool sized for greenlet concurrency (Config.DB_POOL_SIZE + DB_MAX_OVERFLOW).
+# Its queue waits on threading primitives, which are cooperative after monkey.patch_all(), so a greenlet
+# waiting for a connection does not block the others either. The time spent waiting for a connection is
+# recorded (pool_stats) and checkouts slower than Config.DB_POOL_SLOW_CHECKOUT are logged.
+
+def gevent_wait_callback(conn, timeout=None):
+    from gevent.socket import wait_read, wait_write
+    import psycopg2
+    from psycopg2 import extensions
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+def make_psycopg_green():
+    from psycopg2 import extensions
+    extensions.set_wait_callback(gevent_wait_callback)
+
+class PoolStats:
+    """Connection checkout wait times of the pool (last max_samples checkouts for the percentiles)."""
+
+    def __init__(self, max_samples:int=10000):
+        self.samples:deque = deque(maxlen=max_samples)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.lock = Lock()
+
+    def record(self, seconds:float, timed_out:bool=False):
+        with self.lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            self.samples.append(seconds)
+
+    def report(self) -> Dict[str, float]:
+        with self.lock:
+            ordered = sorted(self.samples)
+            def percentile(p:float) -> float:
+                return round(1000 * ordered[min(len(ordered) - 1, int(p * len(ordered)))], 2) if ordered else 0.0
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'mean_wait_ms': round(1000 * self.total_wait / self.checkouts, 2) if self.checkouts else 0.0,
+                'p50_wait_ms': percentile(0.50),
+                'p99_wait_ms': percentile(0.99),
+                'max_wait_ms': round(1000 * self.max_wait, 2)
+            }
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.checkouts = self.timeouts = 0
+            self.total_wait = self.max_wait = 0.0
+
+pool_stats = PoolStats()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            pool_stats.record(waited, timed_out)
+            if waited >= Config.DB_POOL_SLOW_CHECKOUT:
+                logger.warning(f"Waited {1000 * waited:.0f} ms for a database connection ({self.status()})")
+
+def engine_options(uri:str) -> Optional[dict]:
+    # SQLALCHEMY_ENGINE_OPTIONS for Postgres; other databases (e.g. SQLite for the benchmarks) keep the defaults
+    if not uri.startswith('postgresql'):
+        return None
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': Config.DB_POOL_SIZE,
+        'max_overflow': Config.DB_MAX_OVERFLOW,
+        'pool_timeout': Config.DB_POOL_TIMEOUT,
+        'pool_pre_ping': True
+    }
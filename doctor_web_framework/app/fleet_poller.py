@@ -0,0 +1,204 @@
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Set
+from .dashboard_delta import DeltaTracker
+from .tick_scheduler import TickScheduler
+from .task_registry import LocalRegistry
+from .metrics import count_queries, poller_stage_seconds, poller_tick_queries, poller_tick_seconds, record_emits
+from .query_profiler import profile
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fleet-wide pollers
+# ==================
+# One polling loop per kind of update (dashboard KPIs, critical-condition alerts) instead of one loop per doctor.
+# Every tick computes the payload of each watched device exactly once and fans it out to the Socket.IO room
+# of every doctor subscribed to that device. Devices are de-duplicated across subscriptions, so a device
+# shared by several doctors is queried once and a device nobody watches is not computed at all.
+# The loop is started on the first subscription and exits by itself when the last one goes away.
+# With a DeltaTracker (dashboard_delta.py) subscribers get one snapshot and afterwards only the changes; with an
+# AlertStateMachine (alert_state.py) only alert state transitions and heartbeats.
+# Subscriptions live in a registry (task_registry.py): in-process by default, or in Redis, where the loops of
+# all workers share them and only the lease holder computes ticks and immediate pushes.
+# With a TickScheduler (tick_scheduler.py) a tick only recomputes the devices that are due by their severity.
+
+class FleetPoller:
+    """
+    compute(device_ids) must return {device_id: payload} for the devices that have something to report.
+    emit(event, payload, room) sends one payload to one room; emit_batch(event, payloads, room), when given, sends
+    all payloads of a tick (or push) for one room at once instead.
+    lookup(device_ids), when given, serves push_now (e.g. from a cache); ticks always call compute.
+    delta, when given, turns the payloads into sequence-numbered snapshot/delta frames (DeltaTracker) or into
+    transition-only alert frames (alert_state.AlertStateMachine).
+    registry holds the subscriptions and decides which worker leads (LocalRegistry: this one).
+    scheduler, when given, picks the devices of each tick and the loop wakes up at its granularity instead of interval.
+    """
+
+    def __init__(
+        self,
+        name:str,
+        event:str,
+        interval:float,
+        compute:Callable[[List[str]], Dict[str, dict]],
+        emit:Callable[[str, dict, str], None],
+        start_task:Callable,
+        sleep:Callable[[float], None],
+        polling:bool=True,
+        lookup:Optional[Callable[[List[str]], Dict[str, dict]]]=None,
+        delta:Optional[DeltaTracker]=None,
+        registry=None,
+        request_poll:float=0.25,
+        scheduler:Optional[TickScheduler]=None,
+        emit_batch:Optional[Callable[[str, List[dict], str], None]]=None
+    ):
+        self.name = name
+        self.event = event
+        self.interval = interval
+        self.compute = compute
+        self.emit = emit
+        self.start_task = start_task
+        self.sleep = sleep
+        self.polling = polling # False: subscriptions only (e.g. fed by the Kafka stream), no polling loop
+        self.lookup = lookup or compute
+        self.delta = delta
+        self.registry = registry or LocalRegistry()
+        self.request_poll = request_poll # how often a leader checks for push requests of other workers
+        self.scheduler = scheduler
+        self.emit_batch = emit_batch
+        self.lock = Lock()
+        self.running = False
+        self.leading = False
+        self.ticks = 0
+
+    def subscribe(self, room:str, device_ids:Iterable[str], sid:Optional[str]=None):
+        # Replaces the room's previous subscription
+        device_ids = set(device_ids)
+        if not device_ids:
+            self.registry.unsubscribe(room)
+            return
+        self.registry.subscribe(room, device_ids, sid)
+        with self.lock:
+            if self.polling and not self.running:
+                self.running = True
+                self.start_task(self.run)
+                logger.info(f"{self.name} poller started")
+
+    def unsubscribe(self, room:str, sid:Optional[str]=None):
+        # With a sid, only the subscription created by that connection is dropped (a newer tab may own the room)
+        self.registry.unsubscribe(room, sid)
+
+    def unsubscribe_sid(self, sid:str):
+        self.registry.unsubscribe_sid(sid)
+
+    def snapshot(self) -> Dict[str, Set[str]]:
+        return self.registry.subscriptions()
+
+    def watched(self, subscriptions:Optional[Dict[str, Set[str]]]=None) -> List[str]:
+        subscriptions = self.snapshot() if subscriptions is None else subscriptions
+        return list(set().union(*subscriptions.values()))
+
+    def fan_out(self, payloads:Dict[str, dict], rooms:Optional[List[str]]=None, subscriptions:Optional[Dict[str, Set[str]]]=None) -> int:
+        subscriptions = self.snapshot() if subscriptions is None else subscriptions
+        targets = {room: subscriptions.get(room, set()) for room in (rooms if rooms is not None else subscriptions)}
+        emits:Dict[str, int] = {} # device id -> rooms its payload went to
+        for room, device_ids in targets.items():
+            batch = []
+            for device_id in device_ids:
+                payload = payloads.get(device_id)
+                if payload is not None:
+                    if self.emit_batch is None:
+                        self.emit(self.event, payload, room)
+                    else:
+                        batch.append(payload)
+                    emits[device_id] = emits.get(device_id, 0) + 1
+            if batch:
+                self.emit_batch(self.event, batch, room)
+        for device_id, count in emits.items():
+            record_emits(self.event, payloads[device_id], count)
+        return sum(emits.values())
+
+    def frames(self, payloads:Dict[str, dict], computed:Optional[Iterable[str]]=None) -> Dict[str, dict]:
+        # What a tick sends for freshly computed payloads (also used by the Kafka stream);
+        # computed: every device that was computed, including those without a payload
+        if self.delta is None:
+            return payloads
+        return self.delta.delta_frames(payloads, computed)
+
+    def snapshots(self, device_ids:List[str]) -> Dict[str, dict]:
+        if self.delta is None:
+            return self.lookup(device_ids)
+        return self.delta.snapshot_frames(device_ids, self.lookup)
+
+    def tick(self) -> int:
+        subscriptions = self.snapshot()
+        device_ids = self.watched(subscriptions)
+        if self.delta is not None:
+            self.delta.retain(device_ids)
+        if not device_ids:
+            return 0
+        if self.scheduler is not None:
+            self.scheduler.sync(device_ids)
+            device_ids = self.scheduler.due()
+            if not device_ids:
+                return 0
+        self.ticks += 1
+        with poller_tick_seconds.time(poller=self.name):
+            with count_queries() as queries, profile(f'{self.name} tick'), poller_stage_seconds.time(poller=self.name, stage='compute'):
+                payloads = self.compute(device_ids)
+                if self.scheduler is not None:
+                    self.scheduler.observe(device_ids, payloads)
+                frames = self.frames(payloads, device_ids)
+            poller_tick_queries.observe(queries[0], poller=self.name)
+            with poller_stage_seconds.time(poller=self.name, stage='emit'):
+                return self.fan_out(frames, subscriptions=subscriptions)
+
+    def push_now(self, room:str, device_ids:Optional[Iterable[str]]=None):
+        # Immediate full update for a single room (all its devices, or the given ones for a resync),
+        # so a new subscriber does not wait for the next tick. Another worker leading the poller sends it.
+        if self.polling and not self.registry.lead():
+            self.registry.request_push(room, None if device_ids is None else list(device_ids))
+            return
+        self._push(room, device_ids)
+
+    def _push(self, room:str, device_ids:Optional[Iterable[str]]=None):
+        watched = self.registry.room_devices(room)
+        targets = list(watched if device_ids is None else watched & set(device_ids))
+        if targets:
+            self.fan_out(self.snapshots(targets), [room], {room: watched})
+
+    def run(self):
+        try:
+            next_tick = time.monotonic()
+            while True:
+                with self.lock:
+                    if not self.snapshot():
+                        self.running = False
+                        self.leading = False
+                        self.registry.release()
+                        logger.info(f"{self.name} poller stopped, no subscribers left")
+                        return
+                try:
+                    self.registry.heartbeat()
+                    leading = self.registry.lead()
+                    if leading and not self.leading and self.registry.shared and self.delta is not None:
+                        # Frames sent by other leaders meanwhile make this worker's sequence numbers stale
+                        self.delta.retain([])
+                    self.leading = leading
+                    if leading:
+                        for room, device_ids in self.registry.drain_push_requests():
+                            self._push(room, device_ids)
+                        if time.monotonic() >= next_tick:
+                            next_tick = time.monotonic() + (self.scheduler.granularity if self.scheduler is not None else self.interval)
+                            self.tick()
+                except Exception as e:
+                    logger.error(f"Error in {self.name} poller: {str(e)}")
+                # With a shared registry, wake up often enough to serve push requests (leader) or take over (followers)
+                wait = max(0.0, next_tick - time.monotonic())
+                if self.registry.shared:
+                    wait = min(self.request_poll, wait) if self.leading else self.request_poll
+                self.sleep(wait)
+        except BaseException:
+            with self.lock:
+                self.running = False
+            raise
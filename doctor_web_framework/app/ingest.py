@@ -0,0 +1,268 @@
+from .streaming import HealthRecord, decode_health_record, memory_broker
+from .rolling_window import EPOCH
+from .dataModel import DeviceLatestState, DeviceRecords
+from .latest_state import LatestStateTracker, STATE_COLUMNS, seed_from
+from config import Config
+from collections import Counter, namedtuple
+from datetime import timedelta
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy.dialects import postgresql, sqlite
+import io
+import struct
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Bulk ingest worker (ingest.py)
+# ==============================
+# Replaces the JDBC sink connector (one task, one INSERT per record, duplicates on every redelivery).
+# Each worker process is a member of the Config.INGEST_GROUP consumer group, so Kafka spreads the partitions
+# of health-data-records over the processes and they write in parallel. A worker decodes the Avro HealthRecords
+# into a batch and writes the batch in one transaction:
+#   - Postgres: COPY into a temporary staging table, then INSERT ... SELECT ... ON CONFLICT DO NOTHING
+#   - other databases (SQLite for the benchmarks): INSERT ... ON CONFLICT DO NOTHING, executemany in chunks
+# keyed on the unique (device_id, "timestamp") index (postgres/migrations/003). The step that allocates the ids
+# (the merge into health_data_records) and the commit run under a transaction-level advisory lock shared by all
+# workers, so ids become visible in the order they were allocated: the KPI engine fetches readings above a
+# high-water mark id (rolling_window.py, kpi_cache.py) and would otherwise never see a batch whose lower ids
+# commit after a higher id was read. Decoding, the COPY into staging and the device_latest_state upsert stay
+# parallel. Offsets are committed only after the transaction committed, so a crash or a failed write replays the
+# batch and the upsert skips the readings that were already stored. The same transaction upserts the
+# device_latest_state rows of the devices in the batch (latest_state.py, postgres/migrations/004).
+
+try:
+    from confluent_kafka import TopicPartition
+except ImportError: # the in-memory broker only needs the same three fields
+    TopicPartition = namedtuple('TopicPartition', ('topic', 'partition', 'offset'))
+
+IngestRow = Tuple[str, int, Decimal, int, object] # device_id, heart_rate, temperature, spo2, timestamp (naive UTC)
+COLUMNS = ('device_id', 'heart_rate', 'temperature', 'spo2', 'timestamp')
+
+def ingest_row(record:HealthRecord) -> IngestRow:
+    device_id, heart_rate, temperature, spo2, timestamp_ms = record
+    return device_id, heart_rate, Decimal(str(temperature)), spo2, EPOCH + timedelta(milliseconds=timestamp_ms)
+
+# Writers
+# =======
+
+CREATE_STAGING = """
+CREATE TEMPORARY TABLE IF NOT EXISTS ingest_staging (
+    device_id VARCHAR(50), heart_rate INTEGER, temperature NUMERIC, spo2 INTEGER, "timestamp" TIMESTAMP
+) ON COMMIT DELETE ROWS
+"""
+COPY_STAGING = 'COPY ingest_staging (device_id, heart_rate, temperature, spo2, "timestamp") FROM STDIN'
+# Held from id allocation to commit (released with the transaction): ids become visible in allocation order
+ID_ORDER_LOCK_KEY = 1751413248 # any key no other advisory lock of the database uses
+ID_ORDER_LOCK = f'SELECT pg_advisory_xact_lock({ID_ORDER_LOCK_KEY})'
+MERGE_STAGING = """
+INSERT INTO health_data_records (device_id, heart_rate, temperature, spo2, "timestamp")
+SELECT device_id, heart_rate, temperature, spo2, "timestamp" FROM ingest_staging
+ON CONFLICT (device_id, "timestamp") DO NOTHING
+"""
+# A row is only replaced by the state of a newer reading (e.g. not by a worker that lost the partition meanwhile)
+UPSERT_LATEST_STATE = f"""
+INSERT INTO device_latest_state ({', '.join(STATE_COLUMNS)}) VALUES %s
+ON CONFLICT (device_id) DO UPDATE SET {', '.join(f'{column} = EXCLUDED.{column}' for column in STATE_COLUMNS[1:])}
+WHERE device_latest_state.last_timestamp <= EXCLUDED.last_timestamp
+"""
+
+def _copy_text(value) -> str:
+    # COPY text format: backslash escapes for the separators
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+class CopyWriter:
+    """Postgres: COPY the batch into a per-connection staging table and merge it into health_data_records."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def write(self, rows:List[IngestRow], states:Optional[List[tuple]]=None) -> int:
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(map(_copy_text, row)) + '\n')
+        buffer.seek(0)
+        connection = self.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(CREATE_STAGING)
+                cursor.copy_expert(COPY_STAGING, buffer)
+                if states:
+                    from psycopg2.extras import execute_values
+                    execute_values(cursor, UPSERT_LATEST_STATE, states, page_size=1000)
+                cursor.execute(ID_ORDER_LOCK)
+                cursor.execute(MERGE_STAGING)
+                inserted = cursor.rowcount
+            connection.commit()
+            return inserted
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+class UpsertWriter:
+    """
+    Any database with INSERT ... ON CONFLICT: the batch is upserted in one transaction, chunk_size rows per
+    executemany (one compiled statement, the driver batches the parameters; rowcount sums the inserted rows).
+    """
+
+    def __init__(self, engine, chunk_size:int=1000):
+        self.engine = engine
+        self.chunk_size = chunk_size
+        dialect_insert = postgresql.insert if engine.dialect.name == 'postgresql' else sqlite.insert
+        self.statement = dialect_insert(DeviceRecords.__table__).on_conflict_do_nothing(index_elements=['device_id', 'timestamp'])
+        state = dialect_insert(DeviceLatestState.__table__)
+        self.state_statement = state.on_conflict_do_update(
+            index_elements=['device_id'],
+            set_={column: state.excluded[column] for column in STATE_COLUMNS[1:]},
+            where=DeviceLatestState.__table__.c.last_timestamp <= state.excluded.last_timestamp
+        )
+
+    def write(self, rows:List[IngestRow], states:Optional[List[tuple]]=None) -> int:
+        inserted = 0
+        with self.engine.begin() as conn:
+            for start in range(0, len(states or ()), self.chunk_size):
+                conn.execute(self.state_statement, [dict(zip(STATE_COLUMNS, state)) for state in states[start:start + self.chunk_size]])
+            if self.engine.dialect.name == 'postgresql': # SQLite runs one write transaction at a time anyway
+                conn.exec_driver_sql(ID_ORDER_LOCK)
+            for start in range(0, len(rows), self.chunk_size):
+                chunk = [dict(zip(COLUMNS, row)) for row in rows[start:start + self.chunk_size]]
+                inserted += conn.execute(self.statement, chunk).rowcount
+        return inserted
+
+def writer_for(engine):
+    return CopyWriter(engine) if engine.dialect.name == 'postgresql' else UpsertWriter(engine)
+
+# Worker
+# ======
+
+class IngestWorker:
+    """
+    consumer is a confluent_kafka Consumer (or the in-memory FakeConsumer), writer.write(rows) stores a batch
+    durably and returns the number of new rows. A batch is written once it holds batch_size rows or its
+    oldest row waited flush_interval seconds.
+    tracker, when given, keeps the latest state of the ingested devices; their rows are written with each batch.
+    """
+
+    def __init__(self, consumer, writer, batch_size:int, flush_interval:float, clock:Callable[[], float]=time.monotonic, tracker:Optional[LatestStateTracker]=None):
+        self.consumer = consumer
+        self.writer = writer
+        self.tracker = tracker
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.rows:List[IngestRow] = []
+        self.offsets:Dict[Tuple[str, int], int] = {} # (topic, partition) -> next offset to commit
+        self.batch_started:Optional[float] = None
+        self.stats:Counter = Counter()
+
+    def handle(self, message):
+        if message.error():
+            logger.error(f"Kafka consumer error: {message.error()}")
+            return
+        if self.batch_started is None:
+            self.batch_started = self.clock()
+        # Undecodable messages are skipped, but their offsets are committed with the batch
+        self.offsets[(message.topic(), message.partition())] = message.offset() + 1
+        self.stats['messages'] += 1
+        try:
+            self.rows.append(ingest_row(decode_health_record(message.value())))
+        except (ValueError, IndexError, struct.error) as e:
+            self.stats['undecodable'] += 1
+            logger.error(f"Skipping undecodable message at offset {message.offset()}: {str(e)}")
+
+    def due(self) -> bool:
+        if len(self.rows) >= self.batch_size:
+            return True
+        return self.batch_started is not None and self.clock() - self.batch_started >= self.flush_interval
+
+    def flush(self) -> int:
+        """Writes the batch, then commits its offsets. Returns the number of new rows."""
+        if not self.offsets:
+            return 0
+        if self.rows:
+            # Folding is idempotent (readings are keyed by timestamp), so a failed write can simply be retried
+            states = self.tracker.fold(self.rows) if self.tracker is not None else None
+            inserted = self.writer.write(self.rows, states)
+        else:
+            inserted = 0
+        self.consumer.commit(
+            offsets=[TopicPartition(topic, partition, offset) for (topic, partition), offset in self.offsets.items()],
+            asynchronous=False
+        )
+        self.stats['batches'] += 1
+        self.stats['rows'] += inserted
+        self.stats['duplicates'] += len(self.rows) - inserted
+        self.discard()
+        return inserted
+
+    def discard(self):
+        self.rows = []
+        self.offsets = {}
+        self.batch_started = None
+
+    def revoked(self, consumer, partitions):
+        # Rebalance: write what was read so far; if that fails the new owners replay it from the committed offsets
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Dropping an unwritten batch of {len(self.rows)} rows on rebalance: {str(e)}")
+            self.discard()
+        if self.tracker is not None:
+            self.tracker.clear()
+
+def ingest_consumer(on_revoke=None):
+    if Config.KAFKA_BOOTSTRAP_SERVERS == 'memory://':
+        consumer = memory_broker.consumer()
+    else:
+        from confluent_kafka import Consumer
+        consumer = Consumer({
+            'bootstrap.servers': Config.KAFKA_BOOTSTRAP_SERVERS,
+            'group.id': Config.INGEST_GROUP,
+            'auto.offset.reset': 'earliest', # a new group stores everything still retained in the topic
+            'enable.auto.commit': False # offsets are committed by IngestWorker.flush after the write
+        })
+    if on_revoke is None:
+        consumer.subscribe([Config.KAFKA_TOPIC])
+    else:
+        consumer.subscribe([Config.KAFKA_TOPIC], on_revoke=on_revoke)
+    return consumer
+
+def ingest_loop(worker:IngestWorker, sleep:Callable[[float], None]=time.sleep, stop:Callable[[], bool]=lambda: False):
+    backoff = 0.5
+    last_report = time.monotonic()
+    reported = Counter()
+    while not stop():
+        if worker.due():
+            try:
+                worker.flush()
+                backoff = 0.5
+            except Exception as e:
+                # Keep the batch and its offsets and stop reading until the database takes it
+                logger.error(f"Writing a batch of {len(worker.rows)} rows failed, retrying in {backoff:.1f} s: {str(e)}")
+                sleep(backoff)
+                backoff = min(2 * backoff, 30.0)
+                continue
+        for message in worker.consumer.consume(max(1, worker.batch_size - len(worker.rows)), Config.INGEST_POLL_TIMEOUT):
+            worker.handle(message)
+        if time.monotonic() - last_report >= Config.INGEST_STATS_LOG_INTERVAL:
+            elapsed = time.monotonic() - last_report
+            recent = worker.stats - reported
+            logger.info(f"Ingested {recent['rows'] / elapsed:.0f} rows/s ({dict(recent)})")
+            reported = Counter(worker.stats)
+            last_report = time.monotonic()
+    worker.flush()
+
+def run_ingest(app, db):
+    with app.app_context():
+        engine = db.engine
+    tracker = LatestStateTracker(timedelta(minutes=Config.ALERT_WINDOW_MINUTES), seed_from(engine))
+    worker = IngestWorker(None, writer_for(engine), Config.INGEST_BATCH_SIZE, Config.INGEST_FLUSH_INTERVAL, tracker=tracker)
+    worker.consumer = ingest_consumer(on_revoke=worker.revoked)
+    logger.info(f"Ingest worker started ({type(worker.writer).__name__}, batches of {worker.batch_size} rows)")
+    try:
+        ingest_loop(worker)
+    finally:
+        worker.consumer.close()
@@ -0,0 +1,132 @@
+from threading import Lock
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Two-level KPI cache
+# ===================
+# Dashboard payloads are cached per device in two levels:
+#   L1: a bounded in-process LRU with a TTL (no round trip at all)
+#   L2: Redis through Flask-Caching, shared by every worker process
+# Entries are versioned by the id of the latest reading folded into them. Redis holds the immutable entry under
+# kpi:<device_id>:<reading id> plus a pointer kpi:<device_id> to the newest version. A lookup may pass the
+# latest reading id the process already knows about (e.g. the high-water mark of the rolling window); an entry
+# older than that is stale and counts as a miss. Windows that slide without new readings expire with the TTL.
+
+Entry = Tuple[int, dict] # latest reading id, payload
+
+def pointer_key(device_id:str) -> str:
+    return f'kpi:{device_id}'
+
+def entry_key(device_id:str, version:int) -> str:
+    return f'kpi:{device_id}:{version}'
+
+class LruTtlCache:
+    """Bounded LRU map whose entries also expire `ttl` seconds after they were written."""
+
+    def __init__(self, max_entries:int, ttl:float, stats:Counter, clock:Callable[[], float]=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = stats
+        self.clock = clock
+        self.entries:OrderedDict = OrderedDict() # key -> (expires_at, value)
+
+    def get(self, key):
+        item = self.entries.get(key)
+        if item is None:
+            return None
+        if item[0] <= self.clock():
+            del self.entries[key]
+            self.stats['expirations'] += 1
+            return None
+        self.entries.move_to_end(key)
+        return item[1]
+
+    def set(self, key, value):
+        self.entries[key] = (self.clock() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+class KpiCache:
+    """
+    backend is the Flask-Caching client (get_many(*keys) / set_many(mapping, timeout)); it is passed per call,
+    like the redis_conn argument of the KPI engine.
+    """
+
+    def __init__(self, max_entries:int, ttl:int, clock:Callable[[], float]=time.monotonic):
+        self.ttl = ttl
+        self.counters:Counter = Counter()
+        self.local = LruTtlCache(max_entries, ttl, self.counters, clock)
+        self.lock = Lock()
+
+    def lookup(self, backend, device_ids:Iterable[str], latest:Optional[Dict[str, int]]=None) -> Dict[str, dict]:
+        """Payloads of the devices with a fresh entry; at most two backend round trips whatever the number of devices."""
+        latest = latest or {}
+        found:Dict[str, dict] = {}
+        remote:List[str] = []
+        with self.lock:
+            for device_id in device_ids:
+                entry:Optional[Entry] = self.local.get(device_id)
+                if entry is not None and entry[0] >= latest.get(device_id, 0):
+                    found[device_id] = entry[1]
+                    self.counters['l1_hits'] += 1
+                else:
+                    remote.append(device_id)
+        if not remote:
+            return found
+
+        try:
+            versions = dict(zip(remote, backend.get_many(*[pointer_key(device_id) for device_id in remote])))
+            current = [(device_id, version) for device_id, version in versions.items() if version is not None and version >= latest.get(device_id, 0)]
+            payloads = backend.get_many(*[entry_key(device_id, version) for device_id, version in current]) if current else []
+        except Exception as e:
+            logger.error(f"KPI cache lookup failed: {str(e)}")
+            current, payloads = [], []
+
+        hits = 0
+        with self.lock:
+            for (device_id, version), payload in zip(current, payloads):
+                if payload is not None:
+                    found[device_id] = payload
+                    self.local.set(device_id, (version, payload))
+                    hits += 1
+            self.counters['l2_hits'] += hits
+            self.counters['misses'] += len(remote) - hits
+        return found
+
+    def store(self, backend, entries:Dict[str, Entry]):
+        """Writes {device_id: (latest reading id, payload)} to both levels, one backend round trip."""
+        if not entries:
+            return
+        mapping:dict = {}
+        with self.lock:
+            for device_id, (version, payload) in entries.items():
+                self.local.set(device_id, (version, payload))
+                mapping[pointer_key(device_id)] = version
+                mapping[entry_key(device_id, version)] = payload
+            self.counters['stores'] += len(entries)
+        try:
+            backend.set_many(mapping, timeout=self.ttl)
+        except Exception as e:
+            logger.error(f"KPI cache write failed: {str(e)}")
+
+    def clear(self):
+        with self.lock:
+            self.local.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            stats = {key: self.counters[key] for key in ('l1_hits', 'l2_hits', 'misses', 'evictions', 'expirations', 'stores')}
+            stats['l1_entries'] = len(self.local)
+        return stats
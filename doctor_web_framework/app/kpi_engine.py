@@ -0,0 +1,264 @@
+from .dataModel import Device, DoctorDeviceMapping, DeviceRecords, Owner, MedicalRecords, db
+from .rolling_window import BUCKET_SECONDS, EPOCH, RollingWindowStore, Row
+from .rollups import rollup_windows
+from .kpi_cache import KpiCache
+from .metrics import kpi_stage_seconds
+from config import Config
+from flask_caching import Cache
+from typing import List, Dict, Tuple, Optional
+from datetime import datetime, timedelta
+from sqlalchemy import and_
+from collections import defaultdict
+import math
+import time
+
+# Batched KPI engine
+# ==================
+# The dashboard KPIs are computed with a constant number of database round trips,
+# regardless of how many patients a doctor has selected:
+#   1. one roster query (devices + owners + medical histories joined together)
+#   2. one readings query keyed on all selected device ids (IN (...))
+#   3. one pipelined cache write for all devices (the versioned two-level cache of kpi_cache.py)
+# The per-device work that remains (resampling, averaging) happens in memory.
+# With Config.KPI_INCREMENTAL the readings query only returns rows newer than each device's
+# high-water mark and the 2-minute buckets are maintained incrementally (see rolling_window.py).
+
+Reading = Tuple[str, Optional[int], Optional[int], float, datetime, int] # device_id, heart_rate, spo2, temperature, timestamp, id
+ONE_SECOND = timedelta(seconds=1)
+
+# Function to replace Non-Numeric records with None/Null for JavaScript parsing
+def clean_graph_data(graph_data):
+    # Replace NaN values with None, which translates to null in JSON
+    graph_data['y_heart_rate'] = [None if math.isnan(v) else v for v in graph_data['y_heart_rate']]
+    graph_data['y_spo2'] = [None if math.isnan(v) else v for v in graph_data['y_spo2']]
+    return graph_data
+
+def fetch_patient_roster(doctor_email:str, patients:list, patient_usernames:list) -> List[Tuple[Device, Owner, MedicalRecords]]:
+    # Devices, owners and medical histories of the selected patients in a single query
+    with kpi_stage_seconds.time(stage='roster'):
+        return (
+            db.session.query(Device, Owner, MedicalRecords)
+            .join(Owner, Device.device_owner == Owner.owner_username)
+            .join(DoctorDeviceMapping, DoctorDeviceMapping.device_id == Device.device_id)
+            .outerjoin(MedicalRecords, MedicalRecords.medical_history_record_id == Owner.medical_history_record_id)
+            .filter(DoctorDeviceMapping.doctor_id == doctor_email)
+            .filter(
+                and_(
+                    Owner.owner_name.in_(patients),
+                    Owner.owner_username.in_(patient_usernames)
+                )
+            )
+            .all()
+        )
+
+def fetch_device_roster(device_ids:List[str]) -> List[Tuple[Device, Owner, MedicalRecords]]:
+    # Same as fetch_patient_roster, keyed on device ids (used by the fleet-wide poller)
+    if not device_ids:
+        return []
+    with kpi_stage_seconds.time(stage='roster'):
+        return (
+            db.session.query(Device, Owner, MedicalRecords)
+            .join(Owner, Device.device_owner == Owner.owner_username)
+            .outerjoin(MedicalRecords, MedicalRecords.medical_history_record_id == Owner.medical_history_record_id)
+            .filter(Device.device_id.in_(device_ids))
+            .all()
+        )
+
+def fetch_device_readings(device_ids:List[str], freshness:datetime, after_id:Optional[int]=None) -> Dict[str, List[Reading]]:
+    # Readings of every selected device in a single IN (...) keyed query, grouped in memory per device
+    readings:Dict[str, List[Reading]] = defaultdict(list)
+    if not device_ids:
+        return readings
+    query = (
+        db.session.query(
+            DeviceRecords.device_id,
+            DeviceRecords.heart_rate,
+            DeviceRecords.spo2,
+            DeviceRecords.temperature,
+            DeviceRecords.timestamp,
+            DeviceRecords.id
+        )
+        .filter(DeviceRecords.device_id.in_(device_ids))
+        .filter(DeviceRecords.timestamp >= freshness)
+    )
+    if after_id is not None:
+        # Only rows above the high-water mark, in insertion order
+        query = query.filter(DeviceRecords.id > after_id).order_by(DeviceRecords.id)
+    for row in query.all():
+        readings[row[0]].append(tuple(row))
+    return readings
+
+def fetch_window_rows(device_ids:List[str], freshness:datetime, after_id:Optional[int]) -> Dict[str, List[Row]]:
+    # Adapter from readings to the rows folded into the rolling windows
+    readings = fetch_device_readings(device_ids, freshness, 0 if after_id is None else after_id)
+    return {
+        device_id: [(record[5], record[1], record[2], record[3], record[4]) for record in device_data]
+        for device_id, device_data in readings.items()
+    }
+
+rolling_windows = RollingWindowStore(fetch_window_rows)
+kpi_cache = KpiCache(Config.KPI_CACHE_SIZE, Config.KPI_CACHE_TTL)
+
+def build_graph_data(device_owner:str, device_data:List[Reading]) -> dict:
+    # Plot KPI
+    # =================
+    # 2-minute means of heart rate and SpO2, bucketed on integer epoch seconds: the same output as
+    # pd.DataFrame(...).resample('2min').mean() (buckets labelled with the 2-minute floor of their readings,
+    # NaN for the buckets without a value between the first and the last one), without a DataFrame per device
+    buckets:Dict[int, List[int]] = {} # bucket start (epoch seconds) -> [hr sum, hr count, spo2 sum, spo2 count]
+    for record in device_data:
+        seconds = (record[4] - EPOCH) // ONE_SECOND
+        key = seconds - seconds % BUCKET_SECONDS
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = [0, 0, 0, 0]
+        if record[1] is not None:
+            bucket[0] += record[1]
+            bucket[1] += 1
+        if record[2] is not None:
+            bucket[2] += record[2]
+            bucket[3] += 1
+
+    x, y_heart_rate, y_spo2 = [], [], []
+    if buckets:
+        for key in range(min(buckets), max(buckets) + BUCKET_SECONDS, BUCKET_SECONDS):
+            bucket = buckets.get(key)
+            x.append((EPOCH + timedelta(seconds=key)).isoformat()) # '%Y-%m-%dT%H:%M:%S' (whole seconds)
+            y_heart_rate.append(bucket[0] / bucket[1] if bucket and bucket[1] else math.nan)
+            y_spo2.append(bucket[2] / bucket[3] if bucket and bucket[3] else math.nan)
+
+    graph_data = {
+        'x': x,
+        'y_heart_rate': y_heart_rate,
+        'y_spo2': y_spo2,
+        'device_owner': device_owner
+    }
+    # Clean the data before sending
+    return clean_graph_data(graph_data)
+
+def average_temperature(device_data:List[Reading]) -> float:
+    # Body temperature KPI
+    # =====================
+    temperatures = [record[3] for record in device_data]
+    if len(temperatures) > 0:
+        avg_temp = round(sum(temperatures) / len(temperatures), 2)
+    else:
+        avg_temp = -1.0
+    return float(avg_temp)
+
+def personal_traits_of(owner:Owner) -> dict:
+    return {
+        'name': owner.owner_name,
+        'age': owner.age,
+        'gender': owner.gender
+    }
+
+def medical_history_of(medical_history:Optional[MedicalRecords]) -> dict:
+    if medical_history is None:
+        return dict.fromkeys(['chronic_conditions', 'family_history', 'smoking', 'alcohol_usage', 'allergies', 'medication'])
+    return {
+        'chronic_conditions': medical_history.chronic_conditions,
+        'family_history': medical_history.family_history,
+        'smoking': medical_history.smoking,
+        'alcohol_usage': medical_history.alcohol_usage,
+        'allergies': medical_history.allerges,
+        'medication': medical_history.medication
+    }
+
+def dashboard_payload(owner_id:str, json_blob:Dict[str, dict]) -> dict:
+    # 'update_patient_data' payload of one device out of a computed blob
+    return {
+        'device_owner': owner_id,
+        'avg_temp': json_blob['avg_temps'][owner_id],
+        'graph_data': json_blob['graphs'][owner_id],
+        'personal_traits': json_blob['personal_traits'][owner_id],
+        'medical_history': json_blob['medical_histories'][owner_id]
+    }
+
+def compute_kpis_batched(doctor_email:str, patients:list, patient_usernames:list, redis_conn:Cache, kpi_freshness:int) -> Dict[str, dict]:
+    return compute_roster_kpis(fetch_patient_roster(doctor_email, patients, patient_usernames), redis_conn, kpi_freshness)
+
+def compute_device_kpis(device_ids:List[str], redis_conn:Cache, kpi_freshness:int) -> Dict[str, dict]:
+    return compute_roster_kpis(fetch_device_roster(device_ids), redis_conn, kpi_freshness)
+
+def compute_roster_kpis(roster:List[Tuple[Device, Owner, MedicalRecords]], redis_conn:Cache, kpi_freshness:int) -> Dict[str, dict]:
+    device_owners:dict = {}
+    graphs:dict = {}
+    personal_traits:dict = {}
+    medical_histories:dict = {}
+    avg_temps:dict = {}
+
+    # Set KPI freshness
+    freshness = datetime.now() - timedelta(hours=kpi_freshness)
+
+    device_ids = [device.device_id for device, _, _ in roster]
+    with kpi_stage_seconds.time(stage='readings'):
+        if Config.KPI_INCREMENTAL:
+            windows = rolling_windows.refresh(device_ids, freshness)
+        else:
+            # Closed 2-minute rollups plus the raw edges of the window, or the raw window when no rollup covers it
+            windows = rollup_windows(device_ids, freshness)
+            if windows is None:
+                readings = fetch_device_readings(device_ids, freshness)
+
+    resample_start = time.perf_counter()
+    versions:Dict[str, int] = {} # device id -> latest reading id folded in (cache version)
+    for device, owner, medical_history in roster:
+        owner_id = device.device_owner
+        if windows is not None:
+            window = windows[device.device_id]
+            graphs[owner_id] = window.graph_data(owner_id) # sent as a JSON object, not a JSON string inside the JSON payload
+            avg_temps[owner_id] = window.average_temperature() # Log Patient's body temperature to JSON Blob object
+            versions[device.device_id] = window.high_water_mark
+        else:
+            device_data = readings.get(device.device_id, [])
+            graphs[owner_id] = build_graph_data(owner_id, device_data)
+            avg_temps[owner_id] = average_temperature(device_data) # Log Patient's body temperature to JSON Blob object
+            versions[device.device_id] = max((record[5] for record in device_data), default=0)
+        personal_traits[owner_id] = personal_traits_of(owner) # Log Patient's personal metadata to JSON Blob object
+        medical_histories[owner_id] = medical_history_of(medical_history) # Log Patient's medical metadata to JSON Blob object
+        device_owners[owner_id] = owner.owner_name
+
+    json_blob:Dict[str, dict] = {
+        'device_owners': device_owners,
+        'graphs': graphs,
+        'personal_traits': personal_traits,
+        'medical_histories': medical_histories,
+        'avg_temps': avg_temps
+    }
+    kpi_stage_seconds.observe(time.perf_counter() - resample_start, stage='resample')
+    # A single pipelined write instead of one cache round trip per device
+    with kpi_stage_seconds.time(stage='cache_write'):
+        kpi_cache.store(redis_conn, {
+            device.device_id: (versions[device.device_id], dashboard_payload(device.device_owner, json_blob))
+            for device, _, _ in roster
+        })
+    return json_blob
+
+def cached_device_kpis(device_ids:List[str], redis_conn:Cache, kpi_freshness:int) -> Dict[str, dict]:
+    """
+    Read-through dashboard payloads ({device_id: payload}): devices with a fresh cache entry are served without
+    touching the database, the others are computed (and cached) in one batch.
+    """
+    # Latest readings this process already folded in; an older cached version is stale
+    latest = rolling_windows.high_water_marks(device_ids) if Config.KPI_INCREMENTAL else None
+    payloads = kpi_cache.lookup(redis_conn, device_ids, latest)
+    missing = [device_id for device_id in device_ids if device_id not in payloads]
+    if missing:
+        roster = fetch_device_roster(missing)
+        json_blob = compute_roster_kpis(roster, redis_conn, kpi_freshness)
+        for device, _, _ in roster:
+            payloads[device.device_id] = dashboard_payload(device.device_owner, json_blob)
+    return payloads
+
+def device_profiles(device_ids:List[str]) -> Dict[str, dict]:
+    # Static part of the dashboard payload (owner, personal traits, medical history) per device, in one query
+    return {
+        device.device_id: {
+            'device_owner': device.device_owner,
+            'owner_name': owner.owner_name,
+            'personal_traits': personal_traits_of(owner),
+            'medical_history': medical_history_of(medical_history)
+        }
+        for device, owner, medical_history in fetch_device_roster(device_ids)
+    }
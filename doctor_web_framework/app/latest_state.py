@@ -0,0 +1,160 @@
+from .dataModel import Device, DeviceLatestState, DeviceRecords, Owner, db
+from .conditions import critical_condition_payloads_batch, flagged_mask, severity
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import select
+import numpy as np
+
+# Latest state per device (device_latest_state)
+# =============================================
+# The ingest worker keeps the readings of the alert window (Config.ALERT_WINDOW_MINUTES, ending at the device's
+# newest reading) of every device it ingests in memory, and with every batch upserts one row per device the batch
+# touched: the last reading, the window means, the severity class of those means and the time of the last reading
+# that crossed a notification threshold. The row is written in the same transaction as the readings.
+# Kafka keys readings by device, so each device is kept by one worker; a device seen for the first time (start,
+# rebalance) is seeded from its stored readings of the window. Upserts never replace a row with an older reading.
+# The alert poller then answers "which of these devices are flagged, and with which means" with primary-key
+# lookups on device_latest_state instead of range scans over health_data_records.
+
+STATE_COLUMNS = (
+    'device_id', 'last_timestamp', 'heart_rate', 'temperature', 'spo2', 'window_readings',
+    'temp_mean', 'hr_mean', 'spo2_mean', 'severity', 'flagged_until', 'updated_at'
+)
+
+class DeviceReadings:
+    """Readings of one device within the window ending at its newest reading, keyed by timestamp (redeliveries collapse)."""
+    __slots__ = ('readings', 'flagged_until')
+
+    def __init__(self):
+        self.readings:Dict[datetime, tuple] = {}
+        self.flagged_until:Optional[datetime] = None
+
+    def add(self, row:tuple, flagged:bool):
+        self.readings[row[4]] = row
+        if flagged and (self.flagged_until is None or row[4] > self.flagged_until):
+            self.flagged_until = row[4]
+
+    def evict(self, window:timedelta):
+        cutoff = max(self.readings) - window
+        for timestamp in [timestamp for timestamp in self.readings if timestamp <= cutoff]:
+            del self.readings[timestamp]
+
+    def means(self) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+        # Rounded like DeviceWindow.means
+        rows = self.readings.values()
+        temperatures = [row[2] for row in rows]
+        heart_rates = [row[1] for row in rows if row[1] is not None]
+        spo2s = [row[3] for row in rows if row[3] is not None]
+        return (
+            float(round(sum(temperatures, Decimal(0)) / len(temperatures), 2)) if temperatures else None,
+            round(sum(heart_rates) / len(heart_rates), 2) if heart_rates else None,
+            round(sum(spo2s) / len(spo2s), 2) if spo2s else None
+        )
+
+class LatestStateTracker:
+    """
+    In-memory mirror of the device_latest_state rows of the devices one ingest worker writes.
+    Rows are ingest.IngestRow tuples (device_id, heart_rate, temperature, spo2, timestamp).
+    seed(device_ids, since) returns the stored rows of those devices from `since` on.
+    """
+
+    def __init__(self, window:timedelta, seed:Optional[Callable[[List[str], datetime], List[tuple]]]=None):
+        self.window = window
+        self.seed = seed
+        self.devices:Dict[str, DeviceReadings] = {}
+
+    def fold(self, rows:List[tuple]) -> List[tuple]:
+        """Folds a batch in and returns the state row (STATE_COLUMNS) of every device it touched."""
+        touched:Dict[str, List[tuple]] = defaultdict(list)
+        for row in rows:
+            touched[row[0]].append(row)
+        if not touched:
+            return []
+        unseen = [device_id for device_id in touched if device_id not in self.devices]
+        added = list(rows)
+        if unseen and self.seed is not None:
+            since = min(row[4] for device_id in unseen for row in touched[device_id]) - self.window
+            added = self.seed(unseen, since) + added
+        for device_id in unseen:
+            self.devices[device_id] = DeviceReadings()
+
+        # Thresholds of the whole batch in one vectorized pass
+        flags = flagged_mask(
+            np.array([float(row[2]) for row in added], dtype=float),
+            np.array([np.nan if row[1] is None else row[1] for row in added], dtype=float),
+            np.array([np.nan if row[3] is None else row[3] for row in added], dtype=float)
+        ).tolist()
+        for row, flagged in zip(added, flags):
+            self.devices[row[0]].add(row, flagged)
+
+        device_ids = list(touched)
+        means = []
+        for device_id in device_ids:
+            device = self.devices[device_id]
+            device.evict(self.window)
+            means.append(device.means())
+        # Severity of the payload the notification page would show (a missing vital counts as -1, as there)
+        columns = np.array([[-1.0 if value is None else value for value in row] for row in means], dtype=float)
+        classes = severity(columns[:, 0], columns[:, 1], columns[:, 2]).tolist()
+
+        now = datetime.now()
+        states = []
+        for device_id, (temp_mean, hr_mean, spo2_mean), device_severity in zip(device_ids, means, classes):
+            device = self.devices[device_id]
+            last = device.readings[max(device.readings)]
+            states.append((
+                device_id, last[4], last[1], last[2], last[3], len(device.readings),
+                temp_mean, hr_mean, spo2_mean, device_severity, device.flagged_until, now
+            ))
+        return states
+
+    def clear(self):
+        # Partitions were revoked: other workers may write these devices now, re-seed when they come back
+        self.devices.clear()
+
+def seed_from(engine) -> Callable[[List[str], datetime], List[tuple]]:
+    def seed(device_ids:List[str], since:datetime) -> List[tuple]:
+        query = (
+            select(DeviceRecords.device_id, DeviceRecords.heart_rate, DeviceRecords.temperature, DeviceRecords.spo2, DeviceRecords.timestamp)
+            .where(DeviceRecords.device_id.in_(device_ids), DeviceRecords.timestamp >= since)
+        )
+        with engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+    return seed
+
+# Readers
+# =======
+
+class LatestState(NamedTuple):
+    device_id:str
+    owner_name:str
+    temp_mean:Optional[float]
+    hr_mean:Optional[float]
+    spo2_mean:Optional[float]
+    flagged_until:Optional[datetime]
+
+def fetch_latest_states(device_ids:List[str]) -> Dict[str, LatestState]:
+    # Primary-key lookups of the registered devices that have a state row
+    if not device_ids:
+        return {}
+    rows = (
+        db.session.query(
+            DeviceLatestState.device_id, Owner.owner_name,
+            DeviceLatestState.temp_mean, DeviceLatestState.hr_mean, DeviceLatestState.spo2_mean, DeviceLatestState.flagged_until
+        )
+        .join(Device, Device.device_id == DeviceLatestState.device_id)
+        .join(Owner, Device.device_owner == Owner.owner_username)
+        .filter(DeviceLatestState.device_id.in_(device_ids))
+        .all()
+    )
+    return {row[0]: LatestState(*row) for row in rows}
+
+def latest_state_payloads(states:List[LatestState]) -> Dict[str, dict]:
+    """'patient_notification' payloads of the given states, computed from their window means."""
+    if not states:
+        return {}
+    means = np.array([[-1.0 if value is None else value for value in state[2:5]] for state in states], dtype=float)
+    batch = critical_condition_payloads_batch([state.owner_name for state in states], means[:, 0], means[:, 1], means[:, 2])
+    return {state.device_id: payload for state, payload in zip(states, batch)}
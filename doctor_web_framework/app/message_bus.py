@@ -0,0 +1,53 @@
+from .dataModel import PatientMessage
+from config import Config
+from typing import List, Optional
+import redis
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Patient message bus
+# ===================
+# Every message saved by handle_patient_message is also published on the Redis channel
+# Config.PATIENT_MESSAGE_CHANNEL. The patient app keeps one subscriber per process and pushes the message
+# to the patient's open WebSocket right away, instead of every connection polling patient_messages.
+# patient_messages stays the system of record: a failed publish is logged and the patient gets the
+# message from the database the next time the page connects.
+
+_client:Optional[redis.Redis] = None
+
+def message_bus() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(Config.MESSAGE_BUS_URL)
+    return _client
+
+def patient_message_event(message:PatientMessage) -> str:
+    return json.dumps({
+        'id': message.id,
+        'device_owner': message.device_owner,
+        'patient_name': message.patient_name,
+        'message': message.message,
+        'timestamp': message.timestamp.isoformat()
+    })
+
+def publish_patient_events(events:List[str]) -> int:
+    """
+    Publishes encoded events (patient_message_event) in one pipelined round trip.
+    Returns the number of deliveries to patient app processes (0 when the publish failed).
+    """
+    if not events:
+        return 0
+    try:
+        pipeline = message_bus().pipeline(transaction=False)
+        for event in events:
+            pipeline.publish(Config.PATIENT_MESSAGE_CHANNEL, event)
+        return sum(pipeline.execute())
+    except redis.RedisError as e:
+        logger.error(f"Could not publish {len(events)} patient messages: {str(e)}")
+        return 0
+
+def publish_patient_message(message:PatientMessage) -> int:
+    """Returns the number of patient app processes that received the event (0 when the publish failed)."""
+    return publish_patient_events([patient_message_event(message)])
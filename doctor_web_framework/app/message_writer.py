@@ -0,0 +1,136 @@
+from .dataModel import PatientMessage, db
+from .message_bus import patient_message_event, publish_patient_events
+from .metrics import Histogram, registry
+from threading import Event, Lock
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, NamedTuple, Optional
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Write-behind doctor -> patient messages
+# ======================================
+# send_patient_message events are queued instead of committed one by one on the Socket.IO handler. A writer
+# loop (started on the first queued message, stopped once the queue is empty) takes up to batch_size messages
+# when the batch is full or its oldest message waited flush_interval seconds, and:
+#   1. inserts them in one transaction (on PostgreSQL the ORM sends the rows as multi-row INSERT ... RETURNING id)
+#   2. publishes them to the patient app in one pipelined round trip (message_bus.py)
+#   3. acknowledges each message with 'message_saved' to the connection (sid) that sent it only
+# A message is acknowledged only once it is committed; if the write fails, its sender gets an error instead.
+# The queue is bounded: beyond queue_limit pending messages, new ones are refused right away.
+
+patient_message_ack_seconds = registry.register(Histogram(
+    'patient_message_ack_seconds', 'Time from a doctor message being queued to its acknowledgement (after the commit).'
+))
+
+class PendingMessage(NamedTuple):
+    sid:str
+    patient_name:str
+    device_owner:str
+    message:str
+    status_flag:Optional[int]
+    received:datetime
+    queued:float # time.monotonic()
+
+class MessageWriter:
+    """emit(event, payload, room) sends the acknowledgements; start_task(fn) runs the writer loop."""
+
+    def __init__(self, app, emit:Callable[[str, dict, str], None], start_task:Callable, batch_size:int, flush_interval:float, queue_limit:int):
+        self.app = app
+        self.emit = emit
+        self.start_task = start_task
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_limit = queue_limit
+        self.queue:Deque[PendingMessage] = deque()
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.running = False
+        self.written = 0
+        self.batches = 0
+
+    def submit(self, sid:str, patient_name:str, device_owner:str, message:str, status_flag:Optional[int]) -> bool:
+        """Queues a message; False when the queue is full (nothing was queued)."""
+        with self.lock:
+            if len(self.queue) >= self.queue_limit:
+                return False
+            self.queue.append(PendingMessage(sid, patient_name, device_owner, message, status_flag, datetime.now(), time.monotonic()))
+            if len(self.queue) >= self.batch_size:
+                self.wakeup.set()
+            if not self.running:
+                self.running = True
+                self.start_task(self.run)
+        return True
+
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.queue)
+
+    def due(self) -> bool:
+        with self.lock:
+            return len(self.queue) >= self.batch_size or (bool(self.queue) and time.monotonic() - self.queue[0].queued >= self.flush_interval)
+
+    def flush(self) -> int:
+        """Writes, publishes and acknowledges the next batch. Returns the number of messages written."""
+        with self.lock:
+            batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+        if not batch:
+            return 0
+        with self.app.app_context():
+            try:
+                rows = [
+                    PatientMessage(
+                        patient_name=pending.patient_name,
+                        device_owner=pending.device_owner,
+                        message=pending.message,
+                        status_flag=pending.status_flag,
+                        timestamp=pending.received
+                    )
+                    for pending in batch
+                ]
+                db.session.add_all(rows)
+                db.session.flush()
+                events = [patient_message_event(row) for row in rows] # before the commit expires the attributes
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not save a batch of {len(batch)} patient messages: {str(e)}")
+                for pending in batch:
+                    self.emit('message_saved', {'status': 'error', 'message': 'Failed to save message', 'patient_name': pending.patient_name}, pending.sid)
+                return 0
+            finally:
+                db.session.remove()
+
+        # Push the messages to the patients' open pages (the patient app no longer polls for them)
+        publish_patient_events(events)
+        now = time.monotonic()
+        for pending in batch:
+            self.emit('message_saved', {'status': 'success', 'message': 'Message saved successfully', 'patient_name': pending.patient_name}, pending.sid)
+            patient_message_ack_seconds.observe(now - pending.queued)
+        self.written += len(batch)
+        self.batches += 1
+        logger.debug(f"Saved {len(batch)} patient messages")
+        return len(batch)
+
+    def run(self):
+        try:
+            while True:
+                with self.lock:
+                    if not self.queue:
+                        self.running = False
+                        return
+                    wait = 0.0 if len(self.queue) >= self.batch_size else max(0.0, self.flush_interval - (time.monotonic() - self.queue[0].queued))
+                if wait > 0:
+                    self.wakeup.wait(wait) # a full batch wakes the loop early
+                self.wakeup.clear()
+                try:
+                    if self.due():
+                        self.flush()
+                except Exception as e:
+                    logger.error(f"Error in the patient message writer: {str(e)}")
+        except BaseException:
+            with self.lock:
+                self.running = False
+            raise
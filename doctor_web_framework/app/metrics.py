@@ -0,0 +1,212 @@
+from threading import Lock, local
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import json
+import time
+
+# Hot-path metrics (Prometheus text format, served on /metrics)
+# ============================================================
+# Histograms, counters and gauges for the KPI stages, the poller ticks, the queries issued per tick, the bytes
+# emitted over Socket.IO and the rooms/pollers of the worker. Recording is a bisect over the bucket bounds and
+# a few additions under a lock, so the instrumentation stays on in production. Values are per worker process
+# (each gunicorn worker serves its own /metrics); gauges backed by a callback are read at scrape time only.
+# Kept dependency-free instead of pulling in prometheus_client for the few metric types used here.
+
+Labels = Tuple[str, ...]
+
+# Seconds: 1 ms .. 10 s
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+def _format_labels(names:Labels, values:Labels, extra:str='') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value:float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name:str, documentation:str, labelnames:Iterable[str]=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames:Labels = tuple(labelnames)
+        self.lock = Lock()
+
+    def _key(self, labels:Dict[str, str]) -> Labels:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return '\n'.join([f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}'] + self.samples())
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name:str, documentation:str, labelnames:Iterable[str]=()):
+        super().__init__(name, documentation, labelnames)
+        self.values:Dict[Labels, float] = {}
+
+    def inc(self, amount:float=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in sorted(values.items())]
+
+class Gauge(Metric):
+    """Set explicitly, or read from function() at scrape time (a {label values tuple: value} dict when the gauge has labels)."""
+    kind = 'gauge'
+
+    def __init__(self, name:str, documentation:str, labelnames:Iterable[str]=(), function:Optional[Callable]=None):
+        super().__init__(name, documentation, labelnames)
+        self.values:Dict[Labels, float] = {}
+        self.function = function
+
+    def set(self, value:float, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        if self.function is not None:
+            value = self.function()
+            values = {(): value} if not self.labelnames else {tuple(map(str, key)): v for key, v in value.items()}
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in sorted(values.items())]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name:str, documentation:str, labelnames:Iterable[str]=(), buckets:Iterable[float]=TIME_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds:List[float] = sorted(buckets)
+        self.series:Dict[Labels, List[float]] = {} # label values -> per-bucket counts + [sum, count]
+
+    def observe(self, value:float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.bounds, value) # first bucket whose upper bound (le) holds the value
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.bounds) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+        lines = []
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + [float('inf')], values):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(values[-2], 6))}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {values[-1]}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics:List[Metric] = []
+
+    def register(self, metric:Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+registry = Registry()
+
+kpi_stage_seconds = registry.register(Histogram(
+    'kpi_stage_seconds', 'Time spent in each stage of a dashboard KPI computation.', ['stage']
+))
+poller_tick_seconds = registry.register(Histogram(
+    'poller_tick_seconds', 'Duration of a fleet poller tick (compute and fan-out).', ['poller']
+))
+poller_stage_seconds = registry.register(Histogram(
+    'poller_stage_seconds', 'Time spent computing and emitting within a fleet poller tick.', ['poller', 'stage']
+))
+poller_tick_queries = registry.register(Histogram(
+    'poller_tick_queries', 'Database statements issued by one fleet poller tick.', ['poller'], COUNT_BUCKETS
+))
+socketio_emits = registry.register(Counter(
+    'socketio_emits_total', 'Socket.IO events emitted to rooms.', ['event']
+))
+socketio_emitted_bytes = registry.register(Counter(
+    'socketio_emitted_bytes_total', 'Encoded size of the emitted Socket.IO event packets, sampled (record_emits).', ['event']
+))
+
+# Queries per tick
+# ================
+# One listener for every engine counts the statements of the greenlet (threading.local is greenlet-local once
+# gevent has patched the process) while a count_queries() block is active.
+
+_query_scope = local()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = getattr(_query_scope, 'counter', None)
+    if counter is not None:
+        counter[0] += 1
+
+@contextmanager
+def count_queries():
+    outer = getattr(_query_scope, 'counter', None)
+    counter = [0]
+    _query_scope.counter = counter
+    try:
+        yield counter
+    finally:
+        _query_scope.counter = outer
+        if outer is not None:
+            outer[0] += counter[0]
+
+# Emitted bytes
+# =============
+# Encoding every payload again just to count its bytes would double the serialization work of a tick. One emit
+# in EMIT_SIZE_SAMPLE per event is encoded as the packet the Socket.IO serializer writes (set_emit_size, see
+# app/__init__.py) and its size is counted for every emit since the previous sample.
+
+EMIT_SIZE_SAMPLE = 20
+_emit_size:Callable[[str, dict], int] = lambda event_name, payload: len(json.dumps(payload, separators=(',', ':'), default=str))
+_unsized_emits:Dict[str, int] = {}
+
+def set_emit_size(emit_size:Callable[[str, dict], int]):
+    global _emit_size
+    _emit_size = emit_size
+
+def record_emits(event_name:str, payload:dict, rooms:int=1):
+    socketio_emits.inc(rooms, event=event_name)
+    unsized = _unsized_emits.get(event_name, 0) + rooms
+    if unsized < EMIT_SIZE_SAMPLE:
+        _unsized_emits[event_name] = unsized
+        return
+    _unsized_emits[event_name] = 0
+    socketio_emitted_bytes.inc(unsized * _emit_size(event_name, payload), event=event_name)
+
+def render() -> str:
+    return registry.render()
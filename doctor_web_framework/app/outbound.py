@@ -0,0 +1,211 @@
+from .metrics import Counter, registry
+from threading import Lock
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import sys
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Outbound delivery with backpressure (Config.OUTBOUND_QUEUE)
+# ===========================================================
+# socketio.emit is fire-and-forget: a page on a slow connection piles up stale frames in the worker holding its
+# socket and in the Redis message queue. An OutboundQueue sits between a fleet poller and socketio.emit and keeps
+# one bounded queue per room:
+#   - frames are keyed by device_owner; a newer frame for a device replaces its queued one in place (latest wins,
+#     through coalesce(old, new), e.g. the current snapshot for two dashboard deltas), so a queue never holds more
+#     than one frame per device
+#   - at most `window` frames per room are in flight; each gets a room sequence number 'oseq', the last frame of
+#     every burst carries 'ack': true and the page answers with 'outbound_ack' (the oseq, acknowledging
+#     everything up to it), which releases the window
+#   - an acknowledgement missing for ack_timeout seconds (page closed, or the ack was lost) releases the window
+#     as well, but the room then gets one frame at a time until an acknowledgement comes back: a stalled page
+#     costs one frame per ack_timeout until Socket.IO drops its connection, and its queue stays bounded
+#   - beyond queue_limit queued devices, the oldest queued frame is dropped
+#   - with a batch_event, whatever a room's window lets through at once goes out as one {'frames': [...]} event
+# A loop (started on demand, stopped when nothing is queued or in flight) collects acknowledgements relayed from
+# other workers (task_registry.py), releases timed-out windows and forgets idle rooms (unless they are probing).
+
+outbound_sent = registry.register(Counter(
+    'outbound_frames_sent_total', 'Frames the outbound queues passed on to Socket.IO.', ['event']
+))
+outbound_coalesced = registry.register(Counter(
+    'outbound_frames_coalesced_total', 'Queued frames replaced by a newer frame for the same device.', ['event']
+))
+outbound_dropped = registry.register(Counter(
+    'outbound_frames_dropped_total', 'Queued frames dropped because a room queue was full.', ['event']
+))
+outbound_ack_timeouts = registry.register(Counter(
+    'outbound_ack_timeouts_total', 'Delivery windows released because no acknowledgement came in time.', ['event']
+))
+
+ACK_ALL = sys.maxsize # acknowledges every frame sent so far (a new page: nothing of the old one is in flight)
+
+class RoomQueue:
+    __slots__ = ('pending', 'seq', 'acked', 'requested', 'probing')
+
+    def __init__(self):
+        self.pending:'OrderedDict[str, dict]' = OrderedDict() # device owner -> newest frame not sent yet
+        self.seq = 0 # last oseq sent
+        self.acked = 0 # last oseq acknowledged
+        self.requested = 0.0 # when the last acknowledgement was asked for
+        self.probing = False # an acknowledgement timed out: one frame in flight until the page answers
+
+class OutboundQueue:
+    """
+    send(event, payload, room) replaces emit for one event (send_batch: all payloads of a tick for a room);
+    emit(event, payload, room) is socketio.emit.
+    acks(), when given, returns the (room, oseq) acknowledgements received by other workers.
+    """
+
+    def __init__(
+        self,
+        event:str,
+        emit:Callable[[str, dict, str], None],
+        start_task:Callable,
+        sleep:Callable[[float], None],
+        window:int,
+        queue_limit:int,
+        ack_timeout:float,
+        coalesce:Optional[Callable[[dict, dict], Optional[dict]]]=None,
+        acks:Optional[Callable[[], List[Tuple[str, int]]]]=None,
+        poll:float=0.25,
+        batch_event:Optional[str]=None,
+        clock:Callable[[], float]=time.monotonic
+    ):
+        self.event = event
+        self.emit = emit
+        self.start_task = start_task
+        self.sleep = sleep
+        self.window = window
+        self.queue_limit = queue_limit
+        self.ack_timeout = ack_timeout
+        self.coalesce = coalesce or (lambda old, new: new)
+        self.acks = acks
+        self.poll = poll
+        self.batch_event = batch_event
+        self.clock = clock
+        self.rooms:Dict[str, RoomQueue] = {}
+        self.lock = Lock()
+        self.running = False
+
+    def send(self, event:str, payload:dict, room:str):
+        self.send_batch(event, [payload], room)
+
+    def send_batch(self, event:str, payloads:List[dict], room:str):
+        with self.lock:
+            queue = self.rooms.get(room)
+            if queue is None:
+                queue = self.rooms[room] = RoomQueue()
+            for payload in payloads:
+                self._enqueue(queue, payload)
+            frames = self._take(queue)
+            if not self.running and (queue.pending or queue.seq > queue.acked):
+                self.running = True
+                self.start_task(self.run)
+        self._emit(frames, room)
+
+    def _enqueue(self, queue:RoomQueue, payload:dict):
+        key = payload['device_owner']
+        old = queue.pending.get(key)
+        if old is not None:
+            frame = self.coalesce(old, payload)
+            outbound_coalesced.inc(event=self.event)
+            if frame is None:
+                del queue.pending[key]
+            else:
+                queue.pending[key] = frame # keeps the old frame's place in the queue
+            return
+        if len(queue.pending) >= self.queue_limit:
+            queue.pending.popitem(last=False)
+            outbound_dropped.inc(event=self.event)
+        queue.pending[key] = payload
+
+    def _take(self, queue:RoomQueue) -> List[dict]:
+        # Frames the room's window lets through now (lock held)
+        frames = []
+        window = 1 if queue.probing else self.window
+        while queue.pending and queue.seq - queue.acked < window:
+            _, payload = queue.pending.popitem(last=False)
+            queue.seq += 1
+            frames.append(dict(payload, oseq=queue.seq))
+        if frames:
+            frames[-1]['ack'] = True
+            queue.requested = self.clock()
+        return frames
+
+    def _emit(self, frames:List[dict], room:str):
+        if not frames:
+            return
+        if self.batch_event is not None:
+            self.emit(self.batch_event, {'frames': frames}, room)
+        else:
+            for frame in frames:
+                self.emit(self.event, frame, room)
+        outbound_sent.inc(len(frames), event=self.event)
+
+    def ack(self, room:str, seq:int):
+        """The page of `room` received every frame up to oseq `seq` (ACK_ALL: a new page)."""
+        with self.lock:
+            queue = self.rooms.get(room)
+            if queue is None:
+                return # not sent from this worker
+            queue.acked = max(queue.acked, min(int(seq), queue.seq))
+            queue.probing = False
+            frames = self._take(queue)
+        self._emit(frames, room)
+
+    def sweep(self) -> bool:
+        """Applies relayed acknowledgements and releases timed-out windows. False once nothing is queued or in flight."""
+        for room, seq in (self.acks() if self.acks is not None else []):
+            self.ack(room, seq)
+        now = self.clock()
+        sends = []
+        with self.lock:
+            for room, queue in self.rooms.items():
+                if queue.seq > queue.acked and now - queue.requested >= self.ack_timeout:
+                    queue.acked = queue.seq
+                    queue.probing = True
+                    outbound_ack_timeouts.inc(event=self.event)
+                    sends.append((room, self._take(queue)))
+            idle = [room for room, queue in self.rooms.items() if not queue.pending and queue.seq == queue.acked]
+            for room in idle:
+                if not self.rooms[room].probing:
+                    del self.rooms[room] # the next frame starts the room over
+            busy = len(idle) < len(self.rooms)
+        for room, frames in sends:
+            self._emit(frames, room)
+        return busy
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    busy = self.sweep()
+                except Exception as e:
+                    logger.error(f"Error in {self.event} outbound queue: {str(e)}")
+                    busy = True
+                if not busy:
+                    with self.lock:
+                        if not any(queue.pending or queue.seq > queue.acked for queue in self.rooms.values()):
+                            self.running = False
+                            return
+                self.sleep(self.poll)
+        except BaseException:
+            with self.lock:
+                self.running = False
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            depths = [len(queue.pending) for queue in self.rooms.values()]
+            in_flight = [queue.seq - queue.acked for queue in self.rooms.values()]
+            probing = sum(1 for queue in self.rooms.values() if queue.probing)
+        return {
+            'rooms': len(depths),
+            'queued': sum(depths),
+            'queued_max': max(depths, default=0),
+            'in_flight': sum(in_flight),
+            'probing_rooms': probing
+        }
@@ -0,0 +1,160 @@
+from threading import Lock, local
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import Config
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Query profiler (Config.QUERY_PROFILING)
+# =======================================
+# Opt-in profiling of the statements sent through any SQLAlchemy engine, scoped per HTTP request and per fleet
+# poller tick. A scope records the number of statements, the time spent in the database and a normalized
+# fingerprint of every statement (literals and bound parameters replaced by ?, IN lists collapsed), so that a
+# per-device query issued once per patient shows up as one fingerprint repeated N times:
+#   - fingerprints repeated Config.QUERY_PROFILE_REPEATS times or more within a scope are logged as N+1 suspects
+#   - statements slower than Config.QUERY_SLOW_MS are logged with their parameters and EXPLAIN output
+#   - the summary of the last scopes is kept for /db/profile
+# assert_max_queries(n) profiles a block regardless of the setting, for tests and benchmarks.
+
+_PARAMETER = re.compile(r'%\(\w+\)s|%s|\?') # qmark (SQLite) and pyformat (psycopg2) placeholders
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACE = re.compile(r'\s+')
+
+def fingerprint(statement:str) -> str:
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _PARAMETER.sub('?', statement)
+    statement = _IN_LIST.sub('(?)', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+class QueryProfile:
+    """Statements of one request or tick."""
+
+    def __init__(self, scope:str):
+        self.scope = scope
+        self.queries = 0
+        self.db_time = 0.0
+        self.fingerprints:Counter = Counter()
+        self.slow:List[dict] = []
+
+    def record(self, statement:str, seconds:float):
+        self.queries += 1
+        self.db_time += seconds
+        self.fingerprints[fingerprint(statement)] += 1
+
+    def repeated(self, threshold:Optional[int]=None) -> Dict[str, int]:
+        threshold = threshold or Config.QUERY_PROFILE_REPEATS
+        return {statement: count for statement, count in self.fingerprints.most_common() if count >= threshold}
+
+    def summary(self) -> dict:
+        return {
+            'scope': self.scope,
+            'queries': self.queries,
+            'db_ms': round(1000 * self.db_time, 2),
+            'distinct_statements': len(self.fingerprints),
+            'n_plus_one_suspects': [{'statement': statement, 'count': count} for statement, count in self.repeated().items()],
+            'slow_queries': len(self.slow)
+        }
+
+    def assert_max_queries(self, limit:int):
+        if self.queries > limit:
+            statements = '\n'.join(f'  {count} x {statement}' for statement, count in self.fingerprints.most_common())
+            raise AssertionError(f"{self.scope}: {self.queries} queries, expected at most {limit}\n{statements}")
+
+recent_profiles:Deque[dict] = deque(maxlen=100)
+_recent_lock = Lock()
+_active = local() # greenlet-local once gevent has patched the process
+
+def _scopes() -> List[QueryProfile]:
+    scopes = getattr(_active, 'scopes', None)
+    if scopes is None:
+        scopes = _active.scopes = []
+    return scopes
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_active, 'scopes', None):
+        conn.info.setdefault('query_profiler_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_profiler_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    scopes = getattr(_active, 'scopes', None)
+    if not scopes:
+        return
+    for profile in scopes:
+        profile.record(statement, elapsed)
+    if elapsed * 1000 >= Config.QUERY_SLOW_MS:
+        slow = {'statement': statement, 'parameters': parameters, 'ms': round(1000 * elapsed, 1)}
+        scopes[-1].slow.append(slow)
+        plan = '' if executemany else explain(conn, statement, parameters)
+        logger.warning(f"Slow query ({slow['ms']} ms) in {scopes[-1].scope}: {statement} {parameters!r}\n{plan}")
+
+def explain(conn, statement:str, parameters) -> str:
+    # Plan of a slow SELECT, on a separate DBAPI cursor of the same connection (no events, same transaction)
+    if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        return ''
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except Exception as e:
+        return f'(EXPLAIN failed: {str(e)})'
+    finally:
+        cursor.close()
+
+@contextmanager
+def profile(scope:str, force:bool=False):
+    """Profiles the statements of the block; yields None (and records nothing) when profiling is off."""
+    if not (Config.QUERY_PROFILING or force):
+        yield None
+        return
+    query_profile = QueryProfile(scope)
+    scopes = _scopes()
+    scopes.append(query_profile)
+    try:
+        yield query_profile
+    finally:
+        scopes.remove(query_profile)
+        if not force or Config.QUERY_PROFILING:
+            report(query_profile)
+
+def report(query_profile:QueryProfile):
+    summary = query_profile.summary()
+    with _recent_lock:
+        recent_profiles.append(summary)
+    for suspect in summary['n_plus_one_suspects']:
+        logger.warning(f"Possible N+1 in {query_profile.scope}: {suspect['count']} x {suspect['statement']}")
+
+@contextmanager
+def assert_max_queries(limit:int, scope:str='block'):
+    with profile(scope, force=True) as query_profile:
+        yield query_profile
+    query_profile.assert_max_queries(limit)
+
+def install_request_profiling(app):
+    # One scope per HTTP request (Socket.IO events run outside of Flask requests and are not profiled)
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_profile():
+        g.query_profile = profile(f'{request.method} {request.path}')
+        g.query_profile.__enter__()
+
+    @app.teardown_request
+    def _finish_request_profile(exception=None):
+        context = g.pop('query_profile', None)
+        if context is not None:
+            context.__exit__(None, None, None)
@@ -0,0 +1,197 @@
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+import calendar
+
+# Incremental rolling-window KPI state
+# ====================================
+# Each device keeps the readings of the KPI window grouped into 2-minute buckets together with
+# running sums and counts per bucket, plus a high-water mark (the last health_data_records.id folded in).
+# A tick only has to fetch the rows above the high-water mark, fold them in and evict the rows that
+# fell out of the window, instead of re-reading and re-resampling the whole window.
+#
+# The output is identical to pd.DataFrame(...).resample('2min').mean() followed by clean_graph_data:
+# bucket labels are the 2-minute floor of the timestamps (2 minutes divide a day, so this matches the
+# pandas 'start_day' origin), empty buckets between the first and last reading are reported as None,
+# and integer sums divided by counts give exactly the means pandas computes.
+# Temperatures are summed as Decimal (Numeric column), so eviction never accumulates rounding error.
+
+BUCKET_SECONDS = 120
+EPOCH = datetime(1970, 1, 1)
+
+# id, heart_rate, spo2, temperature, timestamp
+Row = Tuple[int, Optional[int], Optional[int], Decimal, datetime]
+
+def bucket_of(timestamp:datetime, bucket_seconds:int=BUCKET_SECONDS) -> int:
+    epoch = calendar.timegm(timestamp.timetuple())
+    return epoch - epoch % bucket_seconds
+
+class Bucket:
+    __slots__ = ('rows', 'hr_sum', 'hr_count', 'spo2_sum', 'spo2_count')
+
+    def __init__(self):
+        self.rows:List[Row] = []
+        self.hr_sum = 0
+        self.hr_count = 0
+        self.spo2_sum = 0
+        self.spo2_count = 0
+
+    def add(self, row:Row):
+        self.rows.append(row)
+        if row[1] is not None:
+            self.hr_sum += row[1]
+            self.hr_count += 1
+        if row[2] is not None:
+            self.spo2_sum += row[2]
+            self.spo2_count += 1
+
+    def remove(self, row:Row):
+        if row[1] is not None:
+            self.hr_sum -= row[1]
+            self.hr_count -= 1
+        if row[2] is not None:
+            self.spo2_sum -= row[2]
+            self.spo2_count -= 1
+
+class DeviceWindow:
+    """Rolling KPI window of a single device."""
+
+    def __init__(self, bucket_seconds:int=BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.buckets:Dict[int, Bucket] = {}
+        self.high_water_mark = 0
+        self.temp_sum = Decimal(0)
+        self.temp_count = 0
+        self.last_access:Optional[datetime] = None
+
+    def fold(self, rows:Iterable[Row]):
+        for row in rows:
+            if row[0] <= self.high_water_mark:
+                continue
+            key = bucket_of(row[4], self.bucket_seconds)
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = Bucket()
+            bucket.add(row)
+            self.temp_sum += row[3]
+            self.temp_count += 1
+            self.high_water_mark = row[0]
+
+    def fold_bucket(self, key:int, hr_sum:int, hr_count:int, spo2_sum:int, spo2_count:int, temp_sum:Decimal, temp_count:int):
+        # Pre-aggregated bucket (e.g. from a rollup table); it carries no rows, so it must lie fully inside the window
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket()
+        bucket.hr_sum += hr_sum or 0
+        bucket.hr_count += hr_count or 0
+        bucket.spo2_sum += spo2_sum or 0
+        bucket.spo2_count += spo2_count or 0
+        self.temp_sum += temp_sum or 0
+        self.temp_count += temp_count or 0
+
+    def evict(self, freshness:datetime):
+        # Drop readings older than the window start; only buckets starting before it are visited
+        cutoff = bucket_of(freshness, self.bucket_seconds)
+        for key in [key for key in self.buckets if key <= cutoff]:
+            bucket = self.buckets[key]
+            kept = []
+            for row in bucket.rows:
+                if row[4] < freshness:
+                    bucket.remove(row)
+                    self.temp_sum -= row[3]
+                    self.temp_count -= 1
+                else:
+                    kept.append(row)
+            if kept:
+                bucket.rows = kept
+            else:
+                del self.buckets[key]
+
+    def graph_data(self, device_owner:str) -> dict:
+        x, y_heart_rate, y_spo2 = [], [], []
+        if self.buckets:
+            first, last = min(self.buckets), max(self.buckets)
+            for key in range(first, last + self.bucket_seconds, self.bucket_seconds):
+                bucket = self.buckets.get(key)
+                x.append((EPOCH + timedelta(seconds=key)).strftime('%Y-%m-%dT%H:%M:%S'))
+                y_heart_rate.append(bucket.hr_sum / bucket.hr_count if bucket and bucket.hr_count else None)
+                y_spo2.append(bucket.spo2_sum / bucket.spo2_count if bucket and bucket.spo2_count else None)
+        return {
+            'x': x,
+            'y_heart_rate': y_heart_rate,
+            'y_spo2': y_spo2,
+            'device_owner': device_owner
+        }
+
+    def means(self) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+        # Temperature, heart rate and SpO2 means over the whole window
+        hr_sum = sum(bucket.hr_sum for bucket in self.buckets.values())
+        hr_count = sum(bucket.hr_count for bucket in self.buckets.values())
+        spo2_sum = sum(bucket.spo2_sum for bucket in self.buckets.values())
+        spo2_count = sum(bucket.spo2_count for bucket in self.buckets.values())
+        return (
+            float(round(self.temp_sum / self.temp_count, 2)) if self.temp_count else None,
+            round(hr_sum / hr_count, 2) if hr_count else None,
+            round(spo2_sum / spo2_count, 2) if spo2_count else None
+        )
+
+    def average_temperature(self) -> float:
+        if self.temp_count > 0:
+            return float(round(self.temp_sum / self.temp_count, 2))
+        return -1.0
+
+class RollingWindowStore:
+    """
+    Per-process store of DeviceWindow objects shared by every doctor watching a device.
+    fetch(device_ids, freshness, after_id) must return {device_id: [Row, ...]} ordered by id.
+    """
+
+    def __init__(self, fetch:Callable[[List[str], datetime, Optional[int]], Dict[str, List[Row]]], bucket_seconds:int=BUCKET_SECONDS):
+        self.fetch = fetch
+        self.bucket_seconds = bucket_seconds
+        self.windows:Dict[str, DeviceWindow] = {}
+        self.lock = Lock()
+
+    def refresh(self, device_ids:List[str], freshness:datetime) -> Dict[str, DeviceWindow]:
+        now = datetime.now()
+        with self.lock:
+            known = [device_id for device_id in device_ids if device_id in self.windows and self.windows[device_id].high_water_mark]
+            # Devices seen for the first time, and devices without any reading so far (high-water mark 0, which
+            # would pull the whole window of every other device into the incremental query)
+            empty = [device_id for device_id in device_ids if device_id not in known]
+
+            # Devices with readings: only rows above the lowest high-water mark among them
+            if known:
+                after_id = min(self.windows[device_id].high_water_mark for device_id in known)
+                for device_id, rows in self.fetch(known, freshness, after_id).items():
+                    self.windows[device_id].fold(rows)
+            # The others: full window
+            if empty:
+                fetched = self.fetch(empty, freshness, None)
+                for device_id in empty:
+                    window = self.windows.get(device_id)
+                    if window is None:
+                        window = self.windows[device_id] = DeviceWindow(self.bucket_seconds)
+                    window.fold(fetched.get(device_id, []))
+
+            result:Dict[str, DeviceWindow] = {}
+            for device_id in device_ids:
+                window = self.windows[device_id]
+                window.evict(freshness)
+                window.last_access = now
+                result[device_id] = window
+
+            # Forget devices nobody has asked for during a whole window; they are rebuilt on demand
+            for device_id in [d for d, w in self.windows.items() if w.last_access < freshness]:
+                del self.windows[device_id]
+            return result
+
+    def high_water_marks(self, device_ids:Iterable[str]) -> Dict[str, int]:
+        # Latest reading id folded in per known device, without any database access
+        with self.lock:
+            return {device_id: self.windows[device_id].high_water_mark for device_id in device_ids if device_id in self.windows}
+
+    def clear(self):
+        with self.lock:
+            self.windows.clear()
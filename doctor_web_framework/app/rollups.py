@@ -0,0 +1,256 @@
+from .dataModel import DeviceRecords, DeviceRollup1m, DeviceRollup2m, RollupWatermark, db
+from .rolling_window import DeviceWindow, bucket_of, EPOCH
+from config import Config
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, delete, literal_column, or_, and_, text, Integer
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rollup storage tier for health_data_records
+# ===========================================
+# Raw readings are partitioned by day (postgres/migrations/002_health_data_records_rollups.sql) and a background
+# compaction job folds every closed 1-minute and 2-minute bucket into health_data_rollup_1m/_2m
+# (min/max/sum/count per vital per device). The rollup_watermarks table records up to where each rollup is final.
+# Readers combine the rollup buckets lying fully inside their window with raw rows for the two edges
+# (the partial bucket at the window start and everything after the watermark), so results are identical
+# to reading raw rows while touching a few kilobytes of rollups instead of the whole raw window.
+# Raw partitions older than Config.RAW_RETENTION_DAYS are dropped once they are fully compacted.
+# Readings arriving after their bucket was compacted are folded in by the next run, which recomputes the buckets
+# of the rows stored since the last compacted id (rollup_watermarks.compacted_id, migration 006); until then
+# rollup reads miss them. Late readings older than the raw retention are not recompacted.
+
+ROLLUP_MODELS = {60: DeviceRollup1m, 120: DeviceRollup2m}
+PARTITION_PREFIX = 'health_data_records_p'
+COMPACTION_LOCK_ID = 4_204_001 # pg advisory lock shared by every worker running the compaction loop
+
+def floor_to_bucket(timestamp:datetime, bucket_seconds:int) -> datetime:
+    return EPOCH + timedelta(seconds=bucket_of(timestamp, bucket_seconds))
+
+def bucket_expression(column, bucket_seconds:int):
+    # Start of the bucket a timestamp falls into, evaluated by the database
+    if db.engine.dialect.name == 'postgresql':
+        minutes = bucket_seconds // 60
+        return func.date_trunc('hour', column) + func.floor(func.date_part('minute', column) / minutes) * literal_column(f"interval '{minutes} minutes'")
+    # SQLite: same text layout SQLAlchemy uses for DateTime values, so range comparisons stay lexicographic
+    epoch = func.strftime('%s', column, type_=Integer)
+    return func.datetime(epoch - epoch % bucket_seconds, 'unixepoch').concat('.000000')
+
+def compacted_until(bucket_seconds:int) -> Optional[datetime]:
+    watermark = db.session.get(RollupWatermark, ROLLUP_MODELS[bucket_seconds].__tablename__)
+    return watermark.compacted_until if watermark else None
+
+def fold_buckets(model, bucket_seconds:int, start:datetime, end:datetime, device_id:Optional[str]=None):
+    """Replaces the rollup buckets in [start, end) (of one device if given) with aggregates of the raw rows."""
+    bucket = bucket_expression(DeviceRecords.timestamp, bucket_seconds).label('bucket_start')
+    aggregates = (
+        db.session.query(
+            DeviceRecords.device_id,
+            bucket,
+            func.count(DeviceRecords.id),
+            func.min(DeviceRecords.heart_rate), func.max(DeviceRecords.heart_rate),
+            func.sum(DeviceRecords.heart_rate), func.count(DeviceRecords.heart_rate),
+            func.min(DeviceRecords.spo2), func.max(DeviceRecords.spo2),
+            func.sum(DeviceRecords.spo2), func.count(DeviceRecords.spo2),
+            func.min(DeviceRecords.temperature), func.max(DeviceRecords.temperature),
+            func.sum(DeviceRecords.temperature), func.count(DeviceRecords.temperature)
+        )
+        .filter(DeviceRecords.timestamp >= start, DeviceRecords.timestamp < end)
+        .group_by(DeviceRecords.device_id, bucket)
+    )
+    stale = delete(model).where(model.bucket_start >= start, model.bucket_start < end)
+    if device_id is not None:
+        aggregates = aggregates.filter(DeviceRecords.device_id == device_id)
+        stale = stale.where(model.device_id == device_id)
+    columns = [
+        'device_id', 'bucket_start', 'readings',
+        'hr_min', 'hr_max', 'hr_sum', 'hr_count',
+        'spo2_min', 'spo2_max', 'spo2_sum', 'spo2_count',
+        'temp_min', 'temp_max', 'temp_sum', 'temp_count'
+    ]
+    db.session.execute(stale)
+    db.session.execute(insert(model).from_select(columns, aggregates.statement))
+
+def recompact_late_buckets(model, bucket_seconds:int, after_id:int, until_id:int, before:datetime, now:datetime) -> int:
+    # Readings stored after their bucket was compacted (more than ROLLUP_GRACE_SECONDS late): ids in
+    # (after_id, until_id] with a timestamp before the watermark. Their buckets are recomputed per device, within
+    # the raw retention only (older raw days may be dropped already). Returns the number of devices recompacted.
+    late = (
+        db.session.query(DeviceRecords.device_id, func.min(DeviceRecords.timestamp), func.max(DeviceRecords.timestamp))
+        .filter(DeviceRecords.id > after_id, DeviceRecords.id <= until_id)
+        .filter(DeviceRecords.timestamp < before, DeviceRecords.timestamp >= now - timedelta(days=Config.RAW_RETENTION_DAYS))
+        .group_by(DeviceRecords.device_id)
+        .all()
+    )
+    for device_id, oldest, newest in late:
+        end = min(floor_to_bucket(newest, bucket_seconds) + timedelta(seconds=bucket_seconds), before)
+        fold_buckets(model, bucket_seconds, floor_to_bucket(oldest, bucket_seconds), end, device_id)
+    return len(late)
+
+def compact_rollup(bucket_seconds:int, now:datetime) -> Optional[datetime]:
+    """
+    Recomputes the closed buckets between the watermark and now - grace from raw rows, and the already compacted
+    buckets that received late readings since the previous run. Idempotent.
+    """
+    model = ROLLUP_MODELS[bucket_seconds]
+    watermark = db.session.get(RollupWatermark, model.__tablename__)
+    # Ids become visible in allocation order (ingest.py), so every reading up to last_id is committed and is
+    # either inside [start, end) below or before start, where the next run's late-row check finds it
+    last_id = db.session.query(func.max(DeviceRecords.id)).scalar()
+    if last_id is None:
+        return None
+    end = floor_to_bucket(now - timedelta(seconds=Config.ROLLUP_GRACE_SECONDS), bucket_seconds)
+    start = watermark.compacted_until if watermark else None
+    if start is None:
+        oldest = db.session.query(func.min(DeviceRecords.timestamp)).scalar()
+        if oldest is None:
+            return None
+        start = floor_to_bucket(oldest, bucket_seconds)
+    elif watermark.compacted_id is not None and watermark.compacted_id < last_id:
+        recompacted = recompact_late_buckets(model, bucket_seconds, watermark.compacted_id, last_id, start, now)
+        if recompacted:
+            logger.info(f"Recompacted {model.__tablename__} buckets of {recompacted} devices with late readings")
+    # Bounded chunks so a first run over a large backlog does not hold one huge transaction
+    end = min(end, start + timedelta(hours=Config.ROLLUP_MAX_CHUNK_HOURS))
+    if end > start:
+        fold_buckets(model, bucket_seconds, start, end)
+    else:
+        end = start
+    if watermark is None:
+        db.session.add(RollupWatermark(rollup_table=model.__tablename__, compacted_until=end, compacted_id=last_id))
+    else:
+        watermark.compacted_until = end
+        watermark.compacted_id = last_id
+    db.session.commit()
+    return end
+
+def partitioned() -> bool:
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'public.health_data_records'::regclass"
+    )).first() is not None
+
+def ensure_daily_partitions(today:datetime, days_ahead:int=2):
+    for offset in range(days_ahead + 1):
+        day = (today + timedelta(days=offset)).date()
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}{day:%Y%m%d} PARTITION OF health_data_records "
+            f"FOR VALUES FROM ('{day}') TO ('{day + timedelta(days=1)}')"
+        ))
+    db.session.commit()
+
+def drop_expired_partitions(today:datetime, retention_days:int) -> List[str]:
+    # A day partition is dropped once it is older than the retention and both rollups are final past its end
+    watermarks = [compacted_until(bucket_seconds) for bucket_seconds in ROLLUP_MODELS]
+    if any(watermark is None for watermark in watermarks):
+        return []
+    safe_until = min([today - timedelta(days=retention_days)] + watermarks)
+    partitions = db.session.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = 'health_data_records'"
+    )).scalars().all()
+    dropped = []
+    for name in partitions:
+        if not name.startswith(PARTITION_PREFIX):
+            continue # e.g. the default partition
+        day_end = datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d') + timedelta(days=1)
+        if day_end <= safe_until:
+            db.session.execute(text(f'DROP TABLE IF EXISTS {name}'))
+            dropped.append(name)
+    db.session.commit()
+    return dropped
+
+def run_compaction(now:Optional[datetime]=None):
+    now = now or datetime.now()
+    if db.engine.dialect.name != 'postgresql':
+        for bucket_seconds in ROLLUP_MODELS:
+            compact_rollup(bucket_seconds, now)
+        return
+    # Only one worker compacts per cycle; the others skip. The lock lives on its own connection,
+    # since the session hands its connection back to the pool on every commit.
+    with db.engine.connect() as lock_conn:
+        if not lock_conn.execute(text('SELECT pg_try_advisory_lock(:id)'), {'id': COMPACTION_LOCK_ID}).scalar():
+            return
+        try:
+            for bucket_seconds in ROLLUP_MODELS:
+                compact_rollup(bucket_seconds, now)
+            if partitioned():
+                ensure_daily_partitions(now)
+                dropped = drop_expired_partitions(now, Config.RAW_RETENTION_DAYS)
+                if dropped:
+                    logger.info(f"Dropped expired raw partitions: {dropped}")
+        finally:
+            lock_conn.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': COMPACTION_LOCK_ID})
+            lock_conn.commit()
+
+def compaction_loop(app, sleep):
+    while True:
+        try:
+            with app.app_context():
+                run_compaction()
+        except Exception as e:
+            logger.error(f"Rollup compaction failed: {str(e)}")
+        sleep(Config.ROLLUP_COMPACTION_INTERVAL)
+
+def rollups_cover(freshness:datetime, bucket_seconds:int) -> Optional[datetime]:
+    # Returns the watermark when at least one closed rollup bucket lies fully inside [freshness, now)
+    if not Config.KPI_READ_ROLLUPS:
+        return None
+    # Windows shorter than two buckets past the grace period (e.g. the 1-minute alert window) cannot be guaranteed
+    # a closed bucket: they read raw rows without looking up the watermark
+    if datetime.now() - timedelta(seconds=Config.ROLLUP_GRACE_SECONDS) - freshness < timedelta(seconds=2 * bucket_seconds):
+        return None
+    watermark = compacted_until(bucket_seconds)
+    first_full = floor_to_bucket(freshness + timedelta(seconds=bucket_seconds) - timedelta(microseconds=1), bucket_seconds)
+    if watermark is None or watermark <= first_full:
+        return None
+    return watermark
+
+def rollup_windows(device_ids:List[str], freshness:datetime, bucket_seconds:int=120) -> Optional[Dict[str, DeviceWindow]]:
+    """
+    Builds the window of every device from the closed rollup buckets inside [freshness, watermark) plus the raw
+    rows of the edges. Returns None when the rollups do not cover any part of the window (caller reads raw rows).
+    """
+    watermark = rollups_cover(freshness, bucket_seconds)
+    if watermark is None:
+        return None
+    model = ROLLUP_MODELS[bucket_seconds]
+    first_full = floor_to_bucket(freshness + timedelta(seconds=bucket_seconds) - timedelta(microseconds=1), bucket_seconds)
+    windows:Dict[str, DeviceWindow] = {device_id: DeviceWindow(bucket_seconds) for device_id in device_ids}
+    if not device_ids:
+        return windows
+
+    buckets = (
+        db.session.query(
+            model.device_id, model.bucket_start,
+            model.hr_sum, model.hr_count, model.spo2_sum, model.spo2_count, model.temp_sum, model.temp_count
+        )
+        .filter(model.device_id.in_(device_ids))
+        .filter(model.bucket_start >= first_full, model.bucket_start < watermark)
+        .all()
+    )
+    for device_id, bucket_start, *sums in buckets:
+        windows[device_id].fold_bucket(bucket_of(bucket_start, bucket_seconds), *sums)
+
+    edges = (
+        db.session.query(
+            DeviceRecords.id, DeviceRecords.heart_rate, DeviceRecords.spo2, DeviceRecords.temperature,
+            DeviceRecords.timestamp, DeviceRecords.device_id
+        )
+        .filter(DeviceRecords.device_id.in_(device_ids))
+        .filter(
+            or_(
+                and_(DeviceRecords.timestamp >= freshness, DeviceRecords.timestamp < first_full),
+                DeviceRecords.timestamp >= watermark
+            )
+        )
+        .order_by(DeviceRecords.id)
+        .all()
+    )
+    for row in edges:
+        windows[row[5]].fold([tuple(row[:5])])
+    return windows
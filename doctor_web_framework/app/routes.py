@@ -1,20 +1,37 @@
-from flask import Blueprint, render_template, redirect, url_for, request, session, jsonify
+from flask import Blueprint, render_template, redirect, url_for, request, session, jsonify, Response
 from flask_login import login_user, logout_user, login_required, current_user
 from .dataModel import Doctor, Device, DoctorDeviceMapping, DeviceRecords, Owner, MedicalRecords, PatientMessage, db
 from flask_socketio import join_room, leave_room
-from . import login_manager, socketio, thread_lock, redis_client, app, user_threads, stop_signals, user_sessions, patients_session, logger
+from . import login_manager, socketio, socketio_serializer, thread_lock, redis_client, app, user_threads, stop_signals, user_sessions, patients_session, logger
 from flask_caching import Cache
-from typing import List, Dict
+from typing import List, Dict, Tuple
 from datetime import datetime, timedelta
 from sqlalchemy import func, or_, distinct, and_
-from config import HealthConditions
-import pandas as pd
-import json
-import math
-import threading
+import numpy as np
+import redis
+from config import Config, HealthConditions
+from .kpi_engine import compute_kpis_batched, compute_roster_kpis, cached_device_kpis, dashboard_payload, fetch_device_roster, fetch_patient_roster, kpi_cache
+from .fleet_poller import FleetPoller
+from .tick_scheduler import alert_signal, dashboard_signal, poller_scheduler
+from .task_registry import RedisRegistry, SelectionStore
+from .dashboard_delta import DeltaTracker
+from .conditions import critical_condition_payloads_batch, device_means
+from .rollups import rollup_windows
+from .latest_state import fetch_latest_states, latest_state_payloads
+from .message_writer import MessageWriter
+from .alert_state import AlertStateMachine, history_recorder
+from .outbound import ACK_ALL, OutboundQueue
+from .db_pool import pool_stats
+from .query_profiler import recent_profiles
+from .metrics import Gauge, registry as metrics_registry, render as render_metrics
 
 main = Blueprint('main', __name__, url_prefix='/')
 
+@main.app_context_processor
+def socketio_client():
+    # The pages load the Socket.IO client bundle matching the server's packet encoding
+    return {'socketio_serializer': socketio_serializer}
+
 @login_manager.user_loader
 def load_user(user_id):
     # return Doctor.query.filter_by(id = user_id).get(Doctor.email)
@@ -67,145 +84,19 @@ def login():
 def logout():
     email = request.form.get('email')
 
-    # Gracefully stop background threads and clean up resources
-    if email in stop_signals:
-        stop_signals[email].set()
+    # Stop pushing updates to the doctor's room and clean up resources
+    dashboard_poller.unsubscribe(email)
+    alert_poller.unsubscribe(email)
     
     with thread_lock:
-        user_threads.pop(email, None)
-        stop_signals.pop(email, None)
         user_sessions.pop(email, None)
     logout_user()
     return redirect(url_for('main.login'))
 
-# Function to convert string timestamp to datetime
-def convert_string_to_datetime(timestamp_str:str):
-    return datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-
-# Function to replace Non-Numeric records with None/Null for JavaScript parsing
-def clean_graph_data(graph_data):
-    # Replace NaN values with None, which translates to null in JSON
-    graph_data['y_heart_rate'] = [None if math.isnan(v) else v for v in graph_data['y_heart_rate']]
-    graph_data['y_spo2'] = [None if math.isnan(v) else v for v in graph_data['y_spo2']]
-    return graph_data
-
 # Master function to compute the relevant KPIs for each patient
 def compute_kpis(doctor_email:str, patients:list, patient_usernames:list, redis_conn:Cache, kpi_freshness:int) -> Dict[str, dict]:
-
-    device_owners:dict = {}
-    graphs:dict ={}
-    personal_traits:dict ={}
-    medical_histories:dict ={}
-    avg_temps:dict ={}
-    json_blob:dict = {}
-
-    # Set KPI freshness
-    freshness = datetime.now() - timedelta(hours=kpi_freshness)
-    
-    # Retrieve the devices associated to a doctor
-    devices:List[Device] = db.session.query(Device).join(DoctorDeviceMapping).filter(DoctorDeviceMapping.doctor_id == doctor_email).all()
-    devices = (
-        db.session.query(Device)
-        .join(Owner, Device.device_owner == Owner.owner_username)
-        .join(DoctorDeviceMapping, DoctorDeviceMapping.device_id == Device.device_id)
-        .filter(DoctorDeviceMapping.doctor_id == doctor_email)
-        .filter(
-            and_(
-                Owner.owner_name.in_(patients),
-                Owner.owner_username.in_(patient_usernames)
-            ) #+add only the selected useername from User_id split
-        )
-        .all()
-    )
-    for device in devices:
-        device_data:List[DeviceRecords] = DeviceRecords.query.filter_by(
-            device_id=device.device_id # Devices belonging to a doctor
-        ).filter(
-            func.to_timestamp(DeviceRecords.timestamp, 'YYYY-MM-DD HH24:MI:SS') >= freshness
-        ).all()
-        # Plot KPI
-        # =================
-        data = {
-            'Timestamp': [convert_string_to_datetime(record.timestamp) for record in device_data],
-            'Heart Rate': [record.heart_rate for record in device_data],
-            'SpO2': [record.spo2 for record in device_data],
-            'Temperature': [record.temperature for record in device_data]
-        }
-        df = pd.DataFrame(data)
-        df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-        df.set_index('Timestamp', inplace=True)
-        df_resampled = df.resample('2min').mean()
-
-        # if compute_type == "refresh":
-        graph_data = {
-            'x': df_resampled.index.strftime('%Y-%m-%dT%H:%M:%S').tolist(),
-            'y_heart_rate': df_resampled['Heart Rate'].tolist(),
-            'y_spo2': df_resampled['SpO2'].tolist(),
-            'device_owner': device.device_owner
-        }
-        # Clean the data before sending
-        graph_data = clean_graph_data(graph_data)
-        graphs[device.device_owner] = json.dumps(graph_data)
-        # else:
-        #     graph_data = {
-        #         'x': [],
-        #         'y_heart_rate': [],
-        #         'y_spo2': [],
-        #         'device_owner': device.device_owner
-        #     }
-        #     graphs[device.device_owner] = json.dumps(graph_data)
-        # Body temperature KPI
-        # =====================
-        # avg_temp = get_avg_temperature(device.device_id)
-        if len(data['Temperature']) > 0:
-            avg_temp = round(sum(data['Temperature']) / len(data['Temperature']), 2)
-        else:
-            avg_temp = -1.0
-        avg_temps[device.device_owner] = float(avg_temp) # Log Patient's body temperature to JSON Blob object
-
-        # Patient's personal metadata
-        # ============================
-        owner:Owner = Owner.query.filter_by(owner_username=device.device_owner).first()
-        personal_traits[device.device_owner] = {
-            'name': owner.owner_name,
-            'age': owner.age,
-            'gender': owner.gender
-        } # Log Patient's personal metadata to JSON Blob object
-
-        # Patient's Medical history
-        # ===========================
-        medical_history:MedicalRecords = MedicalRecords.query.filter_by(medical_history_record_id=owner.medical_history_record_id).first()
-        medical_histories[device.device_owner] = {
-            'chronic_conditions': medical_history.chronic_conditions,
-            'family_history': medical_history.family_history,
-            'smoking': medical_history.smoking,
-            'alcohol_usage': medical_history.alcohol_usage,
-            'allergies': medical_history.allerges,
-            'medication': medical_history.medication
-        } # Log Patient's medical metadata to JSON Blob object
-
-        # Append device owner
-        device_owners[device.device_owner] = owner.owner_name
-
-        redis_conn.set(
-            device.device_owner,
-            {
-                'device_owners': device_owners[device.device_owner],
-                'graphs': graphs[device.device_owner],
-                'personal_traits': personal_traits[device.device_owner],
-                'medical_histories': medical_histories[device.device_owner],
-                'avg_temps': avg_temps[device.device_owner]
-            }
-        )
-
-    json_blob:Dict[str, dict] = {
-        'device_owners': device_owners,
-        'graphs': graphs,
-        'personal_traits': personal_traits,
-        'medical_histories': medical_histories,
-        'avg_temps': avg_temps
-    }
-    return json_blob
+    # Batched engine: a constant number of queries regardless of the number of patients
+    return compute_kpis_batched(doctor_email, patients, patient_usernames, redis_conn, kpi_freshness)
 
 # Valid option without bugs for backgorund_thread
 # def background_thread(doctor_email:str, patients:list):
@@ -257,151 +148,191 @@ def reverse_engineer_username(concatenated_value:str):
     return username_part
 
 
-def background_thread(doctor_email: str):
-    global stop_signals, patients_session
-
-    if not stop_signals[doctor_email]:
-        logger.info(f"No stop signal for {doctor_email}, exiting thread.")
-        return
-
-    try:
-        while not stop_signals[doctor_email].is_set():
-            logger.info(f"Fetching data for {doctor_email}")
-
-            # Fetch the latest patient list dynamically from patients_session
-            patients = patients_session.get(doctor_email, [])
-            if not patients:
-                logger.info(f"No patients for {doctor_email}, waiting for updates")
-                socketio.sleep(5)
-                continue  # If no patients, wait for updates
-            
-            patients_names:list = [reverse_engineer_names(value) for value in patients]
-            patients_usernames:list = [reverse_engineer_username(value) for value in patients]
-            assert len(patients_names) == len(patients_usernames)
-            logger.info(f"Fetching names for patients: {patients_names}")
-            logger.info(f"Fetching usernames for patients: {patients_usernames}")
-            with app.app_context():
-                computed_records = compute_kpis(doctor_email, patients_names, patients_usernames, redis_client, 2)
-                for id, name in computed_records['device_owners'].items():
-                    logger.info(f"Emitting data for patient {name} (ID: {id})")
-                    socketio.emit(
-                        'update_patient_data',
-                        {
-                            'device_owner': id,
-                            'avg_temp': computed_records['avg_temps'][id],
-                            'graph_data': computed_records['graphs'][id],
-                            'personal_traits': computed_records['personal_traits'][id],
-                            'medical_history': computed_records['medical_histories'][id]
-                        },
-                        room=doctor_email
-                    )
-            # Sleep for 5 seconds before fetching data again
-            socketio.sleep(5)
-    except Exception as e:
-        logger.error(f"Error in background thread for {doctor_email}: {str(e)}")
-    finally:
-        logger.info(f"Background thread for {doctor_email} stopped.")
-
-def monitor_critical_condition(doctor_email:str):
-    temp_normal, temp_hypothermi, temp_mild, temp_critical = HealthConditions.Temperature()
-    hr_natural, hr_mild, hr_critical = HealthConditions.HeartRate()
-    spo2_natural, spo2_mild, spo2_critical = HealthConditions.SpO2()
-    critical, mild, hypothermia, normal = HealthConditions.Colours()
-    
-    messages = HealthConditions.Messages()
-    
-    while not stop_signals[doctor_email].is_set():
-        with app.app_context():
-            freshness = datetime.now() - timedelta(minutes=1)
-            devices:List[Device] = (
-                db.session.query(Device)
-                .join(DoctorDeviceMapping, Device.device_id == DoctorDeviceMapping.device_id)
-                .join(DeviceRecords, Device.device_id == DeviceRecords.device_id)
-                .filter(DoctorDeviceMapping.doctor_id == doctor_email)
-                .filter(
-                    (func.to_timestamp(DeviceRecords.timestamp, 'YYYY-MM-DD HH24:MI:SS') >= freshness) &
-                    (
-                        or_(
-                            DeviceRecords.temperature < temp_hypothermi,
-                            DeviceRecords.temperature > temp_mild,
-                            DeviceRecords.heart_rate >= hr_mild,
-                            DeviceRecords.spo2 <= spo2_mild
+def dashboard_payloads(device_ids:List[str]) -> Dict[str, dict]:
+    # KPIs of every watched device, computed once per tick whatever the number of doctors watching it
+    with app.app_context():
+        roster = fetch_device_roster(device_ids)
+        computed_records = compute_roster_kpis(roster, redis_client, 2)
+        return {device.device_id: dashboard_payload(device.device_owner, computed_records) for device, _, _ in roster}
+
+def cached_dashboard_payloads(device_ids:List[str]) -> Dict[str, dict]:
+    # Initial loads and new selections: served from the KPI cache, only the devices without a fresh entry are computed
+    with app.app_context():
+        return cached_device_kpis(device_ids, redis_client, 2)
+
+def critical_condition_payloads(device_ids:List[str]) -> Dict[str, dict]:
+    _, temp_hypothermi, temp_mild, _ = HealthConditions.Temperature()
+    _, hr_mild, _ = HealthConditions.HeartRate()
+    _, spo2_mild, _ = HealthConditions.SpO2()
+
+    payloads:Dict[str, dict] = {}
+    with app.app_context():
+        freshness = datetime.now() - timedelta(minutes=Config.ALERT_WINDOW_MINUTES)
+        if Config.ALERT_LATEST_STATE:
+            # Flagged devices and their window means from device_latest_state (latest_state.py), by primary key.
+            # Without the table (migration 004 not applied) every device is scanned as before
+            try:
+                states = fetch_latest_states(device_ids)
+            except Exception as e:
+                logger.error(f"Latest state lookup failed, scanning the raw window: {str(e)}")
+                db.session.rollback()
+                states = {}
+            payloads.update(latest_state_payloads([
+                state for state in states.values() if state.flagged_until is not None and state.flagged_until >= freshness
+            ]))
+            # Devices the ingest worker has not written a state for yet are scanned as before
+            device_ids = [device_id for device_id in device_ids if device_id not in states]
+            if not device_ids:
+                return payloads
+        devices:List[Tuple[Device, Owner]] = (
+            db.session.query(Device, Owner)
+            .join(Owner, Device.device_owner == Owner.owner_username)
+            .filter(Device.device_id.in_(device_ids))
+            .filter(
+                Device.device_id.in_(
+                    db.session.query(DeviceRecords.device_id)
+                    .filter(DeviceRecords.device_id.in_(device_ids))
+                    .filter(
+                        (DeviceRecords.timestamp >= freshness) &
+                        (
+                            or_(
+                                DeviceRecords.temperature < temp_hypothermi,
+                                DeviceRecords.temperature > temp_mild,
+                                DeviceRecords.heart_rate >= hr_mild,
+                                DeviceRecords.spo2 <= spo2_mild
+                            )
                         )
                     )
                 )
-                .all()
             )
+            .all()
+        )
 
-            if devices:
-                for device in devices:
-                    device_data:List[DeviceRecords] = DeviceRecords.query.filter_by(
-                        device_id=device.device_id
-                    ).filter(
-                        func.to_timestamp(DeviceRecords.timestamp, 'YYYY-MM-DD HH24:MI:SS') >= freshness
-                    ).all()
-                    owner:Owner = Owner.query.filter_by(owner_username=device.device_owner).first()
-                    temperatures = [ record.temperature if record.temperature is not None else -1.0 for record in device_data ]
-                    heart_rates = [ record.heart_rate if record.heart_rate is not None else -1.0 for record in device_data ]
-                    spo2s = [ record.spo2 if record.spo2 is not None else -1.0 for record in device_data ]
-
-                    temperature = float(round(sum(temperatures) / len(temperatures), 2) if temperatures else -1.0)
-                    heart_rate = float(round(sum(heart_rates) / len(heart_rates), 2) if heart_rates else -1.0)
-                    spo2 = float(round(sum(spo2s) / len(spo2s), 2) if spo2s else -1.0)
-
-                    mapping_conditions = {
-                        'critical_temp': temperature >= temp_critical,
-                        'mild_temp': (temperature >= temp_mild) and (temperature < temp_critical),
-                        'hypothermia': (temperature < temp_hypothermi),
-                        'normal_temp': (temperature >= temp_hypothermi) and (temperature <= temp_normal),
-                        'critical_hr': heart_rate >= hr_critical,
-                        'mild_hr': (heart_rate >= hr_mild) and (heart_rate < hr_critical),
-                        'normal_hr': (heart_rate > hr_natural) and (heart_rate < hr_mild),
-                        'critical_spo2': spo2 <= spo2_critical,
-                        'mild_spo2': (spo2 > spo2_critical) and (spo2 <= spo2_mild),
-                        'normal_spo2': (heart_rate > spo2_mild),
-                    }
-
-                    # Emit the general KPI data (for the circle widget to update colors)
-                    socketio.emit('patient_notification', {
-                        'device_owner': owner.owner_name,
-                        'temperature_metadata': {
-                            "value": temperature,
-                            "color":
-                                critical if mapping_conditions['critical_temp'] else 
-                                mild if mapping_conditions['mild_temp'] else 
-                                hypothermia if mapping_conditions['hypothermia'] else 
-                                normal,
-                            "message":
-                                messages['critical_temp'] if mapping_conditions['critical_temp'] else
-                                messages['mild_temp'] if mapping_conditions['mild_temp'] else
-                                messages['hypothermia'] if mapping_conditions['hypothermia'] else
-                                messages['normal_temp']
-                        },
-                        'heartrate_metadata': {
-                            "value": heart_rate,
-                            "color":
-                                critical if (mapping_conditions['critical_hr']) or (heart_rate < hr_natural) else
-                                mild if mapping_conditions['mild_hr'] else
-                                normal,
-                            "message":
-                                messages['critical_hr'] if mapping_conditions['critical_hr'] else
-                                messages['mild_hr'] if mapping_conditions['mild_hr'] else
-                                messages['below_thresh_hr'] if heart_rate < hr_natural else
-                                messages['normal_hr']
-                        },
-                        'spo2_metadata': {
-                            "value": spo2,
-                            "color": 
-                                critical if mapping_conditions['critical_spo2'] else
-                                mild if mapping_conditions['mild_spo2'] else
-                                normal,
-                            "message":
-                                messages['critical_spo2'] if mapping_conditions['critical_spo2'] else
-                                messages['mild_spo2'] if mapping_conditions['mild_spo2'] else
-                                messages['normal_spo2']
-                        }
-                    }, room=doctor_email)
-            socketio.sleep(15)
+        if devices:
+            flagged_ids = [device.device_id for device, _ in devices]
+            # Closed 1-minute rollups plus raw edges when the alert window is long enough for them to exist
+            windows = rollup_windows(flagged_ids, freshness, 60)
+            if windows is not None:
+                means = [[float(value) if value is not None else -1.0 for value in windows[device_id].means()] for device_id in flagged_ids]
+                temperatures, heart_rates, spo2s = np.array(means, dtype=float).reshape(-1, 3).T
+            else:
+                # One query for the readings of every flagged device, averaged with a single group-by
+                readings = (
+                    db.session.query(DeviceRecords.device_id, DeviceRecords.temperature, DeviceRecords.heart_rate, DeviceRecords.spo2)
+                    .filter(DeviceRecords.device_id.in_(flagged_ids))
+                    .filter(DeviceRecords.timestamp >= freshness)
+                    .all()
+                )
+                device_column, temperature_column, heart_rate_column, spo2_column = zip(*readings) if readings else ((), (), (), ())
+                means = device_means(device_column, temperature_column, heart_rate_column, spo2_column).reindex(flagged_ids).fillna(-1.0)
+                temperatures, heart_rates, spo2s = means['temperature'].to_numpy(), means['heart_rate'].to_numpy(), means['spo2'].to_numpy()
+
+            batch = critical_condition_payloads_batch([owner.owner_name for _, owner in devices], temperatures, heart_rates, spo2s)
+            payloads.update(zip(flagged_ids, batch))
+    return payloads
+
+def emit_to_room(event:str, payload:dict, room:str):
+    socketio.emit(event, payload, room=room)
+
+def emit_batch_to_room(event:str, payloads:List[dict], room:str):
+    socketio.emit('update_patient_batch', {'frames': payloads}, room=room)
+
+# One dashboard loop (every 5 seconds) and one critical-condition loop (every 15 seconds) for the whole fleet.
+# With ADAPTIVE_TICKS (off by default, see config.py) those are the refresh intervals of normal devices; critical
+# ones are recomputed every second and steady ones back off (tick_scheduler.py), dashboards up to a minute. Alerts
+# do not back off past their 15 s: a sudden deterioration of a steady patient would otherwise be noticed late.
+# In streaming mode the Kafka consumer pushes the updates and the pollers only keep the subscriptions.
+# Dashboards get a snapshot on subscribe and sequence-numbered deltas afterwards (dashboard_delta.py); notification
+# pages get their active alerts on subscribe and afterwards only alert transitions and heartbeats (alert_state.py).
+# Both go through per-room outbound queues: a slow page gets the newest frame per device at the pace it
+# acknowledges them, instead of a growing backlog (outbound.py). With SOCKETIO_BATCH a dashboard gets the frames
+# of a tick as one 'update_patient_batch' event: one Redis publish and one websocket frame per doctor and tick.
+# With TASK_REGISTRY=redis the subscriptions are shared by all workers and one of them runs each loop
+# (task_registry.py); the streaming consumer runs in every worker, so its subscriptions stay per process.
+registry_client = redis.Redis.from_url(Config.TASK_REGISTRY_URL) if Config.TASK_REGISTRY == 'redis' else None
+
+def poller_registry(name:str):
+    if Config.TASK_REGISTRY != 'redis' or Config.KPI_STREAMING:
+        return None
+    return RedisRegistry(registry_client, name, Config.TASK_LEASE_TTL)
+
+def tick_scheduler(signal, interval:float, stable_max_interval:float):
+    # Severity-aware scheduling of the devices of one poller (tick_scheduler.py)
+    return poller_scheduler(signal, interval, stable_max_interval) if Config.ADAPTIVE_TICKS else None
+
+def alert_state_machine():
+    # Transition-only notifications with hysteresis, every change kept in alert_history (alert_state.py)
+    if not Config.ALERT_TRANSITIONS:
+        return None
+    bands = (Config.ALERT_BAND_TEMPERATURE, Config.ALERT_BAND_HEART_RATE, Config.ALERT_BAND_SPO2)
+    return AlertStateMachine(bands, Config.ALERT_MIN_DWELL, Config.ALERT_HEARTBEAT_INTERVAL, history_recorder(app))
+
+def outbound_queue(event:str, coalesce, registry):
+    # Bounded, acknowledged delivery of a poller's frames per room (outbound.py); None: socketio.emit as is
+    if not Config.OUTBOUND_QUEUE:
+        return None
+    acks = registry.drain_acks if registry is not None else None
+    batch_event = 'update_patient_batch' if event == 'update_patient_data' and Config.SOCKETIO_BATCH else None
+    return OutboundQueue(event, emit_to_room, socketio.start_background_task, socketio.sleep, Config.OUTBOUND_WINDOW, Config.OUTBOUND_QUEUE_LIMIT, Config.OUTBOUND_ACK_TIMEOUT, coalesce, acks, Config.TASK_REQUEST_POLL, batch_event)
+
+def dashboard_emit_batch(outbound):
+    # emit_batch of the dashboard poller (None: one event per frame)
+    if not Config.SOCKETIO_BATCH:
+        return None
+    return outbound.send_batch if outbound is not None else emit_batch_to_room
+
+dashboard_delta, dashboard_registry = DeltaTracker(), poller_registry('dashboard')
+dashboard_outbound = outbound_queue('update_patient_data', dashboard_delta.coalesce, dashboard_registry)
+alert_delta, alert_registry = alert_state_machine(), poller_registry('critical-condition')
+alert_outbound = outbound_queue('patient_notification', AlertStateMachine.coalesce, alert_registry)
+dashboard_poller = FleetPoller('dashboard', 'update_patient_data', 5, dashboard_payloads, dashboard_outbound.send if dashboard_outbound else emit_to_room, socketio.start_background_task, socketio.sleep, polling=not Config.KPI_STREAMING, lookup=cached_dashboard_payloads, delta=dashboard_delta, registry=dashboard_registry, request_poll=Config.TASK_REQUEST_POLL, scheduler=tick_scheduler(dashboard_signal, 5, Config.TICK_STABLE_MAX_INTERVAL), emit_batch=dashboard_emit_batch(dashboard_outbound))
+alert_poller = FleetPoller('critical-condition', 'patient_notification', 15, critical_condition_payloads, alert_outbound.send if alert_outbound else emit_to_room, socketio.start_background_task, socketio.sleep, polling=not Config.KPI_STREAMING, delta=alert_delta, registry=alert_registry, request_poll=Config.TASK_REQUEST_POLL, scheduler=tick_scheduler(alert_signal, 15, Config.TICK_ALERT_STABLE_MAX_INTERVAL))
+outbound_queues = {outbound.event: (poller, outbound) for poller, outbound in ((dashboard_poller, dashboard_outbound), (alert_poller, alert_outbound)) if outbound is not None}
+# Doctor -> patient messages are saved, published and acknowledged in batches by one writer loop
+message_writer = MessageWriter(app, emit_to_room, socketio.start_background_task, Config.MESSAGE_BATCH_SIZE, Config.MESSAGE_FLUSH_INTERVAL, Config.MESSAGE_QUEUE_LIMIT)
+# Patients selected on each dashboard, needed again when the page reconnects (possibly to another worker)
+selections = SelectionStore(patients_session, registry_client)
+
+def socketio_rooms() -> Dict[str, int]:
+    # Doctor rooms of this worker -> connected sessions (every session also sits in a room named after its sid)
+    rooms = socketio.server.manager.rooms.get('/', {}) if socketio.server is not None else {}
+    sids = set(rooms.get(None, ()))
+    return {room: len(members) for room, members in rooms.items() if room is not None and room not in sids}
+
+for metric in (
+    Gauge('poller_running', 'Whether the fleet poller loop runs in this worker.', ['poller'],
+          lambda: {(poller.name,): int(poller.running) for poller in (dashboard_poller, alert_poller)}),
+    Gauge('poller_leader', 'Whether this worker computes the ticks of the fleet poller.', ['poller'],
+          lambda: {(poller.name,): int(poller.running and poller.leading) for poller in (dashboard_poller, alert_poller)}),
+    Gauge('poller_watched_devices', 'Distinct devices watched by the fleet poller.', ['poller'],
+          lambda: {(poller.name,): len(poller.watched()) for poller in (dashboard_poller, alert_poller)}),
+    Gauge('socketio_rooms', 'Doctor rooms with a Socket.IO session on this worker.', function=lambda: len(socketio_rooms())),
+    Gauge('socketio_room_sessions_max', 'Sessions of the largest doctor room on this worker.', function=lambda: max(socketio_rooms().values(), default=0)),
+    Gauge('outbound_queued_frames', 'Frames waiting in the outbound queues of this worker.', ['event'],
+          lambda: {(event,): outbound.stats()['queued'] for event, (_, outbound) in outbound_queues.items()}),
+    Gauge('outbound_queued_frames_max', 'Frames waiting in the largest room queue of this worker.', ['event'],
+          lambda: {(event,): outbound.stats()['queued_max'] for event, (_, outbound) in outbound_queues.items()}),
+    Gauge('outbound_in_flight_frames', 'Frames sent by this worker and not acknowledged yet.', ['event'],
+          lambda: {(event,): outbound.stats()['in_flight'] for event, (_, outbound) in outbound_queues.items()}),
+    Gauge('kpi_cache_entries', 'Entries of the in-process KPI cache.', function=lambda: kpi_cache.stats()['l1_entries']),
+    Gauge('db_pool_checkout_wait_p99_seconds', 'p99 wait for a database connection (recent checkouts).', function=lambda: pool_stats.report()['p99_wait_ms'] / 1000)
+):
+    metrics_registry.register(metric)
+
+def selected_device_ids(doctor_email:str, patients:list) -> List[str]:
+    # Devices behind the patients selected on the dashboard (entries are "<normalized name>_<username>")
+    if not patients:
+        return []
+    patients_names:list = [reverse_engineer_names(value) for value in patients]
+    patients_usernames:list = [reverse_engineer_username(value) for value in patients]
+    roster = fetch_patient_roster(doctor_email, patients_names, patients_usernames)
+    return [device.device_id for device, _, _ in roster]
+
+def mapped_device_ids(doctor_email:str) -> List[str]:
+    return [
+        mapping.device_id for mapping in
+        db.session.query(DoctorDeviceMapping.device_id).filter(DoctorDeviceMapping.doctor_id == doctor_email).all()
+    ]
 
 def get_notifications_info(email:str) -> str:
     doctor_info:Doctor = db.session.query(Doctor).filter(Doctor.email == email).first()
@@ -459,7 +390,7 @@ def fetch_patients(doctor_email:str):
 def get_patients():
     try:
         data = request.get_json()
-        logger.info("My email is: " + str(data))
+        logger.debug("My email is: " + str(data))
         
         if not data or 'email' not in data:
             return jsonify({'error': 'Invalid input'}), 400
@@ -472,7 +403,7 @@ def get_patients():
         
         # Fetch patient names associated with the doctor's email
         owner_names = fetch_patients(email)
-        logger.info(owner_names)
+        logger.debug(owner_names)
         
         if not owner_names:
             return jsonify({'patients': []}), 200
@@ -487,7 +418,7 @@ def get_patients():
 @login_required
 def dashboard():
     patient_names = fetch_patients(current_user.email)
-    logger.info(patient_names)
+    logger.debug(patient_names)
     return render_template(
         'dashboard.html',
         patients=patient_names
@@ -500,6 +431,37 @@ def notification():
     doctor_name = get_notifications_info(email)
     return render_template('notification.html', message="No critical conditions found", doctor_name = doctor_name)
 
+@main.route('/cache/stats')
+@login_required
+def cache_stats():
+    # Hit/miss/eviction counters of the KPI cache of this worker process
+    return jsonify(kpi_cache.stats()), 200
+
+@main.route('/db/stats')
+@login_required
+def db_stats():
+    # Connection pool of this worker process: checkout wait times and current usage
+    return jsonify(dict(pool_stats.report(), pool=db.engine.pool.status())), 200
+
+@main.route('/db/profile')
+@login_required
+def db_profile():
+    # Query profiles of the last requests and poller ticks of this worker process (Config.QUERY_PROFILING)
+    return jsonify({'enabled': Config.QUERY_PROFILING, 'profiles': list(recent_profiles)}), 200
+
+@main.route('/outbound/stats')
+@login_required
+def outbound_stats():
+    # Outbound queues of this worker process: queued and unacknowledged frames per event
+    return jsonify({event: outbound.stats() for event, (_, outbound) in outbound_queues.items()}), 200
+
+@main.route('/metrics')
+def metrics():
+    # Prometheus scrape of this worker process (no login session; optionally guarded by Config.METRICS_TOKEN)
+    if Config.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {Config.METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized access'}), 403
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 # @socketio.on('get_patient_data')
 # def handle_patients(data:Dict[str, str]):
 #     global user_threads, stop_signals, patients_session
@@ -666,76 +628,52 @@ def notification():
 @socketio.on('get_patient_data')
 @login_required
 def handle_patients(data: dict):
-    global user_threads, stop_signals, patients_session
-    with thread_lock:
-        sid = request.sid
-        email: str = data.get('email')
-        new_patients: list = data.get('patients')
+    # The selection and the subscription are the signed-in doctor's own, whatever email the page sends
+    sid = request.sid
+    email: str = current_user.email
+    new_patients: list = data.get('patients') or []
 
+    with thread_lock:
         user_sessions[email] = sid
-        # join_room(email, sid=sid)
+        existing_patients = selections.get(email)
+        logger.debug(f"Existing patients: {existing_patients}")
+        logger.debug(f"New patients: {new_patients}")
+        selections.set(email, new_patients)
 
-        if email not in stop_signals:
-            stop_signals[email] = threading.Event()
+    # Optionally emit a message to the client about removed patients
+    removed_patients = list(set(existing_patients) - set(new_patients))
+    if removed_patients:
+        logger.debug(removed_patients)
+        socketio.emit('remove_patients', {'removed_patients': removed_patients}, room=email)
 
-        if email not in patients_session: #The first time starting the app. The first time user logs.
-            logger.info(f"1-Starting new thread for {email} with patients {new_patients}")
-            patients_session[email] = new_patients
-            user_threads[email] = socketio.start_background_task(background_thread, email)
-        
-        else:
-            if email and new_patients:
-                # If the thread already exists, update the patient list dynamically
-                if email in user_threads:
-                    existing_patients = patients_session.get(email, [])
-                    logger.info(f"Existing patients: {existing_patients}")
-                    logger.info(f"New patients: {new_patients}")
-
-                    # Update the patient list for the existing thread
-                    patients_session[email] = new_patients
-                    logger.info(f"Updated patient list for {email} in the existing thread")
-
-                    # Optionally emit a message to the client about removed patients
-                    removed_patients = list(set(existing_patients) - set(new_patients))
-                    if removed_patients:
-                        logger.info(removed_patients)
-                        socketio.emit('remove_patients', {'removed_patients': removed_patients}, room=email)
-                else:
-                    # If no existing thread, start a new one
-                    logger.info(f"2-Starting new thread for {email} with patients {new_patients}")
-                    patients_session[email] = new_patients
-                    user_threads[email] = socketio.start_background_task(background_thread, email)
-            else:
-                logger.info("No patients selected or missing email.")
+    # Subscribe the doctor's room to the selected devices of the shared dashboard poller
+    dashboard_poller.subscribe(email, selected_device_ids(email, new_patients), sid)
+    dashboard_poller.push_now(email)
 
 @socketio.on('user_info')
 def handle_connect(data:Dict[str, str]):
-    global user_threads, stop_signals
-    with thread_lock:
-        if current_user.is_authenticated:
-            sid = request.sid
-            email = data.get('email')
-            page = data.get('page')
+    if current_user.is_authenticated:
+        sid = request.sid
+        email = current_user.email # not the page's: its acknowledgements and subscriptions are reset below
+        page = data.get('page')
 
+        with thread_lock:
             user_sessions[email] = sid
-            join_room(email, sid=sid)
-
-            if email not in stop_signals:
-                stop_signals[email] = threading.Event()
-            else:
-                stop_signals[email].clear()
+        join_room(email, sid=sid)
 
-            if page == '/notification':
-                if (email not in user_threads) or (not user_threads[email].is_alive()):
-                    user_threads[email] = socketio.start_background_task(monitor_critical_condition, email)
-            else:
-                logger.info("Received message from invalid client. Please check the rendering page.")
+        if page == '/notification':
+            # Watch every device mapped to the doctor on the shared critical-condition poller
+            acknowledge('patient_notification', email, ACK_ALL) # frames in flight to an earlier page are gone
+            alert_poller.subscribe(email, mapped_device_ids(email), sid)
+            if Config.ALERT_TRANSITIONS:
+                alert_poller.push_now(email) # alerts already active are not sent again by the ticks
         else:
-            logger.info("User is not authenticated. Background thread will not start yet.")
+            logger.info("Received message from invalid client. Please check the rendering page.")
+    else:
+        logger.info("User is not authenticated. Background thread will not start yet.")
 
 @socketio.event
 def disconnect():
-    global user_threads, stop_signals
     email = request.args.get('email')
     sid = request.sid
     
@@ -743,19 +681,18 @@ def disconnect():
         leave_room(email, sid=sid)
         del user_sessions[email]
 
-    # Check if there is a stop_signal for this email
-    stop_signal = stop_signals.get(email)
-    if stop_signal:
-        stop_signal.set()  # Gracefully stop any background threads
-
-    with thread_lock:
-        # Safely remove user threads and stop signals
-        user_threads.pop(email, None)  # Remove if exists, otherwise do nothing
-        stop_signals.pop(email, None)  # Remove if exists, otherwise do nothing
+    # Drop the subscriptions made by this connection; the pollers stop once nobody is subscribed
+    dashboard_poller.unsubscribe_sid(sid)
+    alert_poller.unsubscribe_sid(sid)
 
 @socketio.on('rejoin')
 def handle_rejoin(data:dict):
-    email = data.get('email')
+    # Only the signed-in doctor's own room: the acknowledgements reset below would release its delivery windows
+    # and the subscriptions would move to this connection
+    if not current_user.is_authenticated:
+        logger.info("User is not authenticated. Rejoin ignored.")
+        return
+    email = current_user.email
     sid = request.sid
     page = data.get('page')
 
@@ -763,15 +700,47 @@ def handle_rejoin(data:dict):
         user_sessions[email] = sid
         join_room(email, sid=sid)
         
-        # Optionally restart or verify background thread here
-        with thread_lock:
-            if page == '/dashboard':
-                if (email not in user_threads) or (not user_threads[email].is_alive()):
-                    user_threads[email]['monitor_patient'] = socketio.start_background_task(background_thread, email)
+        # Restore the subscription of the reconnected page; frames may have been missed, so start over from snapshots
+        if page == '/dashboard':
+            acknowledge('update_patient_data', email, ACK_ALL)
+            dashboard_poller.subscribe(email, selected_device_ids(email, selections.get(email)), sid)
+            dashboard_poller.push_now(email)
+        elif page == '/notification':
+            acknowledge('patient_notification', email, ACK_ALL)
+            alert_poller.subscribe(email, mapped_device_ids(email), sid)
+            if Config.ALERT_TRANSITIONS:
+                alert_poller.push_now(email)
+
+@socketio.on('outbound_ack')
+def handle_outbound_ack(data:dict):
+    # The page received every frame of the event up to oseq `seq`; only the signed-in doctor's own room is acknowledged.
+    # seq is checked here: a malformed one would otherwise fail in OutboundQueue.ack, or in the leader's drain_acks
+    # once relayed, where it would take the other rooms' relayed acknowledgements of that sweep with it
+    seq = data.get('seq')
+    if not isinstance(seq, int) or isinstance(seq, bool) or seq < 0:
+        return
+    if current_user.is_authenticated:
+        acknowledge(data.get('event'), current_user.email, seq)
 
-            elif page == '/notification':
-                if (email not in user_threads) or (not user_threads[email].is_alive()):
-                    user_threads[email]['critical_conditions'] = socketio.start_background_task(monitor_critical_condition, email)
+def acknowledge(event:str, room:str, seq):
+    if event not in outbound_queues or not room or seq is None:
+        return
+    poller, outbound = outbound_queues[event]
+    outbound.ack(room, seq)
+    if poller.registry.shared:
+        poller.registry.relay_ack(room, seq) # the frames may come from the leader on another worker
+
+@socketio.on('resync_patient_data')
+def handle_resync(data:dict):
+    # The page saw a gap in the sequence numbers of these devices: send their snapshots again.
+    # Only to the signed-in doctor's own room, whatever email the page sends
+    if not current_user.is_authenticated:
+        return
+    email = current_user.email
+    device_ids = data.get('device_ids') or []
+    if device_ids:
+        logger.info(f"Resync of {len(device_ids)} dashboards for {email}")
+        dashboard_poller.push_now(email, device_ids)
 
 @socketio.on('server_response')
 def handle_connect():
@@ -790,44 +759,24 @@ def handle_connect():
     
 @socketio.on("send_patient_message")
 def handle_patient_message(data:dict):
-    # with app.app_context():
-    try:
-        # print(f"Received send_patient_message event with data: {data}")
-        logger.info("Received send_patient_message event with data: ", data)
-
-        # email = data.get('email')
-        # sid = request.sid
-        patient_name = data.get('patient_name')
-        message = data.get('message')
-        device_owner = data.get('device_owner')
-        flag = data.get('publish_flag')
-
-        if not all([patient_name, message, device_owner]):
-            logger.warning("Incomplete message data received.")
-            socketio.emit('message_saved', {
-                'status': 'error',
-                'message': 'Missing required data',
-                'table_name': 'patient_messages'
-            })
-            return
-        
-        # join_room(email, sid=sid)
-        new_message = PatientMessage(
-            patient_name=patient_name,
-            device_owner=device_owner,
-            message=message,
-            status_flag = flag,
-            timestamp=datetime.now()  # Automatically record the timestamp of when the message is received
-        )
-        logger.info("Adding message to the database...")
-        db.session.add(new_message)
-        db.session.commit()  # Write the record to the database
-        logger.info(f"Message from {patient_name} (device owner: {device_owner}) saved to the database.")
+    # Acknowledged with 'message_saved' to this connection only, once the writer has committed the message
+    sid = request.sid
+    patient_name = data.get('patient_name')
+    message = data.get('message')
+    device_owner = data.get('device_owner')
+    flag = data.get('publish_flag')
+    logger.debug(f"Received send_patient_message for {patient_name} (device owner: {device_owner})")
+
+    if not all([patient_name, message, device_owner]):
+        logger.warning("Incomplete message data received.")
+        socketio.emit('message_saved', {
+            'status': 'error',
+            'message': 'Missing required data',
+            'table_name': 'patient_messages'
+        }, room=sid)
+        return
 
-        # Optionally send confirmation to the client
-        socketio.emit('message_saved', {'status': 'success', 'message': 'Message saved successfully', 'patient_name': patient_name})
-    except Exception as e:
-        db.session.rollback()  # Rollback the transaction in case of error
-        logger.error(f"Error saving message: {str(e)}", exc_info=True)
-        socketio.emit('message_saved', {'status': 'error', 'message': 'Failed to save message', 'patient_name': patient_name})
+    if not message_writer.submit(sid, patient_name, device_owner, message, flag):
+        logger.warning(f"Message queue full ({Config.MESSAGE_QUEUE_LIMIT} pending), message for {patient_name} refused")
+        socketio.emit('message_saved', {'status': 'error', 'message': 'Server busy, message not saved', 'patient_name': patient_name}, room=sid)
 
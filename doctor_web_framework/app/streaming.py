@@ -0,0 +1,466 @@
+from .rolling_window import DeviceWindow, BUCKET_SECONDS, EPOCH, Row
+from .conditions import flagged_mask, critical_condition_payloads_batch
+from .metrics import record_emits
+from config import Config
+from collections import defaultdict, deque
+from decimal import Decimal
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+import numpy as np
+import struct
+import time
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Streaming ingestion (Config.KPI_STREAMING)
+# =========================================
+# Instead of learning about readings by polling Postgres after the ingest worker (ingest.py) has written them,
+# every worker consumes the health-data-records topic itself, folds each HealthRecord into the per-device KPI windows
+# (the same DeviceWindow buckets the incremental engine uses) and emits 'update_patient_data' and
+# 'patient_notification' to the rooms subscribed on the fleet pollers. Postgres stays the system of record:
+# it is only read to seed a device's window the first time it shows up and for the static owner profile.
+# Only the devices subscribed on a dashboard or notification page get windows: readings of the others are
+# dropped (the set is refreshed on every flush), and a device's windows are dropped once nobody watches it.
+# Updates are coalesced per device and flushed every Config.STREAM_FLUSH_INTERVAL seconds, and the delay
+# between the reading's timestamp and its emit is tracked (LatencyTracker) and logged periodically.
+# Config.KAFKA_BOOTSTRAP_SERVERS = 'memory://' switches to the in-process FakeBroker below.
+
+HealthRecord = Tuple[str, int, float, int, int] # device_id, heart_rate, temperature, spo2, timestamp (epoch millis)
+
+# Avro HealthRecord (src/main/avro/HealthRecord.asvc) in the Confluent wire format
+# ================================================================================
+# magic byte 0, 4-byte big-endian schema id, then the Avro binary encoding of the fields in schema order.
+
+def _read_long(buf:bytes, pos:int) -> Tuple[int, int]:
+    shift = 0
+    result = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), pos
+
+def _write_long(value:int) -> bytes:
+    value = (value << 1) ^ (value >> 63)
+    out = bytearray()
+    while value & ~0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def decode_health_record(value:bytes) -> HealthRecord:
+    if value[0] != 0:
+        raise ValueError(f"Unknown magic byte {value[0]}")
+    pos = 5
+    length, pos = _read_long(value, pos)
+    device_id = value[pos:pos + length].decode('utf-8')
+    pos += length
+    heart_rate, pos = _read_long(value, pos)
+    temperature = struct.unpack_from('<d', value, pos)[0]
+    pos += 8
+    spo2, pos = _read_long(value, pos)
+    timestamp, pos = _read_long(value, pos)
+    return device_id, heart_rate, temperature, spo2, timestamp
+
+def encode_health_record(device_id:str, heart_rate:int, temperature:float, spo2:int, timestamp:int, schema_id:int=1) -> bytes:
+    encoded_id = device_id.encode('utf-8')
+    return b''.join([
+        b'\x00', struct.pack('>I', schema_id),
+        _write_long(len(encoded_id)), encoded_id,
+        _write_long(heart_rate),
+        struct.pack('<d', temperature),
+        _write_long(spo2),
+        _write_long(timestamp)
+    ])
+
+# In-memory broker
+# ================
+# Same surface as the confluent_kafka Consumer/Message objects the loop uses, for local runs and benchmarks.
+
+class FakeMessage:
+    __slots__ = ('_topic', '_partition', '_offset', '_key', '_value', '_timestamp')
+
+    def __init__(self, topic:str, partition:int, offset:int, key:bytes, value:bytes, timestamp:int):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._timestamp = timestamp
+
+    def topic(self): return self._topic
+    def partition(self): return self._partition
+    def offset(self): return self._offset
+    def key(self): return self._key
+    def value(self): return self._value
+    def timestamp(self): return (1, self._timestamp) # TIMESTAMP_CREATE_TIME
+    def error(self): return None
+
+class FakeBroker:
+    def __init__(self, partitions:int=4):
+        self.partitions = partitions
+        self.topics:Dict[str, List[List[FakeMessage]]] = {}
+        self.committed:Dict[Tuple[str, int], int] = {} # (topic, partition) -> next offset, one consumer group
+        self.lock = Lock()
+
+    def produce(self, topic:str, key:str, value:bytes, timestamp:Optional[int]=None):
+        # Keyed like the Java producer: every message of a device lands on the same partition
+        with self.lock:
+            log = self.topics.setdefault(topic, [[] for _ in range(self.partitions)])
+            partition = zlib.crc32(key.encode('utf-8')) % self.partitions
+            offset = len(log[partition])
+            log[partition].append(FakeMessage(
+                topic, partition, offset, key.encode('utf-8'), value,
+                timestamp if timestamp is not None else int(time.time() * 1000)
+            ))
+
+    def consumer(self, partitions:Optional[List[int]]=None) -> 'FakeConsumer':
+        # partitions: the ones assigned to this member of the group (all by default)
+        return FakeConsumer(self, partitions)
+
+class FakeConsumer:
+    def __init__(self, broker:FakeBroker, partitions:Optional[List[int]]=None):
+        self.broker = broker
+        self.partitions = list(range(broker.partitions)) if partitions is None else list(partitions)
+        self.positions:Dict[Tuple[str, int], int] = {}
+        self.subscribed:List[str] = []
+        self.next_partition = 0
+
+    def subscribe(self, topics:List[str], on_assign=None, on_revoke=None):
+        self.subscribed = list(topics)
+
+    def poll(self, timeout:float=0):
+        with self.broker.lock:
+            slots = [(topic, partition) for topic in self.subscribed for partition in self.partitions]
+            for i in range(len(slots)):
+                topic, partition = slots[(self.next_partition + i) % len(slots)]
+                log = self.broker.topics.get(topic)
+                # Without a position of its own the consumer resumes from the group's committed offset
+                position = self.positions.get((topic, partition), self.broker.committed.get((topic, partition), 0))
+                if log and position < len(log[partition]):
+                    self.positions[(topic, partition)] = position + 1
+                    self.next_partition = (self.next_partition + i + 1) % len(slots)
+                    return log[partition][position]
+        return None
+
+    def consume(self, num_messages:int=1, timeout:float=-1) -> List[FakeMessage]:
+        messages = []
+        for _ in range(num_messages):
+            message = self.poll(0)
+            if message is None:
+                break
+            messages.append(message)
+        return messages
+
+    def commit(self, offsets=None, asynchronous:bool=True):
+        # offsets: objects with topic/partition/offset (the next offset to read), like confluent_kafka.TopicPartition
+        with self.broker.lock:
+            for topic_partition in offsets or []:
+                self.broker.committed[(topic_partition.topic, topic_partition.partition)] = topic_partition.offset
+
+    def close(self):
+        pass
+
+memory_broker = FakeBroker()
+
+def kafka_consumer(group_id:str):
+    if Config.KAFKA_BOOTSTRAP_SERVERS == 'memory://':
+        consumer = memory_broker.consumer()
+        consumer.subscribe([Config.KAFKA_TOPIC])
+        return consumer
+    from confluent_kafka import Consumer, TopicPartition, OFFSET_END
+    consumer = Consumer({
+        'bootstrap.servers': Config.KAFKA_BOOTSTRAP_SERVERS,
+        'group.id': group_id,
+        'enable.auto.commit': False,
+        'enable.auto.offset.store': False
+    })
+    # Every partition is assigned directly at its end (live view only, history comes from Postgres): the worker
+    # joins no consumer group and commits nothing, so restarts leave no groups or offsets behind on the broker
+    metadata = consumer.list_topics(Config.KAFKA_TOPIC, timeout=10).topics[Config.KAFKA_TOPIC]
+    if metadata.error is not None:
+        raise RuntimeError(f"Cannot read the partitions of {Config.KAFKA_TOPIC}: {metadata.error}")
+    consumer.assign([TopicPartition(Config.KAFKA_TOPIC, partition, OFFSET_END) for partition in metadata.partitions])
+    return consumer
+
+# Latency
+# =======
+
+class LatencyTracker:
+    """Milliseconds between a reading's timestamp and the emit that carried it (last max_samples readings)."""
+
+    def __init__(self, max_samples:int=10000):
+        self.samples:Deque[float] = deque(maxlen=max_samples)
+        self.total = 0
+
+    def record(self, milliseconds:float):
+        self.samples.append(milliseconds)
+        self.total += 1
+
+    def report(self) -> Dict[str, float]:
+        if not self.samples:
+            return {'count': self.total}
+        ordered = sorted(self.samples)
+        def percentile(p:float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1)
+        return {
+            'count': self.total,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(ordered[-1], 1)
+        }
+
+# Stream processor
+# ================
+
+def _invert(subscriptions:Dict[str, Set[str]]) -> Dict[str, List[str]]:
+    rooms:Dict[str, List[str]] = defaultdict(list)
+    for room, device_ids in subscriptions.items():
+        for device_id in device_ids:
+            rooms[device_id].append(room)
+    return rooms
+
+class StreamProcessor:
+    """
+    dashboard_rooms()/alert_rooms() return the current {room: device ids} subscriptions,
+    profiles(device_ids) the static payload part per device (kpi_engine.device_profiles),
+    seed(device_id, freshness) the Rows already stored for a device (None to start from an empty window),
+    frames(payloads) turns the dashboard payloads of a flush into what is emitted (the dashboard poller's delta frames),
+    alert_frames(payloads, computed) the alert payloads of the devices checked in a flush (the alert poller's frames),
+    emit_batch(event, frames, room), when given, sends a room's dashboard frames of a flush at once.
+    """
+
+    def __init__(
+        self,
+        dashboard_rooms:Callable[[], Dict[str, Set[str]]],
+        alert_rooms:Callable[[], Dict[str, Set[str]]],
+        profiles:Callable[[List[str]], Dict[str, dict]],
+        emit:Callable[[str, dict, str], None],
+        seed:Optional[Callable[[str, datetime], List[Row]]]=None,
+        kpi_freshness:int=2,
+        clock:Callable[[], float]=time.time,
+        frames:Optional[Callable[[Dict[str, dict]], Dict[str, dict]]]=None,
+        alert_frames:Optional[Callable[[Dict[str, dict], List[str]], Dict[str, dict]]]=None,
+        emit_batch:Optional[Callable[[str, List[dict], str], None]]=None
+    ):
+        self.dashboard_rooms = dashboard_rooms
+        self.alert_rooms = alert_rooms
+        self.profiles = profiles
+        self.emit = emit
+        self.seed = seed
+        self.kpi_window = timedelta(hours=kpi_freshness)
+        self.alert_window = timedelta(minutes=Config.ALERT_WINDOW_MINUTES)
+        self.clock = clock
+        self.frames = frames or (lambda payloads: payloads)
+        self.alert_frames = alert_frames or (lambda payloads, computed: payloads)
+        self.emit_batch = emit_batch
+        self.windows:Dict[str, DeviceWindow] = {}
+        self.alert_windows:Dict[str, DeviceWindow] = {}
+        self.seeded_until:Dict[str, datetime] = {}
+        self.watched:Optional[Set[str]] = None # devices of the subscriptions at the last flush
+        self.pending:Dict[str, List[int]] = defaultdict(list) # device id -> timestamps (ms) not emitted yet
+        self.profile_cache:Dict[str, dict] = {}
+        self.latency = LatencyTracker()
+        self.messages = 0
+        self.flushes = 0
+
+    def now(self) -> datetime:
+        # Reading timestamps are epoch millis (UTC), so windows are kept in naive UTC like the database rows
+        return EPOCH + timedelta(seconds=self.clock())
+
+    def handle(self, message):
+        if message.error():
+            logger.error(f"Kafka consumer error: {message.error()}")
+            return
+        try:
+            record = decode_health_record(message.value())
+        except (ValueError, IndexError, struct.error) as e:
+            logger.error(f"Skipping undecodable message at offset {message.offset()}: {str(e)}")
+            return
+        self.apply(record)
+
+    def apply(self, record:HealthRecord):
+        device_id, heart_rate, temperature, spo2, timestamp_ms = record
+        timestamp = EPOCH + timedelta(milliseconds=timestamp_ms)
+        window = self.windows.get(device_id)
+        if window is None:
+            if self.watched is None:
+                self.watched = set(_invert(self.dashboard_rooms())) | set(_invert(self.alert_rooms()))
+            if device_id not in self.watched:
+                return # nobody watches the device; its window is seeded from the database once somebody does
+            window = self._open(device_id)
+        seeded_until = self.seeded_until.get(device_id)
+        if seeded_until is not None and timestamp <= seeded_until:
+            return # already part of the window read from the database
+        temperature = Decimal(str(temperature))
+        # Stream rows carry no database id; they are numbered on top of the window's high-water mark
+        window.fold([(window.high_water_mark + 1, heart_rate, spo2, temperature, timestamp)])
+        alert_window = self.alert_windows[device_id]
+        alert_window.fold([(alert_window.high_water_mark + 1, heart_rate, spo2, temperature, timestamp)])
+        self.pending[device_id].append(timestamp_ms)
+        self.messages += 1
+
+    def _open(self, device_id:str) -> DeviceWindow:
+        window = self.windows[device_id] = DeviceWindow(BUCKET_SECONDS)
+        alert_window = self.alert_windows[device_id] = DeviceWindow(60)
+        if self.seed is not None:
+            now = self.now()
+            rows = self.seed(device_id, now - self.kpi_window)
+            window.fold(rows)
+            alert_window.fold([row for row in rows if row[4] >= now - self.alert_window])
+            if rows:
+                self.seeded_until[device_id] = max(row[4] for row in rows)
+        return window
+
+    def _close(self, device_id:str):
+        del self.windows[device_id], self.alert_windows[device_id]
+        self.seeded_until.pop(device_id, None)
+        self.pending.pop(device_id, None)
+
+    def _flagged(self, device_ids:List[str]) -> List[str]:
+        # Devices with at least one flagged reading in their alert window
+        owners, temperatures, heart_rates, spo2s = [], [], [], []
+        for index, device_id in enumerate(device_ids):
+            for bucket in self.alert_windows[device_id].buckets.values():
+                for row in bucket.rows:
+                    owners.append(index)
+                    heart_rates.append(np.nan if row[1] is None else row[1])
+                    spo2s.append(np.nan if row[2] is None else row[2])
+                    temperatures.append(float(row[3]))
+        if not owners:
+            return []
+        mask = flagged_mask(np.array(temperatures, dtype=float), np.array(heart_rates, dtype=float), np.array(spo2s, dtype=float))
+        hits = np.bincount(np.array(owners), weights=mask, minlength=len(device_ids))
+        return [device_id for device_id, count in zip(device_ids, hits) if count > 0]
+
+    def flush(self) -> int:
+        """Emits the devices that received readings since the last flush. Returns the number of frames sent (per room)."""
+        self.flushes += 1
+        now = self.now()
+        freshness = now - self.kpi_window
+        alert_freshness = now - self.alert_window
+        dashboard = _invert(self.dashboard_rooms())
+        alerts = _invert(self.alert_rooms())
+        self.watched = set(dashboard) | set(alerts)
+        for device_id in [device_id for device_id in self.windows if device_id not in self.watched]:
+            self._close(device_id) # unsubscribed since the last flush
+
+        dirty, self.pending = self.pending, defaultdict(list)
+        missing = [device_id for device_id in dirty if (device_id in dashboard or device_id in alerts) and device_id not in self.profile_cache]
+        if missing:
+            self.profile_cache.update(self.profiles(missing))
+
+        sent = 0
+        emitted:Set[str] = set()
+        dashboard_payloads:Dict[str, dict] = {}
+        alert_candidates:List[str] = []
+        for device_id in dirty:
+            window = self.windows[device_id]
+            self.alert_windows[device_id].evict(alert_freshness)
+            window.evict(freshness)
+            profile = self.profile_cache.get(device_id)
+            if profile is None:
+                continue # nobody watches the device (or it is not registered)
+
+            owner_id = profile['device_owner']
+            if device_id in dashboard:
+                dashboard_payloads[device_id] = {
+                    'device_owner': owner_id,
+                    'avg_temp': window.average_temperature(),
+                    'graph_data': window.graph_data(owner_id),
+                    'personal_traits': profile['personal_traits'],
+                    'medical_history': profile['medical_history']
+                }
+                emitted.add(device_id)
+            if device_id in alerts:
+                alert_candidates.append(device_id)
+
+        batches:Dict[str, List[dict]] = defaultdict(list)
+        for device_id, frame in self.frames(dashboard_payloads).items():
+            for room in dashboard[device_id]:
+                if self.emit_batch is None:
+                    self.emit('update_patient_data', frame, room)
+                else:
+                    batches[room].append(frame)
+                sent += 1
+            record_emits('update_patient_data', frame, len(dashboard[device_id]))
+        for room, frames in batches.items():
+            self.emit_batch('update_patient_data', frames, room)
+
+        # Alerts for the whole flush are classified as one batch
+        flagged = self._flagged(alert_candidates)
+        alert_payloads:Dict[str, dict] = {}
+        if flagged:
+            means = np.array([
+                [float(value) if value is not None else -1.0 for value in self.alert_windows[device_id].means()]
+                for device_id in flagged
+            ], dtype=float)
+            owner_names = [self.profile_cache[device_id]['owner_name'] for device_id in flagged]
+            alert_payloads = dict(zip(flagged, critical_condition_payloads_batch(owner_names, means[:, 0], means[:, 1], means[:, 2])))
+        for device_id, frame in self.alert_frames(alert_payloads, alert_candidates).items():
+            for room in alerts[device_id]:
+                self.emit('patient_notification', frame, room)
+                sent += 1
+            record_emits('patient_notification', frame, len(alerts[device_id]))
+            emitted.add(device_id)
+
+        emitted_at = self.clock() * 1000
+        for device_id in emitted:
+            for timestamp_ms in dirty[device_id]:
+                self.latency.record(emitted_at - timestamp_ms)
+
+        # Every minute or so, forget devices that stopped sending and refresh the cached profiles
+        if self.flushes % 60 == 0:
+            for device_id in list(self.windows):
+                self.windows[device_id].evict(freshness)
+                if not self.windows[device_id].buckets:
+                    self._close(device_id)
+            self.profile_cache.clear()
+        return sent
+
+def stream_consumer_loop(app, consumer, processor:StreamProcessor, sleep, max_batch:int=500):
+    last_flush = last_report = time.monotonic()
+    while True:
+        drained = False
+        try:
+            with app.app_context():
+                for _ in range(max_batch):
+                    message = consumer.poll(0) # never block the gevent hub inside the client
+                    if message is None:
+                        drained = True
+                        break
+                    processor.handle(message)
+                if time.monotonic() - last_flush >= Config.STREAM_FLUSH_INTERVAL:
+                    processor.flush()
+                    last_flush = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error in stream consumer: {str(e)}")
+        if time.monotonic() - last_report >= Config.STREAM_LATENCY_LOG_INTERVAL:
+            logger.info(f"Stream latency (reading timestamp to emit): {processor.latency.report()}")
+            last_report = time.monotonic()
+        sleep(0.05 if drained else 0)
+
+def start_streaming(app, socketio, dashboard_poller, alert_poller) -> StreamProcessor:
+    from .kpi_engine import device_profiles, fetch_window_rows
+
+    # Through the pollers' emit, so the frames share their outbound queues (outbound.py)
+    emits = {dashboard_poller.event: dashboard_poller.emit, alert_poller.event: alert_poller.emit}
+    def emit(event:str, payload:dict, room:str):
+        emits[event](event, payload, room)
+
+    def seed(device_id:str, freshness:datetime) -> List[Row]:
+        return fetch_window_rows([device_id], freshness, None).get(device_id, [])
+
+    # Every worker serves its own doctors, so each one reads every partition of the topic (kafka_consumer)
+    consumer = kafka_consumer(Config.KAFKA_GROUP_PREFIX)
+    processor = StreamProcessor(dashboard_poller.snapshot, alert_poller.snapshot, device_profiles, emit, seed, frames=dashboard_poller.frames, alert_frames=alert_poller.frames, emit_batch=dashboard_poller.emit_batch)
+    socketio.start_background_task(stream_consumer_loop, app, consumer, processor, socketio.sleep)
+    return processor
@@ -0,0 +1,228 @@
+from threading import Lock
+from typing import Dict, List, Optional, Set, Tuple
+import json
+import os
+import socket
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cluster-wide task registry
+# ==========================
+# Gunicorn runs several workers (and nodes) behind nginx, while Socket.IO emits already travel through the Redis
+# message queue to whichever worker holds the doctor's socket. The registry moves the rest of the coordination
+# state out of the worker processes:
+#   - subscriptions (room -> device ids, the sid and worker that made them) live in a Redis hash per poller,
+#     so every worker sees the whole cluster's doctors and a reconnect to another worker finds them again
+#   - exactly one worker per poller is the leader: it holds a lease (SET NX PX, renewed while it runs) and is
+#     the only one computing ticks, so no device is queried twice, whatever the number of workers
+#   - every worker with a running loop refreshes a heartbeat key; the leader drops the subscriptions of workers
+#     whose heartbeat expired (their sockets are gone), and a dead leader's lease expires so another worker
+#     takes over within Config.TASK_LEASE_TTL seconds
+#   - immediate pushes (new selection, resync) requested on another worker are queued for the leader, so all
+#     frames of a poller come from one process (the delta sequence numbers stay consistent)
+#   - delivery acknowledgements of the pages (outbound.py) received by another worker are relayed to the leader
+# LocalRegistry keeps the previous single-process behaviour (in-memory state, always the leader).
+
+Subscription = Tuple[Set[str], Optional[str]] # device ids, sid
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+class LocalRegistry:
+    """In-process subscriptions; this worker is always the leader."""
+
+    shared = False
+
+    def __init__(self):
+        self.rooms:Dict[str, Subscription] = {}
+        self.lock = Lock()
+
+    def subscribe(self, room:str, device_ids:Set[str], sid:Optional[str]):
+        with self.lock:
+            self.rooms[room] = (set(device_ids), sid)
+
+    def unsubscribe(self, room:str, sid:Optional[str]=None):
+        with self.lock:
+            if room in self.rooms and (sid is None or self.rooms[room][1] == sid):
+                del self.rooms[room]
+
+    def unsubscribe_sid(self, sid:str):
+        with self.lock:
+            for room in [room for room, (_, owner) in self.rooms.items() if owner == sid]:
+                del self.rooms[room]
+
+    def subscriptions(self) -> Dict[str, Set[str]]:
+        with self.lock:
+            return {room: set(device_ids) for room, (device_ids, _) in self.rooms.items()}
+
+    def room_devices(self, room:str) -> Set[str]:
+        with self.lock:
+            return set(self.rooms.get(room, (set(), None))[0])
+
+    def lead(self) -> bool:
+        return True
+
+    def release(self):
+        pass
+
+    def heartbeat(self):
+        pass
+
+    def request_push(self, room:str, device_ids:Optional[List[str]]):
+        raise RuntimeError('a local registry is always the leader')
+
+    def drain_push_requests(self) -> List[Tuple[str, Optional[List[str]]]]:
+        return []
+
+    def relay_ack(self, room:str, seq:int):
+        raise RuntimeError('a local registry is always the leader')
+
+    def drain_acks(self) -> List[Tuple[str, int]]:
+        return []
+
+# Lease renewal/release only if this worker still owns the lease (atomic check-and-set)
+RENEW_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+class RedisRegistry:
+    """
+    Subscriptions, leader lease, worker heartbeats and push requests of one poller, in Redis.
+    Keys: fleet:<name>:rooms (hash), fleet:<name>:leader, fleet:<name>:push (list), fleet:<name>:acks (hash),
+    fleet:workers:<worker id>.
+    """
+
+    shared = True
+
+    def __init__(self, client, name:str, lease_ttl:float, worker:Optional[str]=None):
+        self.client = client
+        self.name = name
+        self.lease_ttl_ms = int(lease_ttl * 1000)
+        self.worker = worker or worker_id()
+        self.rooms_key = f'fleet:{name}:rooms'
+        self.leader_key = f'fleet:{name}:leader'
+        self.push_key = f'fleet:{name}:push'
+        self.acks_key = f'fleet:{name}:acks'
+        self.renew_lease = client.register_script(RENEW_LEASE)
+        self.release_lease = client.register_script(RELEASE_LEASE)
+        self.leading = False
+        self.last_prune = 0.0
+
+    @staticmethod
+    def heartbeat_key(worker:str) -> str:
+        return f'fleet:workers:{worker}'
+
+    def _entries(self) -> Dict[str, dict]:
+        return {
+            (room.decode() if isinstance(room, bytes) else room): json.loads(value)
+            for room, value in self.client.hgetall(self.rooms_key).items()
+        }
+
+    def subscribe(self, room:str, device_ids:Set[str], sid:Optional[str]):
+        self.heartbeat() # the subscription must not look orphaned before this worker's loop runs
+        self.client.hset(self.rooms_key, room, json.dumps({'devices': sorted(device_ids), 'sid': sid, 'worker': self.worker}))
+
+    def unsubscribe(self, room:str, sid:Optional[str]=None):
+        if sid is None:
+            self.client.hdel(self.rooms_key, room)
+            return
+        value = self.client.hget(self.rooms_key, room)
+        if value is not None and json.loads(value)['sid'] == sid:
+            self.client.hdel(self.rooms_key, room)
+
+    def unsubscribe_sid(self, sid:str):
+        rooms = [room for room, entry in self._entries().items() if entry['sid'] == sid]
+        if rooms:
+            self.client.hdel(self.rooms_key, *rooms)
+
+    def subscriptions(self) -> Dict[str, Set[str]]:
+        return {room: set(entry['devices']) for room, entry in self._entries().items()}
+
+    def room_devices(self, room:str) -> Set[str]:
+        value = self.client.hget(self.rooms_key, room)
+        return set(json.loads(value)['devices']) if value is not None else set()
+
+    def lead(self) -> bool:
+        """Acquires or renews the lease; True while this worker is the leader."""
+        if self.leading and not self.renew_lease(keys=[self.leader_key], args=[self.worker, self.lease_ttl_ms]):
+            self.leading = False
+            logger.info(f"{self.name} poller: worker {self.worker} lost the lead")
+        if not self.leading and self.client.set(self.leader_key, self.worker, nx=True, px=self.lease_ttl_ms):
+            self.leading = True
+            logger.info(f"{self.name} poller: worker {self.worker} took the lead")
+        if self.leading:
+            self._prune()
+        return self.leading
+
+    def release(self):
+        if self.leading:
+            self.release_lease(keys=[self.leader_key], args=[self.worker])
+            self.leading = False
+
+    def heartbeat(self):
+        self.client.set(self.heartbeat_key(self.worker), 1, px=self.lease_ttl_ms)
+
+    def _prune(self):
+        # Subscriptions of workers that stopped heartbeating belong to sockets that no longer exist
+        if time.monotonic() - self.last_prune < self.lease_ttl_ms / 1000:
+            return
+        self.last_prune = time.monotonic()
+        entries = self._entries()
+        workers = sorted({entry['worker'] for entry in entries.values()})
+        alive = dict(zip(workers, self.client.mget([self.heartbeat_key(worker) for worker in workers]))) if workers else {}
+        orphaned = [room for room, entry in entries.items() if alive.get(entry['worker']) is None]
+        if orphaned:
+            logger.info(f"{self.name} poller: dropping {len(orphaned)} subscriptions of stopped workers")
+            self.client.hdel(self.rooms_key, *orphaned)
+
+    def request_push(self, room:str, device_ids:Optional[List[str]]):
+        self.client.rpush(self.push_key, json.dumps({'room': room, 'devices': device_ids}))
+
+    def drain_push_requests(self, limit:int=100) -> List[Tuple[str, Optional[List[str]]]]:
+        pipeline = self.client.pipeline()
+        pipeline.lrange(self.push_key, 0, limit - 1)
+        pipeline.ltrim(self.push_key, limit, -1)
+        requests, _ = pipeline.execute()
+        return [(request['room'], request['devices']) for request in map(json.loads, requests)]
+
+    def relay_ack(self, room:str, seq:int):
+        # Acknowledgements are cumulative: only the newest one per room matters
+        self.client.hset(self.acks_key, room, seq)
+
+    def drain_acks(self) -> List[Tuple[str, int]]:
+        pipeline = self.client.pipeline()
+        pipeline.hgetall(self.acks_key)
+        pipeline.delete(self.acks_key)
+        acks, _ = pipeline.execute()
+        return [(room.decode() if isinstance(room, bytes) else room, int(seq)) for room, seq in acks.items()]
+
+class SelectionStore:
+    """Patients selected on each doctor's dashboard; a dict, or a Redis hash shared by the workers."""
+
+    def __init__(self, local:Dict[str, List], client=None, key:str='dashboard:selections'):
+        self.local = local
+        self.client = client
+        self.key = key
+
+    def get(self, email:str) -> List:
+        if self.client is None:
+            return self.local.get(email, [])
+        value = self.client.hget(self.key, email)
+        return json.loads(value) if value is not None else []
+
+    def set(self, email:str, patients:List):
+        if self.client is None:
+            self.local[email] = patients
+        else:
+            self.client.hset(self.key, email, json.dumps(patients))
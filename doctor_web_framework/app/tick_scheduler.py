@@ -0,0 +1,165 @@
+from .conditions import CRITICAL, MILD, NORMAL, severity
+from config import Config
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import heapq
+import math
+import time
+import numpy as np
+
+# Severity-aware tick scheduling (Config.ADAPTIVE_TICKS)
+# ======================================================
+# Instead of recomputing every watched device on every tick, a fleet poller with a TickScheduler wakes up every
+# critical_interval seconds and recomputes only the devices that are due. Each device gets its next due time from
+# the severity class of its last payload (conditions.severity of the vitals it shows) and from how much those
+# vitals moved since the previous computation:
+#   critical             every critical_interval seconds
+#   mild                 every mild_interval seconds
+#   normal               normal_interval seconds, doubled after every computation that stayed normal and steady,
+#                        up to stable_max_interval
+# A move of more than `volatility` (relative) in any vital, or a change of severity, restarts the back-off, so a
+# deteriorating patient is looked at more often before crossing a threshold. Due times sit in a heap
+# (lazy deletion: an entry is skipped when the device was rescheduled or unsubscribed after it was pushed).
+
+Signal = Tuple[float, float, float] # temperature, heart rate, SpO2 (NaN when unknown)
+
+def _vital(value) -> float:
+    # -1 is how payloads report a vital without readings; unknown vitals neither alarm nor count as movement
+    return math.nan if value is None or value == -1 else float(value)
+
+def alert_signal(payload:dict) -> Signal:
+    return (
+        _vital(payload['temperature_metadata']['value']),
+        _vital(payload['heartrate_metadata']['value']),
+        _vital(payload['spo2_metadata']['value'])
+    )
+
+def dashboard_signal(payload:dict) -> Signal:
+    # Average temperature and the newest 2-minute bucket of the graphs
+    graph = payload.get('graph_data') or {}
+    def newest(values):
+        return next((value for value in reversed(values or []) if value is not None), None)
+    return _vital(payload.get('avg_temp')), _vital(newest(graph.get('y_heart_rate'))), _vital(newest(graph.get('y_spo2')))
+
+class DeviceSchedule:
+    __slots__ = ('due', 'severity', 'signal', 'steady')
+
+    def __init__(self, due:float):
+        self.due = due
+        self.severity = NORMAL
+        self.signal:Optional[Signal] = None
+        self.steady = -1 # consecutive normal, steady computations (-1: not computed yet)
+
+class TickScheduler:
+    """
+    signal(payload) extracts the vitals of a poller's payload; devices without a payload this tick are normal
+    (e.g. the alert poller only returns flagged devices).
+    """
+
+    def __init__(
+        self,
+        signal:Callable[[dict], Signal],
+        critical_interval:float,
+        mild_interval:float,
+        normal_interval:float,
+        stable_max_interval:float,
+        volatility:float,
+        clock:Callable[[], float]=time.monotonic
+    ):
+        self.signal = signal
+        self.critical_interval = critical_interval
+        self.mild_interval = mild_interval
+        self.normal_interval = normal_interval
+        self.stable_max_interval = stable_max_interval
+        self.volatility = volatility
+        self.clock = clock
+        self.schedules:Dict[str, DeviceSchedule] = {}
+        self.heap:List[Tuple[float, str]] = []
+
+    @property
+    def granularity(self) -> float:
+        # How often the poller has to check for due devices
+        return self.critical_interval
+
+    def sync(self, device_ids:Iterable[str]):
+        # New subscriptions are due right away, unwatched devices are forgotten
+        watched = set(device_ids)
+        now = self.clock()
+        for device_id in watched - self.schedules.keys():
+            self.schedules[device_id] = DeviceSchedule(now)
+            heapq.heappush(self.heap, (now, device_id))
+        for device_id in self.schedules.keys() - watched:
+            del self.schedules[device_id]
+        if len(self.heap) > 4 * len(self.schedules) + 64:
+            self.heap = [(schedule.due, device_id) for device_id, schedule in self.schedules.items()]
+            heapq.heapify(self.heap)
+
+    def due(self) -> List[str]:
+        now = self.clock()
+        device_ids = []
+        while self.heap and self.heap[0][0] <= now:
+            due, device_id = heapq.heappop(self.heap)
+            schedule = self.schedules.get(device_id)
+            if schedule is not None and schedule.due == due:
+                device_ids.append(device_id)
+                # Provisional next due time, replaced by observe(); keeps the device scheduled if the tick fails
+                schedule.due = now + self.interval(schedule.severity, max(schedule.steady, 0))
+                heapq.heappush(self.heap, (schedule.due, device_id))
+        return device_ids
+
+    def next_due(self) -> Optional[float]:
+        while self.heap:
+            due, device_id = self.heap[0]
+            schedule = self.schedules.get(device_id)
+            if schedule is not None and schedule.due == due:
+                return due
+            heapq.heappop(self.heap)
+        return None
+
+    def interval(self, device_severity:int, steady:int) -> float:
+        if device_severity == CRITICAL:
+            return self.critical_interval
+        if device_severity == MILD:
+            return self.mild_interval
+        return min(self.stable_max_interval, self.normal_interval * 2 ** min(steady, 16))
+
+    def moved(self, previous:Optional[Signal], current:Optional[Signal]) -> bool:
+        if previous is None or current is None:
+            return previous is not current # a device entering or leaving the payloads (e.g. flagged / unflagged)
+        for before, after in zip(previous, current):
+            if math.isnan(before) != math.isnan(after):
+                return True
+            if not math.isnan(before) and abs(after - before) > self.volatility * max(abs(before), 1.0):
+                return True
+        return False
+
+    def observe(self, device_ids:List[str], payloads:Dict[str, dict]):
+        """Reschedules the devices a tick computed from the payloads it produced."""
+        if not device_ids:
+            return
+        signals = [self.signal(payloads[device_id]) if device_id in payloads else None for device_id in device_ids]
+        vitals = np.array([signal if signal is not None else (math.nan,) * 3 for signal in signals], dtype=float)
+        classes = severity(vitals[:, 0], vitals[:, 1], vitals[:, 2]).tolist() # NaN compares false: normal
+        now = self.clock()
+        for device_id, signal, device_severity in zip(device_ids, signals, classes):
+            schedule = self.schedules.get(device_id)
+            if schedule is None:
+                continue # unsubscribed while the tick ran
+            steady = device_severity == NORMAL and schedule.severity == NORMAL and not self.moved(schedule.signal, signal)
+            schedule.steady = schedule.steady + 1 if steady else 0
+            schedule.severity, schedule.signal = device_severity, signal
+            schedule.due = now + self.interval(device_severity, schedule.steady)
+            heapq.heappush(self.heap, (schedule.due, device_id))
+
+    def counts(self) -> Dict[int, int]:
+        # Watched devices per severity class
+        counts = {NORMAL: 0, MILD: 0, CRITICAL: 0}
+        for schedule in self.schedules.values():
+            counts[schedule.severity] += 1
+        return counts
+
+def poller_scheduler(signal:Callable[[dict], Signal], interval:float, stable_max_interval:float, clock:Callable[[], float]=time.monotonic) -> TickScheduler:
+    # interval: the poller's fixed interval, used for normal devices; the Config.TICK_* bounds for the rest
+    return TickScheduler(
+        signal, Config.TICK_CRITICAL_INTERVAL, min(Config.TICK_MILD_INTERVAL, interval), interval,
+        max(stable_max_interval, interval), Config.TICK_VOLATILITY, clock
+    )
@@ -0,0 +1,143 @@
+"""
+'patient_notification' traffic of the critical-condition poller with a full payload per flagged device and tick
+versus the AlertStateMachine (app/alert_state.py: transitions with hysteresis plus heartbeats), on a simulated
+fleet and clock. Both run the alert poller as routes.py does (adaptive ticks with the Config.TICK_* bounds).
+
+The fleet mixes --mix fractions of stable patients, patients hovering around the mild heart-rate threshold
+(120 bpm, +-3 bpm of noise), steady mild and critical patients, and patients who turn critical at a random
+time (deteriorating) or recover from critical to normal (recovering). Payload values are window means with
+noise; a device is flagged when a reading of its window (within two noise deviations of the mean) crosses a threshold.
+
+Reported per mode:
+  emits       'patient_notification' events sent (one room watches the fleet; with more rooms both scale alike)
+  KB          JSON-encoded size of those events; with SOCKETIO_MESSAGE_QUEUE every one also crosses Redis
+  flips       changes of what the page shows for a patient (a colour, or the patient appearing / disappearing)
+  history     alert_history rows written
+  onset p95   seconds from a deteriorating patient turning critical to the page showing red
+  clear p95   seconds from a recovering patient turning normal to the page dropping the patient ('never' with full
+              payloads: a device that stops being flagged is not sent again, so the page keeps its last alert)
+  stale       normal patients (stable or recovered) the page still shows at the end
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_alert_state --devices 2000 --duration 1800
+"""
+import argparse
+import json
+import math
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from app.alert_state import AlertStateMachine
+from app.conditions import critical_condition_payloads_batch, flagged_mask
+from app.fleet_poller import FleetPoller
+from app.tick_scheduler import alert_signal, poller_scheduler
+from config import Config
+
+STABLE, HOVERING, MILD, CRIT, DETERIORATING, RECOVERING = range(6)
+VITALS = {
+    STABLE: (36.8, 75.0, 97.0),
+    HOVERING: (36.8, 120.0, 97.0),
+    MILD: (37.7, 130.0, 89.0),
+    CRIT: (38.6, 160.0, 82.0)
+}
+NOISE = np.array([0.05, 3.0, 0.5])
+
+class Fleet:
+    def __init__(self, n_devices:int, mix:List[float], duration:int, seed:int=7):
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        self.device_ids = [f'device_{i}' for i in range(n_devices)]
+        self.index = {device_id: i for i, device_id in enumerate(self.device_ids)}
+        self.kinds = rng.choice(6, size=n_devices, p=np.array(mix) / sum(mix))
+        before = {DETERIORATING: STABLE, RECOVERING: CRIT}
+        after = {DETERIORATING: CRIT, RECOVERING: STABLE}
+        self.before = np.array([VITALS[before.get(kind, kind)] for kind in self.kinds])
+        self.after = np.array([VITALS[after.get(kind, kind)] for kind in self.kinds])
+        changing = np.isin(self.kinds, [DETERIORATING, RECOVERING])
+        self.change_at = np.where(changing, rng.uniform(60, duration - 300, n_devices), math.inf)
+
+    def alert_payloads(self, device_ids:List[str], now:float) -> Dict[str, dict]:
+        rows = np.array([self.index[device_id] for device_id in device_ids])
+        base = np.where((now >= self.change_at[rows])[:, None], self.after[rows], self.before[rows])
+        vitals = (base + self.rng.normal(0, 1, (len(rows), 3)) * NOISE).round(2)
+        # Flagged when any reading of the window crossed a threshold: the readings spread around the mean
+        high, low = vitals + 2 * NOISE, vitals - 2 * NOISE
+        mask = flagged_mask(high[:, 0], high[:, 1], low[:, 2]) | flagged_mask(low[:, 0], high[:, 1], low[:, 2])
+        flagged = [device_id for device_id, hit in zip(device_ids, mask) if hit]
+        batch = critical_condition_payloads_batch(flagged, vitals[mask, 0], vitals[mask, 1], vitals[mask, 2])
+        return dict(zip(flagged, batch))
+
+def simulate(fleet:Fleet, transitions:bool, duration:int) -> dict:
+    clock = [0.0]
+    shown:Dict[str, tuple] = {} # what the notification page shows: device owner -> colours
+    stats = {'emits': 0, 'bytes': 0, 'flips': 0, 'history': 0}
+    onset:Dict[str, float] = {}
+    cleared:Dict[str, float] = {}
+
+    def emit(event, payload, room):
+        stats['emits'] += 1
+        stats['bytes'] += len(json.dumps(payload, separators=(',', ':')))
+        owner = payload['device_owner']
+        if payload.get('type') == 'heartbeat':
+            return
+        colours = tuple(payload[key]['color'] for key in ('temperature_metadata', 'heartrate_metadata', 'spo2_metadata')) if 'temperature_metadata' in payload else None
+        state = None if colours is None or colours == ('green',) * 3 else colours
+        if shown.get(owner) != state:
+            stats['flips'] += 1
+            if state is None:
+                shown.pop(owner, None)
+            else:
+                shown[owner] = state
+        i = fleet.index[owner]
+        if clock[0] >= fleet.change_at[i]:
+            if fleet.kinds[i] == DETERIORATING and state is not None and 'red' in state:
+                onset.setdefault(owner, clock[0] - fleet.change_at[i])
+            if fleet.kinds[i] == RECOVERING and state is None:
+                cleared.setdefault(owner, clock[0] - fleet.change_at[i])
+
+    def record(rows):
+        stats['history'] += len(rows)
+
+    bands = (Config.ALERT_BAND_TEMPERATURE, Config.ALERT_BAND_HEART_RATE, Config.ALERT_BAND_SPO2)
+    machine = AlertStateMachine(bands, Config.ALERT_MIN_DWELL, Config.ALERT_HEARTBEAT_INTERVAL, record, clock=lambda: clock[0]) if transitions else None
+    scheduler = poller_scheduler(alert_signal, 15, Config.TICK_ALERT_STABLE_MAX_INTERVAL, clock=lambda: clock[0])
+    poller = FleetPoller('alerts', 'patient_notification', 15, lambda device_ids: fleet.alert_payloads(device_ids, clock[0]), emit, lambda task: None, time.sleep, delta=machine, scheduler=scheduler)
+    poller.subscribe('doctor', fleet.device_ids)
+    while clock[0] < duration:
+        poller.tick()
+        clock[0] += scheduler.granularity
+
+    def p95(values) -> float:
+        values = sorted(values)
+        return values[min(len(values) - 1, int(0.95 * len(values)))] if values else math.nan
+    stats['onset'], stats['clear'] = p95(onset.values()), p95(cleared.values())
+    stats['stale'] = sum(1 for owner in shown if fleet.kinds[fleet.index[owner]] in (STABLE, RECOVERING))
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--duration', type=int, default=1800, help='simulated seconds')
+    parser.add_argument('--mix', type=float, nargs=6, default=[0.75, 0.08, 0.06, 0.03, 0.04, 0.04],
+                        metavar=('STABLE', 'HOVERING', 'MILD', 'CRITICAL', 'DETERIORATING', 'RECOVERING'))
+    args = parser.parse_args()
+
+    fleet = Fleet(args.devices, args.mix, args.duration)
+    counts = np.bincount(fleet.kinds, minlength=6)
+    print(f"{args.devices} devices over {args.duration} s: {counts[STABLE]} stable, {counts[HOVERING]} hovering, {counts[MILD]} mild, "
+          f"{counts[CRIT]} critical, {counts[DETERIORATING]} deteriorating, {counts[RECOVERING]} recovering")
+    print(f"  {'mode':<24} {'emits':>8} {'KB':>9} {'flips':>7} {'history':>8} {'onset p95':>10} {'clear p95':>10} {'stale':>6}")
+    results = {}
+    for transitions in (False, True):
+        start = time.perf_counter()
+        result = results[transitions] = simulate(fleet, transitions, args.duration)
+        label = 'transitions + heartbeat' if transitions else 'full payload every tick'
+        clear = 'never' if math.isnan(result['clear']) else f"{result['clear']:.1f}"
+        print(
+            f"  {label:<24} {result['emits']:>8d} {result['bytes'] / 1024:>9.1f} {result['flips']:>7d} {result['history']:>8d}"
+            f" {result['onset']:>10.1f} {clear:>10} {result['stale']:>6d}   ({time.perf_counter() - start:.1f} s)"
+        )
+    print(f"  traffic: {results[False]['emits'] / max(results[True]['emits'], 1):.1f}x fewer emits, "
+          f"{results[False]['bytes'] / max(results[True]['bytes'], 1):.1f}x fewer bytes")
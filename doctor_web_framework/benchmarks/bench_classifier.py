@@ -0,0 +1,132 @@
+"""
+Critical-condition tick at fleet scale: the former per-device loop versus the vectorized classifier (app.conditions).
+
+1. Classification only: nested conditionals per device versus one batch of vectorized comparisons.
+2. Whole tick against the database: flagged-devices query, per-device readings + owner queries and scalar
+   classification (former monitor_critical_condition) versus routes.critical_condition_payloads
+   (one readings query, one group-by, one classification batch).
+Both paths must produce the same payloads.
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_classifier --devices 10000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.fixtures import QueryCounter, populate, DOCTOR_EMAIL
+from app import app, db
+from app.dataModel import Device, DoctorDeviceMapping, DeviceRecords, Owner
+from app.conditions import critical_condition_payloads_batch
+from app.routes import critical_condition_payloads
+from config import Config, HealthConditions
+from sqlalchemy import or_
+
+def legacy_payload(owner_name:str, temperature:float, heart_rate:float, spo2:float) -> dict:
+    # The nested conditional chain monitor_critical_condition evaluated for every device
+    temp_normal, temp_hypothermi, temp_mild, temp_critical = HealthConditions.Temperature()
+    hr_natural, hr_mild, hr_critical = HealthConditions.HeartRate()
+    spo2_natural, spo2_mild, spo2_critical = HealthConditions.SpO2()
+    critical, mild, hypothermia, normal = HealthConditions.Colours()
+    messages = HealthConditions.Messages()
+    mapping_conditions = {
+        'critical_temp': temperature >= temp_critical,
+        'mild_temp': (temperature >= temp_mild) and (temperature < temp_critical),
+        'hypothermia': (temperature < temp_hypothermi),
+        'critical_hr': heart_rate >= hr_critical,
+        'mild_hr': (heart_rate >= hr_mild) and (heart_rate < hr_critical),
+        'critical_spo2': spo2 <= spo2_critical,
+        'mild_spo2': (spo2 > spo2_critical) and (spo2 <= spo2_mild),
+    }
+    return {
+        'device_owner': owner_name,
+        'temperature_metadata': {
+            "value": temperature,
+            "color": critical if mapping_conditions['critical_temp'] else mild if mapping_conditions['mild_temp'] else hypothermia if mapping_conditions['hypothermia'] else normal,
+            "message": messages['critical_temp'] if mapping_conditions['critical_temp'] else messages['mild_temp'] if mapping_conditions['mild_temp'] else messages['hypothermia'] if mapping_conditions['hypothermia'] else messages['normal_temp']
+        },
+        'heartrate_metadata': {
+            "value": heart_rate,
+            "color": critical if (mapping_conditions['critical_hr']) or (heart_rate < hr_natural) else mild if mapping_conditions['mild_hr'] else normal,
+            "message": messages['critical_hr'] if mapping_conditions['critical_hr'] else messages['mild_hr'] if mapping_conditions['mild_hr'] else messages['below_thresh_hr'] if heart_rate < hr_natural else messages['normal_hr']
+        },
+        'spo2_metadata': {
+            "value": spo2,
+            "color": critical if mapping_conditions['critical_spo2'] else mild if mapping_conditions['mild_spo2'] else normal,
+            "message": messages['critical_spo2'] if mapping_conditions['critical_spo2'] else messages['mild_spo2'] if mapping_conditions['mild_spo2'] else messages['normal_spo2']
+        }
+    }
+
+def legacy_tick(device_ids:List[str]) -> Dict[str, dict]:
+    _, temp_hypothermi, temp_mild, _ = HealthConditions.Temperature()
+    _, hr_mild, _ = HealthConditions.HeartRate()
+    _, spo2_mild, _ = HealthConditions.SpO2()
+    freshness = datetime.now() - timedelta(minutes=Config.ALERT_WINDOW_MINUTES)
+    devices:List[Device] = (
+        db.session.query(Device)
+        .join(DoctorDeviceMapping, Device.device_id == DoctorDeviceMapping.device_id)
+        .join(DeviceRecords, Device.device_id == DeviceRecords.device_id)
+        .filter(DoctorDeviceMapping.doctor_id == DOCTOR_EMAIL)
+        .filter((DeviceRecords.timestamp >= freshness) & or_(
+            DeviceRecords.temperature < temp_hypothermi, DeviceRecords.temperature > temp_mild,
+            DeviceRecords.heart_rate >= hr_mild, DeviceRecords.spo2 <= spo2_mild
+        ))
+        .all()
+    )
+    payloads = {}
+    for device in devices:
+        owner:Owner = Owner.query.filter_by(owner_username=device.device_owner).first()
+        device_data = DeviceRecords.query.filter_by(device_id=device.device_id).filter(DeviceRecords.timestamp >= freshness).all()
+        temperatures = [record.temperature if record.temperature is not None else -1.0 for record in device_data]
+        heart_rates = [record.heart_rate if record.heart_rate is not None else -1.0 for record in device_data]
+        spo2s = [record.spo2 if record.spo2 is not None else -1.0 for record in device_data]
+        temperature = float(round(sum(temperatures) / len(temperatures), 2) if temperatures else -1.0)
+        heart_rate = float(round(sum(heart_rates) / len(heart_rates), 2) if heart_rates else -1.0)
+        spo2 = float(round(sum(spo2s) / len(spo2s), 2) if spo2s else -1.0)
+        payloads[device.device_id] = legacy_payload(owner.owner_name, temperature, heart_rate, spo2)
+    return payloads
+
+def classification_only(n_devices:int):
+    rng = random.Random(3)
+    names = [f'Patient {i}' for i in range(n_devices)]
+    temperatures = [round(rng.uniform(35.0, 39.5), 2) for _ in range(n_devices)]
+    heart_rates = [round(rng.uniform(40, 170), 2) for _ in range(n_devices)]
+    spo2s = [round(rng.uniform(80, 100), 2) for _ in range(n_devices)]
+
+    legacy_seconds, batch_seconds = [], []
+    for _ in range(5):
+        start = time.perf_counter()
+        legacy = [legacy_payload(*vitals) for vitals in zip(names, temperatures, heart_rates, spo2s)]
+        legacy_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        batch = critical_condition_payloads_batch(names, np.array(temperatures), np.array(heart_rates), np.array(spo2s))
+        batch_seconds.append(time.perf_counter() - start)
+    assert batch == legacy
+    print(f"classification of {n_devices} devices: per-device {1000 * min(legacy_seconds):.1f} ms, vectorized {1000 * min(batch_seconds):.1f} ms")
+
+def whole_tick(n_devices:int, readings:int):
+    roster = populate(n_devices, readings)
+    results = {}
+    for label, fn in (('per-device loop', legacy_tick), ('vectorized', critical_condition_payloads)):
+        counter = QueryCounter()
+        with app.app_context(), counter.track():
+            start = time.perf_counter()
+            results[label] = fn(roster['device_ids'])
+            seconds = time.perf_counter() - start
+            db.session.remove()
+        print(f"tick over {n_devices} devices ({len(results[label])} flagged): {label:<16} {counter.count:>6} queries {1000 * seconds:9.1f} ms")
+    assert results['per-device loop'] == results['vectorized']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=10000)
+    # Readings every 10 s; kept well inside the one-minute alert window so both ticks see the same rows
+    parser.add_argument('--readings', type=int, default=3)
+    args = parser.parse_args()
+
+    classification_only(args.devices)
+    whole_tick(args.devices, args.readings)
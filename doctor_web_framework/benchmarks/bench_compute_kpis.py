@@ -0,0 +1,81 @@
+"""
+Database round trips and wall time of the dashboard KPI computation versus patient count.
+
+Compares the former per-device loop (one readings, one owner and one medical-history query per device)
+with the batched engine in app.kpi_engine.
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_compute_kpis --patients 10 100 1000 --readings 120
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from benchmarks.fixtures import FakeCache, QueryCounter, populate, DOCTOR_EMAIL
+from app import app, db
+from app.dataModel import Device, DoctorDeviceMapping, DeviceRecords, Owner, MedicalRecords
+from app.kpi_engine import compute_kpis_batched, build_graph_data, average_temperature, personal_traits_of, medical_history_of
+from sqlalchemy import and_
+
+def legacy_compute_kpis(doctor_email:str, patients:list, patient_usernames:list, redis_conn, kpi_freshness:int) -> Dict[str, dict]:
+    # The N+1 query pattern the batched engine replaced, kept here as the baseline
+    json_blob = {'device_owners': {}, 'graphs': {}, 'personal_traits': {}, 'medical_histories': {}, 'avg_temps': {}}
+    freshness = datetime.now() - timedelta(hours=kpi_freshness)
+    db.session.query(Device).join(DoctorDeviceMapping).filter(DoctorDeviceMapping.doctor_id == doctor_email).all()
+    devices:List[Device] = (
+        db.session.query(Device)
+        .join(Owner, Device.device_owner == Owner.owner_username)
+        .join(DoctorDeviceMapping, DoctorDeviceMapping.device_id == Device.device_id)
+        .filter(DoctorDeviceMapping.doctor_id == doctor_email)
+        .filter(and_(Owner.owner_name.in_(patients), Owner.owner_username.in_(patient_usernames)))
+        .all()
+    )
+    for device in devices:
+        device_data = DeviceRecords.query.filter_by(device_id=device.device_id).filter(DeviceRecords.timestamp >= freshness).all()
+        rows = [(r.device_id, r.heart_rate, r.spo2, r.temperature, r.timestamp, r.id) for r in device_data]
+        owner:Owner = Owner.query.filter_by(owner_username=device.device_owner).first()
+        medical_history = MedicalRecords.query.filter_by(medical_history_record_id=owner.medical_history_record_id).first()
+        json_blob['graphs'][device.device_owner] = build_graph_data(device.device_owner, rows)
+        json_blob['avg_temps'][device.device_owner] = average_temperature(rows)
+        json_blob['personal_traits'][device.device_owner] = personal_traits_of(owner)
+        json_blob['medical_histories'][device.device_owner] = medical_history_of(medical_history)
+        json_blob['device_owners'][device.device_owner] = owner.owner_name
+        redis_conn.set(device.device_owner, {key: json_blob[key][device.device_owner] for key in json_blob})
+    return json_blob
+
+def measure(fn, roster:dict, repeat:int) -> dict:
+    cache = FakeCache()
+    counter = QueryCounter()
+    timings = []
+    with app.app_context(), counter.track():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            blob = fn(DOCTOR_EMAIL, roster['names'], roster['usernames'], cache, 2)
+            timings.append(time.perf_counter() - start)
+            db.session.remove()
+    return {
+        'queries': counter.count // repeat,
+        'cache_round_trips': cache.round_trips // repeat,
+        'wall_ms': 1000 * min(timings),
+        'blob': blob
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--readings', type=int, default=120, help='readings per device inside the 2 hour window')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'patients':>9} {'engine':>8} {'queries':>8} {'cache rt':>9} {'wall ms':>10}")
+    for n in args.patients:
+        roster = populate(n, args.readings)
+        legacy = measure(legacy_compute_kpis, roster, args.repeat)
+        batched = measure(compute_kpis_batched, roster, args.repeat)
+        assert legacy['blob'] == batched['blob'], 'batched engine output differs from the per-device loop'
+        for label, result in (('legacy', legacy), ('batched', batched)):
+            print(f"{n:>9} {label:>8} {result['queries']:>8} {result['cache_round_trips']:>9} {result['wall_ms']:>10.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Dashboard traffic with full 'update_patient_data' payloads every tick versus the delta protocol (app.dashboard_delta).
+
+Every device sends a reading every 10 seconds and the dashboard ticks every 5 seconds, for --minutes simulated
+minutes. Both protocols start with one full payload per device (the initial load). Reported per doctor:
+  socket bytes/min  the Socket.IO text frames the doctor's browser receives (42["update_patient_data",{...}])
+  queue bytes/min   what the emits publish on the Redis message queue (one JSON message per emit and room)
+Full payloads are measured as they were sent before: graph_data JSON-encoded into a string inside the payload.
+The page-side application of the deltas must rebuild exactly the full payloads.
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_dashboard_delta --doctors 10 --per-doctor 20 --minutes 2
+"""
+import argparse
+import json
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict
+
+from benchmarks.fixtures import FakeCache, populate, generate_readings
+from app import app, db
+from app.dataModel import DeviceRecords
+from app.dashboard_delta import DeltaTracker, apply_graph_delta, STATIC_FIELDS
+from app.kpi_engine import compute_roster_kpis, dashboard_payload, fetch_device_roster
+from sqlalchemy import insert
+
+HOST_ID = uuid.uuid4().hex
+
+def socket_bytes(payload:dict) -> int:
+    # Socket.IO EVENT packet as written on the wire by python-socketio
+    return len('42' + json.dumps(['update_patient_data', payload], separators=(',', ':')))
+
+def queue_bytes(payload:dict, room:str) -> int:
+    # What the Redis message queue manager publishes for one emit
+    return len(json.dumps({
+        'method': 'emit', 'event': 'update_patient_data', 'data': [payload], 'binary': False, 'namespace': '/',
+        'room': room, 'skip_sid': None, 'callback': None, 'host_id': HOST_ID
+    }))
+
+def legacy_payload(payload:dict) -> dict:
+    return dict(payload, graph_data=json.dumps(payload['graph_data']))
+
+def client_apply(pages:Dict[str, dict], frame:dict):
+    # dashboard.html: snapshots replace the state, deltas must follow the last sequence number
+    device_id = frame['device_id']
+    if frame['type'] == 'snapshot':
+        pages[device_id] = dict(frame)
+        return
+    page = pages[device_id]
+    assert frame['base'] == page['seq'], 'sequence gap'
+    for field in STATIC_FIELDS:
+        if field in frame:
+            page[field] = frame[field]
+    if 'graph' in frame:
+        page['graph_data'] = apply_graph_delta(page['graph_data'], frame['graph'])
+    page['seq'] = frame['seq']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctors', type=int, default=10)
+    parser.add_argument('--per-doctor', type=int, default=20)
+    parser.add_argument('--readings', type=int, default=720, help='readings per device already inside the 2 hour window')
+    parser.add_argument('--minutes', type=int, default=2)
+    args = parser.parse_args()
+
+    n_devices = args.doctors * args.per_doctor
+    roster = populate(n_devices, args.readings)
+    rooms = {f'doctor{d}@example.com': roster['device_ids'][d * args.per_doctor:(d + 1) * args.per_doctor] for d in range(args.doctors)}
+    room_of = {device_id: room for room, device_ids in rooms.items() for device_id in device_ids}
+    cache = FakeCache()
+    tracker = DeltaTracker()
+    pages:Dict[str, dict] = {}
+    totals = {'full': [0, 0], 'delta': [0, 0]} # socket bytes, queue bytes
+    emits = {'full': 0, 'delta': 0}
+    start = datetime.now()
+
+    ticks = args.minutes * 12
+    for tick in range(ticks + 1):
+        if tick > 0:
+            # Half of the devices report during each 5 second tick
+            now = start + timedelta(seconds=5 * tick)
+            reporting = roster['device_ids'][tick % 2::2]
+            with app.app_context():
+                db.session.execute(insert(DeviceRecords), generate_readings(reporting, 1, end=now + timedelta(seconds=10)))
+                db.session.commit()
+        with app.app_context():
+            device_roster = fetch_device_roster(roster['device_ids'])
+            blob = compute_roster_kpis(device_roster, cache, 2)
+            payloads = {device.device_id: dashboard_payload(device.device_owner, blob) for device, _, _ in device_roster}
+            db.session.remove()
+
+        for device_id, payload in payloads.items():
+            full = legacy_payload(payload)
+            totals['full'][0] += socket_bytes(full)
+            totals['full'][1] += queue_bytes(full, room_of[device_id])
+            emits['full'] += 1
+        for device_id, frame in tracker.delta_frames(payloads).items():
+            totals['delta'][0] += socket_bytes(frame)
+            totals['delta'][1] += queue_bytes(frame, room_of[device_id])
+            emits['delta'] += 1
+            client_apply(pages, frame)
+        for device_id, payload in payloads.items():
+            page = pages[device_id]
+            assert {key: page[key] for key in payload} == payload, 'delta state differs from the full payload'
+
+    print(f"{args.doctors} doctors x {args.per_doctor} devices, {ticks} ticks ({args.minutes} min) after the initial load")
+    print(f"{'protocol':>9} {'emits':>7} {'socket bytes/min/doctor':>24} {'queue bytes/min/doctor':>23}")
+    for label in ('full', 'delta'):
+        socket_total, queue_total = totals[label]
+        per_doctor = args.minutes * args.doctors
+        print(f"{label:>9} {emits[label]:>7} {socket_total / per_doctor:>24,.0f} {queue_total / per_doctor:>23,.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Database round trips per dashboard tick with one polling loop per doctor versus the shared fleet poller.
+
+Each doctor watches its own devices. The per-doctor baseline runs the batched KPI computation once per
+doctor and tick (what background_thread did); the fleet poller computes every watched device once per tick
+and fans the payloads out to the doctors' rooms, so its query count does not grow with the number of doctors.
+Devices nobody watches (the remainder of --devices) are not computed at all.
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_fleet_poller --doctors 10 50 --devices 1200 --per-doctor 20
+"""
+import argparse
+import time
+from typing import Dict, List
+
+from benchmarks.fixtures import FakeCache, QueryCounter, populate, DOCTOR_EMAIL
+from app import app, db
+from app.dataModel import Doctor, DoctorDeviceMapping
+from app.fleet_poller import FleetPoller
+from app.query_profiler import assert_max_queries
+from app.kpi_engine import compute_kpis_batched, compute_device_kpis
+from sqlalchemy import update
+
+def add_doctors(roster:dict, n_doctors:int, per_doctor:int) -> Dict[str, List[int]]:
+    # Splits the devices between n_doctors (device_mapping holds one doctor per device); returns doctor -> roster indexes
+    selections:Dict[str, List[int]] = {}
+    with app.app_context():
+        for d in range(n_doctors):
+            email = DOCTOR_EMAIL if d == 0 else f'doctor{d}@example.com'
+            selections[email] = list(range(d * per_doctor, (d + 1) * per_doctor))
+            if d > 0:
+                db.session.add(Doctor(name=f'Doctor {d}', email=email, password_hash='password'))
+            db.session.execute(
+                update(DoctorDeviceMapping)
+                .where(DoctorDeviceMapping.device_id.in_([roster['device_ids'][i] for i in selections[email]]))
+                .values(doctor_id=email)
+            )
+        db.session.commit()
+    return selections
+
+def per_doctor_tick(roster:dict, selections:Dict[str, List[int]], cache:FakeCache) -> int:
+    emitted = 0
+    for email, indexes in selections.items():
+        blob = compute_kpis_batched(email, [roster['names'][i] for i in indexes], [roster['usernames'][i] for i in indexes], cache, 2)
+        emitted += len(blob['device_owners'])
+    return emitted
+
+def fleet_poller_for(roster:dict, cache:FakeCache, sent:list) -> FleetPoller:
+    owners = dict(zip(roster['usernames'], roster['device_ids']))
+    def compute(device_ids):
+        blob = compute_device_kpis(device_ids, cache, 2)
+        return {owners[owner]: {'device_owner': owner, 'avg_temp': blob['avg_temps'][owner]} for owner in blob['device_owners']}
+    return FleetPoller(
+        'bench', 'update_patient_data', 5, compute,
+        lambda event, payload, room: sent.append(room),
+        lambda task: None, # ticks are driven by hand
+        time.sleep
+    )
+
+def measure(label:str, fn, repeat:int) -> dict:
+    counter = QueryCounter()
+    timings = []
+    with app.app_context(), counter.track():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            emitted = fn()
+            timings.append(time.perf_counter() - start)
+            db.session.remove()
+    return {'label': label, 'queries': counter.count // repeat, 'emitted': emitted, 'ms': 1000 * min(timings)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--doctors', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--devices', type=int, default=1200)
+    parser.add_argument('--per-doctor', type=int, default=20)
+    parser.add_argument('--readings', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for n_doctors in args.doctors:
+        assert n_doctors * args.per_doctor <= args.devices, '--devices must cover doctors x per-doctor'
+        roster = populate(args.devices, args.readings)
+        selections = add_doctors(roster, n_doctors, args.per_doctor)
+
+        cache = FakeCache()
+        baseline = measure('per-doctor loops', lambda: per_doctor_tick(roster, selections, cache), args.repeat)
+
+        sent:list = []
+        poller = fleet_poller_for(roster, cache, sent)
+        for email, indexes in selections.items():
+            poller.subscribe(email, [roster['device_ids'][i] for i in indexes])
+        fleet = measure('fleet poller', poller.tick, args.repeat)
+        assert fleet['emitted'] == baseline['emitted'], (fleet['emitted'], baseline['emitted'])
+        # The tick must stay at a constant number of round trips (roster + readings), whatever the fleet size
+        with app.app_context(), assert_max_queries(2, 'fleet poller tick'):
+            poller.tick()
+
+        print(f"{n_doctors} doctors, {len(poller.watched())} distinct devices watched")
+        for result in (baseline, fleet):
+            print(f"  {result['label']:<18} {result['queries']:>5} queries/tick  {result['emitted']:>5} emits  {result['ms']:8.1f} ms")
@@ -0,0 +1,75 @@
+"""
+Per-tick cost of the full-window KPI path versus the incremental rolling-window path.
+
+Every tick appends one new reading per device (the DeviceSimulator rate over a 10s tick) and then
+computes the dashboard KPIs both ways, checking the outputs are identical. Both paths of a tick see the same
+datetime.now() (frozen_now), so a reading or bucket boundary on the 2 hour window edge cannot fall inside one
+window and outside the other.
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_incremental_window --patients 100 --readings 720 --ticks 5
+"""
+import argparse
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from benchmarks.fixtures import FakeCache, QueryCounter, populate, generate_readings, DOCTOR_EMAIL
+from app import app, db
+from app.dataModel import DeviceRecords
+from app import kpi_engine, rolling_window, rollups
+from config import Config
+from sqlalchemy import insert
+
+@contextmanager
+def frozen_now(moment:datetime):
+    # datetime.now() of the modules computing the KPI windows returns `moment` inside the block
+    class Frozen(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return moment
+    modules = (kpi_engine, rolling_window, rollups)
+    for module in modules:
+        module.datetime = Frozen
+    try:
+        yield
+    finally:
+        for module in modules:
+            module.datetime = datetime
+
+def timed_kpis(roster:dict, incremental:bool) -> tuple:
+    Config.KPI_INCREMENTAL = incremental
+    counter = QueryCounter()
+    with app.app_context(), counter.track():
+        start = time.perf_counter()
+        blob = kpi_engine.compute_kpis_batched(DOCTOR_EMAIL, roster['names'], roster['usernames'], FakeCache(), 2)
+        elapsed = time.perf_counter() - start
+        db.session.remove()
+    return blob, elapsed, counter.count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, default=100)
+    parser.add_argument('--readings', type=int, default=720, help='readings per device already inside the 2 hour window')
+    parser.add_argument('--ticks', type=int, default=5)
+    args = parser.parse_args()
+
+    roster = populate(args.patients, args.readings)
+    kpi_engine.rolling_windows.clear()
+    # Warm the incremental state (first tick reads the whole window, like the full path)
+    timed_kpis(roster, True)
+
+    print(f"{'tick':>5} {'full ms':>9} {'incremental ms':>15} {'speedup':>8}")
+    for tick in range(1, args.ticks + 1):
+        with app.app_context():
+            # One new reading per device, 10 seconds after the previous one (readings are unique per device and timestamp)
+            db.session.execute(insert(DeviceRecords), generate_readings(roster['device_ids'], 1, end=datetime.now() + timedelta(seconds=10 * tick)))
+            db.session.commit()
+        with frozen_now(datetime.now()):
+            full, full_s, _ = timed_kpis(roster, False)
+            incremental, incremental_s, _ = timed_kpis(roster, True)
+        assert full == incremental, 'incremental window output differs from the full-window resample'
+        print(f"{tick:>5} {1000 * full_s:>9.1f} {1000 * incremental_s:>15.1f} {full_s / incremental_s:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Dashboard selections served through the two-level KPI cache (app.kpi_cache) versus recomputed from the database.
+
+A selection of --select devices out of --devices is loaded:
+  cold      nothing cached: one batch computation, which fills both levels
+  l2        in-process LRU cleared (e.g. another worker process): two Redis round trips, no database query
+  l1        repeated selection in the same process: no round trip at all
+  tick      new readings arrive, one dashboard tick recomputes the watched devices and bumps their versions;
+            the next selection gets the new versions from L1
+Cached and recomputed payloads must be identical.
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_kpi_cache --devices 2000 --select 200
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.fixtures import FakeCache, QueryCounter, populate, generate_readings
+from app import app, db
+from app.dataModel import DeviceRecords
+from app import kpi_engine
+from sqlalchemy import insert
+
+def timed_selection(label:str, device_ids:list, cache:FakeCache) -> dict:
+    counter = QueryCounter()
+    round_trips = cache.round_trips
+    with app.app_context(), counter.track():
+        start = time.perf_counter()
+        payloads = kpi_engine.cached_device_kpis(device_ids, cache, 2)
+        elapsed = time.perf_counter() - start
+        db.session.remove()
+    print(f"{label:>6} {counter.count:>8} {cache.round_trips - round_trips:>9} {1000 * elapsed:>10.2f}")
+    return payloads
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--select', type=int, default=200)
+    parser.add_argument('--readings', type=int, default=120, help='readings per device inside the 2 hour window')
+    args = parser.parse_args()
+
+    roster = populate(args.devices, args.readings)
+    selection = roster['device_ids'][:args.select]
+    cache = FakeCache()
+    kpi_engine.rolling_windows.clear()
+    kpi_engine.kpi_cache.clear()
+
+    print(f"{'load':>6} {'queries':>8} {'cache rt':>9} {'wall ms':>10}")
+    cold = timed_selection('cold', selection, cache)
+    kpi_engine.kpi_cache.clear()
+    from_l2 = timed_selection('l2', selection, cache)
+    from_l1 = timed_selection('l1', selection, cache)
+    assert cold == from_l2 == from_l1
+
+    with app.app_context():
+        db.session.execute(insert(DeviceRecords), generate_readings(selection, 1, end=datetime.now() + timedelta(seconds=10)))
+        db.session.commit()
+    with app.app_context():
+        # What dashboard_payloads does on every tick
+        roster = kpi_engine.fetch_device_roster(selection)
+        blob = kpi_engine.compute_roster_kpis(roster, cache, 2)
+        ticked = {device.device_id: kpi_engine.dashboard_payload(device.device_owner, blob) for device, _, _ in roster}
+        db.session.remove()
+    after_tick = timed_selection('tick', selection, cache)
+    assert after_tick == ticked and after_tick != from_l1
+    print(kpi_engine.kpi_cache.stats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Critical-condition alerts from device_latest_state (app/latest_state.py) versus the range scan over the alert
+window of health_data_records, and what maintaining the table costs the ingest worker.
+
+--devices registered devices send --readings readings each (10 s apart, ending now) through the in-memory
+broker and the ingest worker, once without and once with the LatestStateTracker. Then
+routes.critical_condition_payloads runs over every device with Config.ALERT_LATEST_STATE off and on.
+Reported: ingest rows/s, alert tick time and database statements, and how many devices each path flags.
+The two can differ by readings at the window edge: the scan's window ends now, the state's at the last reading.
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_latest_state --devices 2000 --readings 60
+"""
+import argparse
+import calendar
+import time
+from datetime import timedelta
+from typing import List
+
+from benchmarks.fixtures import QueryCounter, generate_readings, populate
+from app import app, db
+from app.dataModel import DeviceLatestState, DeviceRecords
+from app.ingest import IngestWorker, ingest_loop, writer_for
+from app.latest_state import LatestStateTracker, seed_from
+from app.streaming import FakeBroker, encode_health_record
+from config import Config
+
+def produce(device_ids:List[str], readings_per_device:int) -> FakeBroker:
+    broker = FakeBroker()
+    rows = generate_readings(device_ids, readings_per_device)
+    rows.sort(key=lambda row: row['timestamp']) # arrival order
+    for row in rows:
+        timestamp_ms = calendar.timegm(row['timestamp'].timetuple()) * 1000 # naive timestamps, read back as UTC
+        broker.produce(Config.KAFKA_TOPIC, row['device_id'], encode_health_record(
+            row['device_id'], row['heart_rate'], row['temperature'], row['spo2'], timestamp_ms
+        ))
+    return broker
+
+def ingest(broker:FakeBroker, tracked:bool, batch_size:int) -> float:
+    with app.app_context():
+        db.session.query(DeviceRecords).delete()
+        db.session.query(DeviceLatestState).delete()
+        db.session.commit()
+        engine = db.engine
+    consumer = broker.consumer()
+    consumer.subscribe([Config.KAFKA_TOPIC])
+    tracker = LatestStateTracker(timedelta(minutes=Config.ALERT_WINDOW_MINUTES), seed_from(engine)) if tracked else None
+    worker = IngestWorker(consumer, writer_for(engine), batch_size, 0.0, tracker=tracker)
+    log = broker.topics[Config.KAFKA_TOPIC]
+    def exhausted() -> bool:
+        return not worker.offsets and all(consumer.positions.get((Config.KAFKA_TOPIC, p), 0) >= len(log[p]) for p in range(broker.partitions))
+    start = time.perf_counter()
+    ingest_loop(worker, stop=exhausted)
+    return time.perf_counter() - start
+
+def alert_tick(device_ids:List[str], latest_state:bool, repeat:int):
+    from app.routes import critical_condition_payloads
+    previous, Config.ALERT_LATEST_STATE = Config.ALERT_LATEST_STATE, latest_state
+    try:
+        counter = QueryCounter()
+        timings = []
+        for _ in range(repeat):
+            with app.app_context(), counter.track():
+                start = time.perf_counter()
+                payloads = critical_condition_payloads(device_ids)
+                timings.append(time.perf_counter() - start)
+        return 1000 * min(timings), counter.count // repeat, payloads
+    finally:
+        Config.ALERT_LATEST_STATE = previous
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--readings', type=int, default=60, help='readings per device (10 s apart)')
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger('app').setLevel(logging.WARNING)
+    device_ids = populate(args.devices, 1)['device_ids']
+    total = args.devices * args.readings
+    print(f"{args.devices} devices x {args.readings} readings")
+    for tracked in (False, True):
+        seconds = ingest(produce(device_ids, args.readings), tracked, args.batch)
+        print(f"  ingest {'with' if tracked else 'without':<7} latest state  {seconds:7.2f} s  {total / seconds:10,.0f} rows/s")
+    with app.app_context():
+        states = db.session.query(DeviceLatestState).count()
+    assert states == args.devices, states
+
+    print(f"  {'alert tick':<28} {'ms':>8} {'stmts':>6} {'flagged':>8}")
+    scan_ms, scan_queries, scanned = alert_tick(device_ids, False, args.repeat)
+    state_ms, state_queries, stated = alert_tick(device_ids, True, args.repeat)
+    print(f"  {'raw window scan':<28} {scan_ms:8.1f} {scan_queries:6d} {len(scanned):8d}")
+    print(f"  {'device_latest_state':<28} {state_ms:8.1f} {state_queries:6d} {len(stated):8d}  ({scan_ms / state_ms:.1f}x)")
+    print(f"  flagged by both: {len(set(scanned) & set(stated))}")
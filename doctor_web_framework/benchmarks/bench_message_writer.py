@@ -0,0 +1,102 @@
+"""
+Doctor -> patient messages: one commit and one publish per message (the send_patient_message handler as it
+was) versus the write-behind MessageWriter (app/message_writer.py), for a burst of --messages messages sent
+by --senders connections at once.
+
+Reported per mode: the time until every message is saved and acknowledged (messages/s), the database
+statements and message bus round trips it took, and the ack latency percentiles (burst start -> 'message_saved').
+Runs on a temporary SQLite file (the writer loop runs in its own greenlet) and an in-memory message bus.
+SQLite cannot return the ids of a multi-row INSERT in order, so the ORM still sends one INSERT per row there:
+the gain measured here is one commit per batch; PostgreSQL also gets one INSERT per batch of rows.
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_message_writer --messages 5000 --batch-sizes 50 500
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import List
+
+# A file, not in-memory SQLite: the pool of the in-memory database is per thread (per greenlet once patched)
+os.environ.setdefault('SQLALCHEMY_DATABASE_URI', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'messages.db')}")
+
+from benchmarks.fixtures import FakeBus, QueryCounter, populate
+from app import app, db, socketio, message_bus
+from app.dataModel import PatientMessage
+from app.message_writer import MessageWriter
+
+def burst(n_messages:int, patients:dict) -> List[tuple]:
+    n = len(patients['names'])
+    return [(patients['names'][i % n], patients['usernames'][i % n], f'Message {i}: please measure your blood pressure', 0) for i in range(n_messages)]
+
+def percentile(values:List[float], q:float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def saved_messages() -> int:
+    with app.app_context():
+        count = db.session.query(PatientMessage).count()
+        db.session.query(PatientMessage).delete()
+        db.session.commit()
+        db.session.remove()
+    return count
+
+def per_row(messages:List[tuple]) -> List[float]:
+    acks = []
+    start = time.perf_counter()
+    for patient_name, device_owner, message, flag in messages:
+        with app.app_context():
+            row = PatientMessage(patient_name=patient_name, device_owner=device_owner, message=message, status_flag=flag, timestamp=datetime.now())
+            db.session.add(row)
+            db.session.commit()
+            message_bus.publish_patient_message(row)
+            db.session.remove()
+        acks.append(time.perf_counter() - start)
+    return acks
+
+def write_behind(messages:List[tuple], senders:int, batch_size:int, flush_interval:float) -> List[float]:
+    acks = []
+    def emit(event, payload, room):
+        assert payload['status'] == 'success', payload
+        acks.append(time.perf_counter() - start)
+    writer = MessageWriter(app, emit, socketio.start_background_task, batch_size, flush_interval, len(messages))
+    start = time.perf_counter()
+    for i, (patient_name, device_owner, message, flag) in enumerate(messages):
+        writer.submit(f'sid-{i % senders}', patient_name, device_owner, message, flag)
+    while len(acks) < len(messages):
+        socketio.sleep(0.001)
+    return acks
+
+def run(label:str, fn, n_messages:int):
+    bus = message_bus._client = FakeBus()
+    counter = QueryCounter()
+    with app.app_context(), counter.track():
+        acks = fn()
+    saved = saved_messages()
+    assert saved == n_messages and len(bus.published) == n_messages, (saved, len(bus.published))
+    seconds = max(acks)
+    print(
+        f"  {label:<22} {seconds * 1000:9.1f} ms {n_messages / seconds:10.0f} msg/s {counter.count:9d} {bus.round_trips:9d}"
+        f" {percentile(acks, 0.5) * 1000:9.1f} {percentile(acks, 0.99) * 1000:9.1f}"
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--senders', type=int, default=50, help='doctor connections the burst comes from')
+    parser.add_argument('--patients', type=int, default=200)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[50, 500])
+    parser.add_argument('--flush-interval', type=float, default=0.1)
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger('app').setLevel(logging.WARNING)
+    patients = populate(args.patients, 1)
+    messages = burst(args.messages, patients)
+    print(f"{args.messages} messages from {args.senders} connections to {args.patients} patients")
+    print(f"  {'mode':<22} {'all acked':>12} {'throughput':>16} {'db stmts':>9} {'bus trips':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    run('commit per message', lambda: per_row(messages), args.messages)
+    for batch_size in args.batch_sizes:
+        run(f'write-behind x{batch_size}', lambda: write_behind(messages, args.senders, batch_size, args.flush_interval), args.messages)
@@ -0,0 +1,163 @@
+"""
+Dashboard frames to pages on fast, slow and stalled connections: socketio.emit as is versus the per-room
+OutboundQueue (app/outbound.py), on a simulated clock (a run takes a few seconds).
+
+--devices dashboards are watched by three rooms. Every --tick seconds each device's payload changes (the newest
+graph bucket and the average temperature), and the dashboard DeltaTracker turns it into a delta frame, as in
+streaming mode. Each room's connection delivers frames in order at its bandwidth; an acknowledgement asked for by
+a frame reaches the server one round trip after the frame was delivered. Frames emitted and not delivered yet are
+the backlog the worker's socket buffers and the Redis message queue hold today.
+
+Reported per room:
+  sent        frames handed to Socket.IO
+  peak KB     largest backlog (queued in the OutboundQueue plus emitted and not delivered), in KB of JSON
+  end KB      the backlog when the run ends
+  stale p50   age of the dashboard state the page shows, median over devices at the end (seconds)
+  gaps        deltas the page could not apply (it would ask for a resync)
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_outbound --devices 200 --duration 120
+"""
+import argparse
+import json
+import random
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app.dashboard_delta import DeltaTracker, apply_graph_delta
+from app.outbound import OutboundQueue
+from config import Config
+
+ROOMS = {
+    # room: (bytes per second, round trip seconds); 0 bytes per second: a stalled page
+    'fast@example.com': (2_000_000, 0.05),
+    'slow@example.com': (20_000, 0.4),
+    'stalled@example.com': (0, 0.4)
+}
+STEP = 0.05 # simulated seconds per step
+
+def size(frame:dict) -> int:
+    return len(json.dumps(frame, separators=(',', ':')))
+
+class Link:
+    """One page's connection: frames in flight, delivered in order at the connection's bandwidth."""
+
+    def __init__(self, bandwidth:float, rtt:float):
+        self.bandwidth = bandwidth
+        self.rtt = rtt
+        self.frames:Deque[Tuple[dict, int]] = deque()
+        self.budget = 0.0
+        self.backlog = 0 # bytes
+        self.seqs:Dict[str, int] = {} # what the page holds: device id -> seq
+        self.graphs:Dict[str, dict] = {}
+        self.gaps = 0
+        self.acks:List[Tuple[float, int]] = [] # (arrives at, oseq)
+
+    def push(self, frame:dict):
+        nbytes = size(frame)
+        self.frames.append((frame, nbytes))
+        self.backlog += nbytes
+
+    def deliver(self, now:float):
+        self.budget = min(self.budget + self.bandwidth * STEP, self.bandwidth) # at most a second of burst
+        while self.frames and self.frames[0][1] <= self.budget:
+            frame, nbytes = self.frames.popleft()
+            self.budget -= nbytes
+            self.backlog -= nbytes
+            device_id = frame['device_id']
+            if frame['type'] == 'snapshot':
+                self.seqs[device_id], self.graphs[device_id] = frame['seq'], frame['graph_data']
+            elif self.seqs.get(device_id) == frame['base']:
+                self.seqs[device_id] = frame['seq']
+                if 'graph' in frame:
+                    self.graphs[device_id] = apply_graph_delta(self.graphs[device_id], frame['graph'])
+            else:
+                self.gaps += 1
+            if frame.get('ack'):
+                self.acks.append((now + self.rtt, frame['oseq']))
+
+def queued_bytes(outbound:Optional[OutboundQueue], room:str) -> int:
+    if outbound is None or room not in outbound.rooms:
+        return 0
+    return sum(size(frame) for frame in outbound.rooms[room].pending.values())
+
+def payload(device_id:str, buckets:List[float], rng:random.Random) -> dict:
+    values = [round(rng.uniform(60, 120)) for _ in buckets]
+    return {
+        'device_owner': device_id, 'avg_temp': round(rng.uniform(36.0, 38.0), 2),
+        'personal_traits': {'name': device_id}, 'medical_history': {},
+        'graph_data': {'x': list(buckets), 'y_heart_rate': values, 'y_spo2': [97] * len(buckets), 'device_owner': device_id}
+    }
+
+def simulate(n_devices:int, duration:float, tick:float, queued:bool) -> Dict[str, dict]:
+    rng = random.Random(3)
+    clock = [0.0]
+    links = {room: Link(*ROOMS[room]) for room in ROOMS}
+    delta = DeltaTracker()
+    produced:Dict[Tuple[str, int], float] = {} # (device id, seq) -> when it was computed
+    sent = {room: 0 for room in ROOMS}
+    peak = {room: 0 for room in ROOMS}
+
+    def emit(event, frame, room):
+        sent[room] += 1
+        links[room].push(frame)
+
+    outbound: Optional[OutboundQueue] = None
+    if queued:
+        outbound = OutboundQueue(
+            'update_patient_data', emit, lambda task: None, lambda seconds: None, Config.OUTBOUND_WINDOW,
+            Config.OUTBOUND_QUEUE_LIMIT, Config.OUTBOUND_ACK_TIMEOUT, delta.coalesce, clock=lambda: clock[0]
+        )
+    send = outbound.send if outbound is not None else emit
+
+    device_ids = [f'device_{i}' for i in range(n_devices)]
+    buckets = [float(i) for i in range(60)] # 2 hours of 2-minute buckets
+    next_tick = 0.0
+    while clock[0] < duration:
+        now = clock[0]
+        if now >= next_tick:
+            next_tick += tick
+            buckets = buckets[1:] + [buckets[-1] + 1]
+            frames = delta.delta_frames({device_id: payload(device_id, buckets, rng) for device_id in device_ids})
+            for device_id, frame in frames.items():
+                produced[(device_id, frame['seq'])] = now
+                for room in ROOMS:
+                    send('update_patient_data', frame, room)
+            for room, link in links.items(): # the backlog peaks right after a tick
+                peak[room] = max(peak[room], link.backlog + queued_bytes(outbound, room))
+        for room, link in links.items():
+            link.deliver(now)
+            arrived = [oseq for at, oseq in link.acks if at <= now]
+            link.acks = [(at, oseq) for at, oseq in link.acks if at > now]
+            if outbound is not None:
+                for oseq in arrived:
+                    outbound.ack(room, oseq)
+        if outbound is not None:
+            outbound.sweep()
+        clock[0] += STEP
+
+    results = {}
+    for room, link in links.items():
+        ages = sorted(clock[0] - produced[(device_id, link.seqs[device_id])] if device_id in link.seqs else clock[0] for device_id in device_ids)
+        results[room] = {
+            'sent': sent[room], 'peak_kb': peak[room] / 1024, 'end_kb': (link.backlog + queued_bytes(outbound, room)) / 1024,
+            'stale': ages[len(ages) // 2], 'gaps': link.gaps
+        }
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=120, help='simulated seconds')
+    parser.add_argument('--tick', type=float, default=1.0, help='seconds between dashboard updates (Config.STREAM_FLUSH_INTERVAL)')
+    args = parser.parse_args()
+
+    print(f"{args.devices} dashboards updated every {args.tick:.0f} s for {args.duration:.0f} s, window {Config.OUTBOUND_WINDOW} frames, ack timeout {Config.OUTBOUND_ACK_TIMEOUT:.0f} s")
+    print(f"  {'mode':<10} {'room':<20} {'sent':>8} {'peak KB':>9} {'end KB':>9} {'stale p50':>10} {'gaps':>6}")
+    for queued in (False, True):
+        results = simulate(args.devices, args.duration, args.tick, queued)
+        for room, result in results.items():
+            print(
+                f"  {'outbound' if queued else 'emit':<10} {room.split('@')[0]:<20} {result['sent']:>8d} {result['peak_kb']:>9.1f}"
+                f" {result['end_kb']:>9.1f} {result['stale']:>10.1f} {result['gaps']:>6d}"
+            )
@@ -0,0 +1,123 @@
+"""
+The bucketed resampler of kpi_engine.build_graph_data versus the pandas resample('2min').mean() it replaced,
+and what deferring pandas saves at worker startup.
+
+  output    build_graph_data must equal the pandas implementation (kept here as the reference) on readings
+            with missing vitals, gaps of empty buckets and sub-second timestamps
+  per tick  resampling --devices devices x --readings readings, both implementations
+  startup   a fresh interpreter importing the app package (what a gunicorn worker does), time and RSS (Linux),
+            as it is now (pandas deferred) and with pandas imported up front as before
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_resample --devices 1000 --readings 720
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import timedelta
+from typing import List
+
+from benchmarks.fixtures import generate_readings
+from app.kpi_engine import build_graph_data, clean_graph_data
+
+def pandas_graph_data(device_owner:str, device_data:list) -> dict:
+    # build_graph_data as it was: one DataFrame, DatetimeIndex and resample per device
+    import pandas as pd
+    df = pd.DataFrame({
+        'Timestamp': [record[4] for record in device_data],
+        'Heart Rate': [record[1] for record in device_data],
+        'SpO2': [record[2] for record in device_data]
+    })
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    df.set_index('Timestamp', inplace=True)
+    df_resampled = df.resample('2min').mean()
+    return clean_graph_data({
+        'x': df_resampled.index.strftime('%Y-%m-%dT%H:%M:%S').tolist(),
+        'y_heart_rate': df_resampled['Heart Rate'].tolist(),
+        'y_spo2': df_resampled['SpO2'].tolist(),
+        'device_owner': device_owner
+    })
+
+def device_readings(n_devices:int, readings_per_device:int, gaps:bool) -> List[list]:
+    device_ids = [f'device_{i}' for i in range(n_devices)]
+    rng = random.Random(3)
+    devices = {device_id: [] for device_id in device_ids}
+    for row_id, row in enumerate(generate_readings(device_ids, readings_per_device), start=1):
+        timestamp = row['timestamp']
+        if gaps:
+            if rng.random() < 0.2:
+                continue # lost readings: some buckets end up empty
+            timestamp += timedelta(microseconds=rng.randint(0, 999999))
+        heart_rate = None if gaps and rng.random() < 0.1 else row['heart_rate']
+        spo2 = None if gaps and rng.random() < 0.1 else row['spo2']
+        devices[row['device_id']].append((row['device_id'], heart_rate, spo2, row['temperature'], timestamp, row_id))
+    if gaps:
+        # A device silent for 30 minutes, one with a single reading
+        silent = devices[device_ids[0]]
+        devices[device_ids[0]] = [r for r in silent if not (silent[0][4] + timedelta(minutes=10) <= r[4] < silent[0][4] + timedelta(minutes=40))]
+        devices[device_ids[-1]] = devices[device_ids[-1]][:1]
+    return list(devices.values())
+
+def best_of(fn, repeat:int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return 1000 * min(timings)
+
+STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+if {eager}:
+    import pandas
+import app
+seconds = time.perf_counter() - start
+with open('/proc/self/status') as f: # ru_maxrss would report the parent's peak, inherited through fork
+    rss_kib = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+print(json.dumps({{'seconds': seconds, 'rss_mib': rss_kib / 1024, 'pandas': 'pandas' in sys.modules}}))
+"""
+
+def cold_start(eager_pandas:bool, repeat:int) -> dict:
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI='sqlite://', ROLLUP_COMPACTION='0')
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP.format(eager=eager_pandas)], env=env, capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'seconds': statistics.median(run['seconds'] for run in runs),
+        'rss_mib': statistics.median(run['rss_mib'] for run in runs),
+        'pandas': runs[0]['pandas']
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--readings', type=int, default=720, help='readings per device (2 hours at 10 s)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--startup-runs', type=int, default=5)
+    args = parser.parse_args()
+
+    for readings in device_readings(50, args.readings, gaps=True) + [[]]:
+        expected, actual = pandas_graph_data('owner', readings), build_graph_data('owner', readings)
+        assert actual == expected, (readings[:3], actual, expected)
+    print("build_graph_data matches the pandas resampling (gaps, missing vitals, empty window)")
+
+    devices = device_readings(args.devices, args.readings, gaps=False)
+    pandas_ms = best_of(lambda: [pandas_graph_data('owner', readings) for readings in devices], args.repeat)
+    bucketed_ms = best_of(lambda: [build_graph_data('owner', readings) for readings in devices], args.repeat)
+    print(f"{args.devices} devices x {args.readings} readings per tick")
+    print(f"  pandas resample  {pandas_ms:9.1f} ms")
+    print(f"  bucketed         {bucketed_ms:9.1f} ms  ({pandas_ms / bucketed_ms:.1f}x)")
+
+    print(f"worker startup (import app, median of {args.startup_runs})")
+    for label, eager in (('pandas up front', True), ('pandas deferred', False)):
+        result = cold_start(eager, args.startup_runs)
+        print(f"  {label:<16} {result['seconds']:6.2f} s  {result['rss_mib']:7.1f} MiB RSS  (pandas loaded: {result['pandas']})")
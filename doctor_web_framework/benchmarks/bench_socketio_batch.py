@@ -0,0 +1,147 @@
+"""
+Dashboard traffic at --doctors x --patients: one 'update_patient_data' event per patient versus one
+'update_patient_batch' event per doctor and tick (Config.SOCKETIO_BATCH), each with JSON and msgpack packets
+(Config.SOCKETIO_SERIALIZER).
+
+The dashboard FleetPoller, its DeltaTracker and the outbound queue run as in routes.py (pages acknowledge at
+once). Every tick each patient's graph slides by one bucket and the average temperature changes; the first tick
+sends snapshots, the next --ticks send deltas. Every event is encoded like python-socketio does it: the message
+the Redis manager publishes (the dict of PubSubManager.emit, json.dumps or msgpack) and the EVENT packet written
+to the doctor's websocket (Packet or MsgPackPacket, one connected page per doctor).
+
+Reported per mode, per second with a tick every --interval seconds (1 s: Config.STREAM_FLUSH_INTERVAL; the
+dashboard poller ticks every 5 s):
+  redis ops/s   PUBLISH commands to the message queue
+  redis KB/s    bytes published
+  frames/s      websocket frames written to the pages
+  ws KB/s       bytes written to the pages
+  encode ms     CPU per tick spent encoding the messages and packets
+  snapshot KB   websocket bytes of the first (snapshot) tick
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_socketio_batch --doctors 100 --patients 30
+"""
+import argparse
+import json
+import random
+import time
+from typing import Dict, List
+
+import msgpack
+from socketio import packet
+from socketio.msgpack_packet import MsgPackPacket
+
+from app.dashboard_delta import DeltaTracker
+from app.fleet_poller import FleetPoller
+from app.outbound import OutboundQueue
+from config import Config
+
+HOST_ID = 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6'
+
+class Wire:
+    """Counts what one emit costs on the message queue and on the websocket."""
+
+    def __init__(self, serializer:str):
+        self.serializer = serializer
+        self.stats = {'ops': 0, 'queue_bytes': 0, 'frames': 0, 'socket_bytes': 0, 'encode': 0.0}
+
+    def emit(self, event:str, payload:dict, room:str):
+        start = time.perf_counter()
+        message = {
+            'method': 'emit', 'event': event, 'data': [payload], 'binary': False, 'namespace': '/',
+            'room': room, 'skip_sid': None, 'callback': None, 'host_id': HOST_ID
+        }
+        if self.serializer == 'msgpack':
+            published = msgpack.packb(message)
+            written = MsgPackPacket(packet.EVENT, data=[event, payload]).encode()
+        else:
+            published = json.dumps(message)
+            written = '4' + packet.Packet(packet.EVENT, data=[event, payload]).encode() # Engine.IO message prefix
+        self.stats['encode'] += time.perf_counter() - start
+        self.stats['ops'] += 1
+        self.stats['queue_bytes'] += len(published)
+        self.stats['frames'] += 1
+        self.stats['socket_bytes'] += len(written)
+
+    def take(self) -> Dict[str, float]:
+        stats = dict(self.stats)
+        self.stats = {key: 0 for key in self.stats}
+        return stats
+
+def payload(device_id:str, buckets:List[float], rng:random.Random) -> dict:
+    number = int(device_id.split('_')[1])
+    return {
+        'device_owner': device_id, 'avg_temp': round(rng.uniform(36.0, 38.0), 2),
+        'personal_traits': {'name': device_id, 'age': 30 + number % 60, 'gender': 'F', 'blood_type': 'A+'},
+        'medical_history': {'conditions': ['hypertension'], 'allergies': ['penicillin'], 'medications': ['lisinopril']},
+        'graph_data': {
+            'x': [f'2024-10-01T{int(bucket) // 30:02d}:{int(bucket) % 30 * 2:02d}:00' for bucket in buckets],
+            'y_heart_rate': [60 + (number * 7 + int(bucket) * 13) % 60 for bucket in buckets], 'y_spo2': [97] * len(buckets),
+            'device_owner': device_id
+        }
+    }
+
+def simulate(n_doctors:int, n_patients:int, ticks:int, batch:bool, serializer:str) -> dict:
+    rng = random.Random(5)
+    wire = Wire(serializer)
+    delta = DeltaTracker()
+    outbound_ref:List[OutboundQueue] = []
+
+    def emit(event, data, room):
+        wire.emit(event, data, room)
+        frames = data['frames'] if event == 'update_patient_batch' else [data]
+        for frame in frames:
+            if frame.get('ack'): # the page acknowledges right away (dashboard.html)
+                outbound_ref[0].ack(room, frame['oseq'])
+
+    outbound = OutboundQueue(
+        'update_patient_data', emit, lambda task: None, lambda seconds: None, Config.OUTBOUND_WINDOW, Config.OUTBOUND_QUEUE_LIMIT,
+        Config.OUTBOUND_ACK_TIMEOUT, delta.coalesce, batch_event='update_patient_batch' if batch else None
+    )
+    outbound_ref.append(outbound)
+    buckets = [float(i) for i in range(60)] # 2 hours of 2-minute buckets
+    device_ids = [f'device_{i}' for i in range(n_doctors * n_patients)]
+
+    def compute(ids):
+        return {device_id: payload(device_id, buckets, rng) for device_id in ids}
+
+    poller = FleetPoller(
+        'dashboard', 'update_patient_data', 5, compute, outbound.send, lambda task: None, time.sleep, delta=delta,
+        emit_batch=outbound.send_batch if batch else None
+    )
+    for doctor in range(n_doctors):
+        poller.subscribe(f'doctor_{doctor}@example.com', device_ids[doctor * n_patients:(doctor + 1) * n_patients])
+
+    poller.tick()
+    snapshot = wire.take()
+    totals = {key: 0.0 for key in snapshot}
+    for _ in range(ticks):
+        buckets = buckets[1:] + [buckets[-1] + 1]
+        poller.tick()
+        for key, value in wire.take().items():
+            totals[key] += value
+    return {'snapshot': snapshot, 'tick': {key: value / ticks for key, value in totals.items()}}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--doctors', type=int, default=100)
+    parser.add_argument('--patients', type=int, default=30, help='patients per doctor')
+    parser.add_argument('--ticks', type=int, default=20, help='delta ticks after the snapshot tick')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between ticks')
+    args = parser.parse_args()
+
+    print(f"{args.doctors} doctors x {args.patients} patients, a tick every {args.interval:g} s")
+    print(f"  {'mode':<20} {'redis ops/s':>12} {'redis KB/s':>11} {'frames/s':>9} {'ws KB/s':>9} {'encode ms':>10} {'snapshot KB':>12}")
+    results = {}
+    for batch, serializer in ((False, 'default'), (False, 'msgpack'), (True, 'default'), (True, 'msgpack')):
+        result = results[(batch, serializer)] = simulate(args.doctors, args.patients, args.ticks, batch, serializer)
+        tick = result['tick']
+        label = f"{'batch' if batch else 'per patient'} {'msgpack' if serializer == 'msgpack' else 'JSON'}"
+        print(
+            f"  {label:<20} {tick['ops'] / args.interval:>12.0f} {tick['queue_bytes'] / 1024 / args.interval:>11.1f}"
+            f" {tick['frames'] / args.interval:>9.0f} {tick['socket_bytes'] / 1024 / args.interval:>9.1f}"
+            f" {1000 * tick['encode']:>10.1f} {result['snapshot']['socket_bytes'] / 1024:>12.1f}"
+        )
+    before, after = results[(False, 'default')]['tick'], results[(True, 'msgpack')]['tick']
+    print(f"  batch msgpack vs per patient JSON: {before['ops'] / after['ops']:.0f}x fewer Redis ops and websocket frames, "
+          f"{before['queue_bytes'] / after['queue_bytes']:.1f}x fewer Redis bytes, {before['socket_bytes'] / after['socket_bytes']:.1f}x fewer websocket bytes")
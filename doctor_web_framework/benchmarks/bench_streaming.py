@@ -0,0 +1,109 @@
+"""
+Streaming ingestion against the in-memory broker: consumer throughput and reading-to-emit latency.
+
+1. Throughput: decode + fold of --messages Avro HealthRecords, then one flush.
+2. Latency: --devices devices each produce a reading every --interval seconds for --seconds seconds while the
+   consumer loop drains the topic and flushes every Config.STREAM_FLUSH_INTERVAL. Reported latencies are from the
+   reading's timestamp to the emit that carried it; the polling path adds the ingest worker's batching delay
+   (up to Config.INGEST_FLUSH_INTERVAL) plus up to 5 s (dashboard) / 15 s (alerts) on top of the database write.
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_streaming --devices 500 --messages 200000 --seconds 10
+"""
+import argparse
+import random
+import time
+from typing import Dict, List
+
+from config import Config
+from app.streaming import FakeBroker, StreamProcessor, encode_health_record
+
+def profiles_for(device_ids:List[str]) -> Dict[str, dict]:
+    return {
+        device_id: {
+            'device_owner': f'user{device_id}',
+            'owner_name': f'Patient {device_id}',
+            'personal_traits': {'name': f'Patient {device_id}', 'age': 40, 'gender': 'female'},
+            'medical_history': {}
+        }
+        for device_id in device_ids
+    }
+
+def processor_for(device_ids:List[str], doctors:int, emitted:list) -> StreamProcessor:
+    # Devices split evenly between the doctors' rooms, on both the dashboard and the notification page
+    subscriptions = {f'doctor{d}@example.com': set(device_ids[d::doctors]) for d in range(doctors)}
+    return StreamProcessor(
+        lambda: subscriptions, lambda: subscriptions, profiles_for,
+        lambda event, payload, room: emitted.append(event)
+    )
+
+def produce(broker:FakeBroker, rng:random.Random, device_id:str, timestamp_ms:int):
+    value = encode_health_record(device_id, rng.randint(45, 170), round(rng.uniform(35.5, 39.0), 2), rng.randint(80, 100), timestamp_ms)
+    broker.produce(Config.KAFKA_TOPIC, device_id, value, timestamp_ms)
+
+def throughput(n_devices:int, n_messages:int, doctors:int):
+    rng = random.Random(1)
+    broker = FakeBroker()
+    device_ids = [str(i) for i in range(n_devices)]
+    now_ms = int(time.time() * 1000)
+    for i in range(n_messages):
+        produce(broker, rng, device_ids[i % n_devices], now_ms - (n_messages - i) * 10)
+    consumer = broker.consumer()
+    consumer.subscribe([Config.KAFKA_TOPIC])
+    emitted:list = []
+    processor = processor_for(device_ids, doctors, emitted)
+
+    start = time.perf_counter()
+    while True:
+        message = consumer.poll(0)
+        if message is None:
+            break
+        processor.handle(message)
+    folded = time.perf_counter() - start
+    processor.flush()
+    flushed = time.perf_counter() - start - folded
+    print(f"throughput: {n_messages} messages in {folded:.2f} s ({n_messages / folded:,.0f} msg/s), "
+          f"flush of {n_devices} devices {1000 * flushed:.1f} ms, {len(emitted)} emits")
+
+def latency(n_devices:int, interval:float, seconds:float, doctors:int):
+    rng = random.Random(2)
+    broker = FakeBroker()
+    device_ids = [str(i) for i in range(n_devices)]
+    consumer = broker.consumer()
+    consumer.subscribe([Config.KAFKA_TOPIC])
+    emitted:list = []
+    processor = processor_for(device_ids, doctors, emitted)
+    # Devices start at random phases, like independent simulators
+    next_reading = {device_id: time.time() + rng.uniform(0, interval) for device_id in device_ids}
+
+    end = time.time() + seconds
+    last_flush = time.monotonic()
+    while time.time() < end:
+        now = time.time()
+        for device_id, due in next_reading.items():
+            if due <= now:
+                produce(broker, rng, device_id, int(due * 1000))
+                next_reading[device_id] = due + interval
+        while True:
+            message = consumer.poll(0)
+            if message is None:
+                break
+            processor.handle(message)
+        if time.monotonic() - last_flush >= Config.STREAM_FLUSH_INTERVAL:
+            processor.flush()
+            last_flush = time.monotonic()
+        time.sleep(0.005)
+    print(f"latency: {processor.messages} readings from {n_devices} devices, {len(emitted)} emits, {processor.latency.report()}")
+    print(f"polling path: ingest flush 0-{1000 * Config.INGEST_FLUSH_INTERVAL:.0f} ms + 0-5000 ms (dashboard) / 0-15000 ms (alerts) after the database write")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=500)
+    parser.add_argument('--doctors', type=int, default=25)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    throughput(args.devices, args.messages, args.doctors)
+    latency(args.devices, args.interval, args.seconds, args.doctors)
@@ -0,0 +1,263 @@
+"""
+Microbenchmark suite of the doctor app's data-processing functions, to catch regressions between commits.
+
+Every case runs at each of --sizes patients (devices) with --readings synthetic readings per device, on
+in-memory SQLite and the FakeCache. Reported per case and size: the best and median wall time over --repeat
+runs (after one warm-up run) and the peak memory allocated by one run (tracemalloc).
+
+  reverse_engineer_names   selection strings -> patient names and usernames (routes.py)
+  clean_graph_data         NaN -> None of the resampled graphs
+  build_graph_data         2-minute resampling of raw readings (full-recompute path)
+  rolling_window           DeviceWindow fold + graph_data of the same readings (incremental path)
+  device_means             per-device means of the alert window (one group-by)
+  critical_payloads        vectorized classification into 'patient_notification' payloads
+  kpis_full                compute_device_kpis with Config.KPI_INCREMENTAL off (database + resampling)
+  kpis_incremental         compute_device_kpis on warm rolling windows
+  dashboard_tick           a full fleet poller tick: KPIs, delta frames and fan-out to one doctor's room
+  alert_tick               routes.critical_condition_payloads of every device
+
+--save writes the results as JSON; --compare reads such a file and exits with status 1 when a median got
+slower than --threshold times its baseline (and by more than --min-ms), e.g.:
+
+    cd doctor_web_framework
+    git stash && python -m benchmarks.bench_suite --save /tmp/baseline.json && git stash pop
+    python -m benchmarks.bench_suite --compare /tmp/baseline.json
+    python -m benchmarks.bench_suite --sizes 10 100 --only kpis tick
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from benchmarks.fixtures import FakeCache, generate_readings, populate, DOCTOR_EMAIL
+from app import app, db
+from config import Config
+
+class Case(NamedTuple):
+    name:str
+    setup:Callable[[dict], Callable[[], object]] # synthetic data of one size -> the function to measure
+    database:bool # needs the populated database
+
+CASES:List[Case] = []
+
+def case(name:str, database:bool=False):
+    def register(setup):
+        CASES.append(Case(name, setup, database))
+        return setup
+    return register
+
+# Synthetic data
+# ==============
+
+def synthetic(n_devices:int, readings_per_device:int) -> dict:
+    device_ids = [f'device_{i}' for i in range(1, n_devices + 1)]
+    rows = generate_readings(device_ids, readings_per_device)
+    readings:Dict[str, list] = {device_id: [] for device_id in device_ids}
+    for row_id, row in enumerate(rows, start=1):
+        readings[row['device_id']].append((row['device_id'], row['heart_rate'], row['spo2'], row['temperature'], row['timestamp'], row_id))
+    return {
+        'device_ids': device_ids,
+        'usernames': [f'user{i}' for i in range(1, n_devices + 1)],
+        'names': [f'Patient Number{i}' for i in range(1, n_devices + 1)],
+        'rows': rows,
+        'readings': readings # device id -> [Reading, ...] as fetch_device_readings returns them
+    }
+
+# Cases
+# =====
+
+@case('reverse_engineer_names')
+def _reverse_engineer_names(data:dict):
+    from app.routes import reverse_engineer_names, reverse_engineer_username
+    selections = [f"{name.lower().replace(' ', '_')}_{username}" for name, username in zip(data['names'], data['usernames'])]
+    return lambda: [(reverse_engineer_names(selection), reverse_engineer_username(selection)) for selection in selections]
+
+@case('clean_graph_data')
+def _clean_graph_data(data:dict):
+    from app.kpi_engine import build_graph_data, clean_graph_data
+    # Uncleaned graphs (NaN for the empty buckets); clean_graph_data replaces the lists of the dict it is given
+    graphs = []
+    for username, device_id in zip(data['usernames'], data['device_ids']):
+        graph = build_graph_data(username, data['readings'][device_id])
+        graph['y_heart_rate'] = [float('nan') if v is None else v for v in graph['y_heart_rate']]
+        graph['y_spo2'] = [float('nan') if v is None else v for v in graph['y_spo2']]
+        graphs.append(graph)
+    return lambda: [clean_graph_data(dict(graph)) for graph in graphs]
+
+@case('build_graph_data')
+def _build_graph_data(data:dict):
+    from app.kpi_engine import build_graph_data
+    pairs = list(zip(data['usernames'], [data['readings'][device_id] for device_id in data['device_ids']]))
+    return lambda: [build_graph_data(username, readings) for username, readings in pairs]
+
+@case('rolling_window')
+def _rolling_window(data:dict):
+    from app.rolling_window import DeviceWindow
+    from decimal import Decimal
+    pairs = [
+        (username, [(r[5], r[1], r[2], Decimal(str(r[3])), r[4]) for r in data['readings'][device_id]])
+        for username, device_id in zip(data['usernames'], data['device_ids'])
+    ]
+    def run():
+        graphs = []
+        for username, rows in pairs:
+            window = DeviceWindow()
+            window.fold(rows)
+            graphs.append(window.graph_data(username))
+        return graphs
+    return run
+
+@case('device_means')
+def _device_means(data:dict):
+    from app.conditions import device_means
+    rows = data['rows']
+    columns = [[row[key] for row in rows] for key in ('device_id', 'temperature', 'heart_rate', 'spo2')]
+    return lambda: device_means(*columns)
+
+@case('critical_payloads')
+def _critical_payloads(data:dict):
+    from app.conditions import critical_condition_payloads_batch, device_means
+    means = device_means(*[[row[key] for row in data['rows']] for key in ('device_id', 'temperature', 'heart_rate', 'spo2')])
+    columns = (means['temperature'].to_numpy(), means['heart_rate'].to_numpy(), means['spo2'].to_numpy())
+    return lambda: critical_condition_payloads_batch(data['names'], *columns)
+
+def _kpis(data:dict, incremental:bool):
+    from app import kpi_engine
+    cache = FakeCache()
+    def run():
+        previous, Config.KPI_INCREMENTAL = Config.KPI_INCREMENTAL, incremental
+        try:
+            with app.app_context():
+                blob = kpi_engine.compute_device_kpis(data['device_ids'], cache, 2)
+                db.session.remove()
+            return blob
+        finally:
+            Config.KPI_INCREMENTAL = previous
+    kpi_engine.rolling_windows.clear()
+    return run
+
+@case('kpis_full', database=True)
+def _kpis_full(data:dict):
+    return _kpis(data, False)
+
+@case('kpis_incremental', database=True)
+def _kpis_incremental(data:dict):
+    return _kpis(data, True) # the warm-up run builds the windows, the measured runs find no new rows
+
+@case('dashboard_tick', database=True)
+def _dashboard_tick(data:dict):
+    from app import kpi_engine
+    from app.dashboard_delta import DeltaTracker
+    from app.fleet_poller import FleetPoller
+    cache = FakeCache()
+    def compute(device_ids):
+        with app.app_context():
+            roster = kpi_engine.fetch_device_roster(device_ids)
+            blob = kpi_engine.compute_roster_kpis(roster, cache, 2)
+            db.session.remove()
+        return {device.device_id: kpi_engine.dashboard_payload(device.device_owner, blob) for device, _, _ in roster}
+    poller = FleetPoller(
+        'bench', 'update_patient_data', 10, compute, lambda event, payload, room: None,
+        lambda task: None, time.sleep, delta=DeltaTracker()
+    )
+    poller.subscribe(DOCTOR_EMAIL, data['device_ids'])
+    kpi_engine.rolling_windows.clear()
+    return poller.tick
+
+@case('alert_tick', database=True)
+def _alert_tick(data:dict):
+    from app.routes import critical_condition_payloads
+    def run():
+        # The alert window covers the last minute of the synthetic readings, however long the earlier cases ran
+        previous = Config.ALERT_WINDOW_MINUTES
+        Config.ALERT_WINDOW_MINUTES = previous + (datetime.now() - data['populated']).total_seconds() / 60
+        try:
+            return critical_condition_payloads(data['device_ids'])
+        finally:
+            Config.ALERT_WINDOW_MINUTES = previous
+    return run
+
+# Measurement
+# ===========
+
+def measure(fn:Callable[[], object], repeat:int) -> dict:
+    fn() # warm-up: imports, caches, rolling windows
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'min_ms': round(1000 * min(timings), 3),
+        'median_ms': round(1000 * statistics.median(timings), 3),
+        'peak_kib': round(peak / 1024, 1)
+    }
+
+def run_suite(cases:List[Case], sizes:List[int], readings:int, repeat:int) -> Dict[str, Dict[str, dict]]:
+    results:Dict[str, Dict[str, dict]] = {c.name: {} for c in cases}
+    for size in sizes:
+        data = synthetic(size, readings)
+        if any(c.database for c in cases):
+            populate(size, readings, interleaved=True) # ids in arrival order, as the simulator writes them
+            data['populated'] = datetime.now()
+        for c in cases:
+            results[c.name][str(size)] = result = measure(c.setup(data), repeat)
+            print(f"{c.name:<24} {size:>6} {result['min_ms']:>11.2f} {result['median_ms']:>11.2f} {result['peak_kib']:>11.1f}", flush=True)
+    return results
+
+def regressions(results:dict, baseline:dict, threshold:float, min_ms:float) -> List[str]:
+    found = []
+    for name, by_size in results.items():
+        for size, result in by_size.items():
+            base:Optional[dict] = baseline.get('results', {}).get(name, {}).get(size)
+            if base is None:
+                continue
+            if result['median_ms'] > threshold * base['median_ms'] and result['median_ms'] - base['median_ms'] > min_ms:
+                found.append(f"{name} @ {size}: {base['median_ms']:.2f} -> {result['median_ms']:.2f} ms ({result['median_ms'] / base['median_ms']:.2f}x)")
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='patients (devices)')
+    parser.add_argument('--readings', type=int, default=360, help='readings per device (10 s apart)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', help='run the cases whose name contains one of these')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file written by --save')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    parser.add_argument('--min-ms', type=float, default=0.5, help='ignore slowdowns smaller than this (timer noise)')
+    args = parser.parse_args()
+
+    import logging
+    logging.getLogger('app').setLevel(logging.WARNING)
+    cases = [c for c in CASES if not args.only or any(part in c.name for part in args.only)]
+    print(f"{args.readings} readings per device, best/median of {args.repeat} runs")
+    print(f"{'case':<24} {'size':>6} {'min ms':>11} {'median ms':>11} {'peak KiB':>11}")
+    results = run_suite(cases, args.sizes, args.readings, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'readings': args.readings, 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('readings') != args.readings:
+            print(f"warning: the baseline was measured with {baseline.get('readings')} readings per device")
+        found = regressions(results, baseline, args.threshold, args.min_ms)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            raise SystemExit(1)
+        print(f"no regression above {args.threshold}x against {args.compare}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Fixed-interval fleet pollers versus the severity-aware TickScheduler (app/tick_scheduler.py), on a simulated
+fleet and a simulated clock (each run of the default 30 simulated minutes takes under half a minute).
+
+The fleet mixes --mix fractions of stable, mild, critical and deteriorating patients. A deteriorating patient
+is normal until a random onset and then drifts to critical values over --ramp seconds (--ramp 0: a sudden jump).
+Both pollers run as in routes.py (dashboard every 5 s, critical-condition alerts every 15 s) over a FleetPoller
+whose compute returns the payloads of the simulated vitals, then adaptive with the Config.TICK_* intervals and two
+bounds for steady patients: the poller's own interval (no back-off) and 60 s.
+
+Reported per poller and mode:
+  ticks/min        batched computations
+  queries/s        database statements per second: ticks times the statements of one real tick of the poller
+                   (routes.dashboard_payloads / critical_condition_payloads on a small SQLite fleet, measured at
+                   start; their number does not grow with the devices of the tick)
+  devices/s        device payloads computed per second; the rows read grow with it
+  critical latency seconds from a deteriorating patient turning critical to the first emit showing it critical
+
+    cd doctor_web_framework
+    python -m benchmarks.bench_tick_scheduler --devices 2000 --duration 1800
+    python -m benchmarks.bench_tick_scheduler --ramp 0
+"""
+import argparse
+import math
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.fixtures import QueryCounter, populate
+from app.conditions import CRITICAL, critical_condition_payloads_batch, flagged_mask, severity
+from app.fleet_poller import FleetPoller
+from app.tick_scheduler import alert_signal, dashboard_signal, poller_scheduler
+
+STABLE, MILD, CRIT, DETERIORATING = range(4)
+VITALS = {
+    STABLE: (36.8, 75.0, 97.0),
+    MILD: (37.7, 125.0, 89.0),
+    CRIT: (38.6, 160.0, 82.0)
+}
+NOISE = np.array([0.05, 2.0, 0.5])
+
+class Fleet:
+    def __init__(self, n_devices:int, mix:List[float], duration:int, ramp:float, seed:int=11):
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        self.device_ids = [f'device_{i}' for i in range(n_devices)]
+        self.index = {device_id: i for i, device_id in enumerate(self.device_ids)}
+        self.kinds = rng.choice(4, size=n_devices, p=np.array(mix) / sum(mix))
+        self.base = np.array([VITALS[STABLE if kind == DETERIORATING else kind] for kind in self.kinds])
+        self.target = np.array([VITALS[CRIT]] * n_devices)
+        self.onset = np.where(self.kinds == DETERIORATING, rng.uniform(60, duration - ramp - 120, n_devices), math.inf)
+        self.ramp = ramp
+        # When each deteriorating patient's noise-free vitals first classify as critical
+        self.critical_at:Dict[str, float] = {}
+        for i in np.flatnonzero(self.kinds == DETERIORATING):
+            for step in range(int(ramp) + 1):
+                vitals = self.base[i] + (self.target[i] - self.base[i]) * (step / ramp if ramp else 1.0)
+                if severity(*[np.array([value]) for value in vitals])[0] == CRITICAL:
+                    self.critical_at[self.device_ids[i]] = self.onset[i] + step
+                    break
+
+    def vitals(self, device_ids:List[str], now:float) -> np.ndarray:
+        rows = np.array([self.index[device_id] for device_id in device_ids])
+        progress = np.clip((now - self.onset[rows]) / self.ramp, 0, 1) if self.ramp else (now >= self.onset[rows]).astype(float)
+        drift = (self.target[rows] - self.base[rows]) * progress[:, None]
+        return self.base[rows] + drift + self.rng.normal(0, 1, (len(rows), 3)) * NOISE
+
+    def alert_payloads(self, device_ids:List[str], now:float) -> Dict[str, dict]:
+        vitals = self.vitals(device_ids, now).round(2)
+        mask = flagged_mask(vitals[:, 0], vitals[:, 1], vitals[:, 2])
+        flagged = [device_id for device_id, hit in zip(device_ids, mask) if hit]
+        batch = critical_condition_payloads_batch(flagged, vitals[mask, 0], vitals[mask, 1], vitals[mask, 2])
+        return dict(zip(flagged, batch))
+
+    def dashboard_payloads(self, device_ids:List[str], now:float) -> Dict[str, dict]:
+        vitals = self.vitals(device_ids, now).round(2)
+        return {
+            device_id: {
+                'device_owner': device_id, 'avg_temp': temperature,
+                'graph_data': {'x': [], 'y_heart_rate': [heart_rate], 'y_spo2': [spo2], 'device_owner': device_id}
+            }
+            for device_id, (temperature, heart_rate, spo2) in zip(device_ids, vitals.tolist())
+        }
+
+def statements_per_tick() -> Dict[str, int]:
+    from app import app, routes
+    device_ids = populate(50, 20)['device_ids']
+    statements = {}
+    for name, compute in (('dashboard', routes.dashboard_payloads), ('alerts', routes.critical_condition_payloads)):
+        counter = QueryCounter()
+        with app.app_context(), counter.track():
+            compute(device_ids)
+        statements[name] = counter.count
+    return statements
+
+def simulate(fleet:Fleet, name:str, interval:float, adaptive:bool, stable_max:float, duration:int) -> dict:
+    clock = [0.0]
+    compute_fn = fleet.alert_payloads if name == 'alerts' else fleet.dashboard_payloads
+    signal = alert_signal if name == 'alerts' else dashboard_signal
+    computed = [0]
+    latencies:Dict[str, float] = {}
+
+    def compute(device_ids):
+        computed[0] += len(device_ids)
+        return compute_fn(device_ids, clock[0])
+
+    def emit(event, payload, room):
+        device_id = payload['device_owner']
+        critical_at = fleet.critical_at.get(device_id)
+        if critical_at is None or device_id in latencies or clock[0] < critical_at:
+            return
+        if severity(*[np.array([value]) for value in signal(payload)])[0] == CRITICAL:
+            latencies[device_id] = clock[0] - critical_at
+
+    scheduler = poller_scheduler(signal, interval, stable_max, clock=lambda: clock[0]) if adaptive else None
+    poller = FleetPoller(name, 'event', interval, compute, emit, lambda task: None, time.sleep, scheduler=scheduler)
+    poller.subscribe('doctor', fleet.device_ids)
+    step = scheduler.granularity if scheduler is not None else interval
+    while clock[0] < duration:
+        poller.tick()
+        clock[0] += step
+
+    missed = len(fleet.critical_at) - len(latencies)
+    values = sorted(latencies.values())
+    def percentile(q:float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))] if values else math.nan
+    return {
+        'ticks_per_min': 60 * poller.ticks / duration,
+        'devices_per_s': computed[0] / duration,
+        'p50': percentile(0.5), 'p95': percentile(0.95), 'max': values[-1] if values else math.nan,
+        'missed': missed
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--duration', type=int, default=1800, help='simulated seconds')
+    parser.add_argument('--mix', type=float, nargs=4, default=[0.80, 0.10, 0.05, 0.05], metavar=('STABLE', 'MILD', 'CRITICAL', 'DETERIORATING'))
+    parser.add_argument('--ramp', type=float, default=300, help='seconds a deteriorating patient takes from normal to critical')
+    args = parser.parse_args()
+
+    fleet = Fleet(args.devices, args.mix, args.duration, args.ramp)
+    counts = np.bincount(fleet.kinds, minlength=4)
+    print(f"{args.devices} devices over {args.duration} s: {counts[STABLE]} stable, {counts[MILD]} mild, {counts[CRIT]} critical, "
+          f"{counts[DETERIORATING]} deteriorating ({'sudden' if not args.ramp else f'{args.ramp:.0f} s ramp'})")
+    statements = statements_per_tick()
+    print(f"statements per tick: dashboard {statements['dashboard']}, alerts {statements['alerts']}")
+    print(f"  {'poller':<26} {'ticks/min':>10} {'queries/s':>10} {'devices/s':>10} {'p50 s':>7} {'p95 s':>7} {'max s':>7} {'missed':>7}")
+    runs = [
+        ('dashboard', 5, None), ('dashboard', 5, 5.0), ('dashboard', 5, 60.0),
+        ('alerts', 15, None), ('alerts', 15, 15.0), ('alerts', 15, 60.0)
+    ]
+    for name, interval, stable_max in runs: # stable_max None: fixed interval
+        result = simulate(fleet, name, interval, stable_max is not None, stable_max or interval, args.duration)
+        label = f"{name} every {interval} s" if stable_max is None else f"{name} adaptive <= {stable_max:.0f} s"
+        print(
+            f"  {label:<26} {result['ticks_per_min']:>10.1f} {result['ticks_per_min'] / 60 * statements[name]:>10.1f} {result['devices_per_s']:>10.1f}"
+            f" {result['p50']:>7.1f} {result['p95']:>7.1f} {result['max']:>7.1f} {result['missed']:>7d}"
+        )
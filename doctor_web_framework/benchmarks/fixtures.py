@@ -0,0 +1,143 @@
+import os
+import random
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+# Benchmarks run against a local database (in-memory SQLite unless SQLALCHEMY_DATABASE_URI points elsewhere).
+# The variable has to be set before the application package is imported, since Config reads it at import time.
+os.environ.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite://')
+os.environ.setdefault('ROLLUP_COMPACTION', '0')
+
+from sqlalchemy import event, insert
+from app import app, db
+from app.dataModel import Doctor, Device, DoctorDeviceMapping, DeviceRecords, Owner, MedicalRecords
+
+DOCTOR_EMAIL = 'bench.doctor@example.com'
+
+class FakeCache:
+    """In-memory stand-in for the Flask-Caching Redis client that counts round trips."""
+    def __init__(self):
+        self.store:Dict[str, object] = {}
+        self.round_trips = 0
+
+    def get(self, key):
+        self.round_trips += 1
+        return self.store.get(key)
+
+    def get_many(self, *keys):
+        self.round_trips += 1
+        return [self.store.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        self.round_trips += 1
+        self.store[key] = value
+        return True
+
+    def set_many(self, mapping:dict, timeout=None):
+        self.round_trips += 1
+        self.store.update(mapping)
+        return list(mapping)
+
+class FakeBus:
+    """In-memory stand-in for the message bus Redis client (message_bus.py) that counts round trips."""
+    def __init__(self):
+        self.published:List[tuple] = []
+        self.round_trips = 0
+
+    def publish(self, channel, message):
+        self.round_trips += 1
+        self.published.append((channel, message))
+        return 1
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakePipeline:
+    def __init__(self, bus:FakeBus):
+        self.bus = bus
+        self.commands:List[tuple] = []
+
+    def publish(self, channel, message):
+        self.commands.append((channel, message))
+        return self
+
+    def execute(self):
+        self.bus.round_trips += 1
+        self.bus.published.extend(self.commands)
+        results, self.commands = [1] * len(self.commands), []
+        return results
+
+class QueryCounter:
+    """Counts the statements sent to the database while active."""
+    def __init__(self):
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    @contextmanager
+    def track(self):
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+        try:
+            yield self
+        finally:
+            event.remove(engine, 'before_cursor_execute', self._on_execute)
+
+def reset_database():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+def generate_readings(device_ids:List[str], readings_per_device:int, interval_seconds:int=10, end:datetime=None) -> List[dict]:
+    # Synthetic readings spaced like the DeviceSimulator output (one row per device every interval_seconds)
+    end = end or datetime.now()
+    rng = random.Random(42)
+    rows = []
+    for device_id in device_ids:
+        for i in range(readings_per_device):
+            ts = (end - timedelta(seconds=interval_seconds * (readings_per_device - i))).replace(microsecond=0)
+            rows.append({
+                'device_id': device_id,
+                'heart_rate': rng.randint(45, 170),
+                'temperature': round(rng.uniform(35.5, 39.0), 2),
+                'spo2': rng.randint(80, 100),
+                'timestamp': ts
+            })
+    return rows
+
+def populate(n_devices:int, readings_per_device:int, doctor_email:str=DOCTOR_EMAIL, interleaved:bool=False) -> Dict[str, List[str]]:
+    """
+    Creates one doctor with n_devices patients (owner, medical record, device, mapping) and their readings.
+    interleaved inserts the readings in arrival order (all devices per timestamp) instead of device by device.
+    """
+    reset_database()
+    device_ids = [f'device_{i}' for i in range(1, n_devices + 1)]
+    names = [f'Patient Number{i}' for i in range(1, n_devices + 1)]
+    usernames = [f'user{i}' for i in range(1, n_devices + 1)]
+    with app.app_context():
+        db.session.add(Doctor(name='Bench Doctor', email=doctor_email, password_hash='password'))
+        db.session.execute(insert(MedicalRecords), [
+            {'medical_history_record_id': i, 'chronic_conditions': 'None', 'family_history': 'None', 'smoking': 'No',
+             'alcohol_usage': 'Low', 'allerges': 'None', 'medication': 'None'}
+            for i in range(1, n_devices + 1)
+        ])
+        db.session.execute(insert(Owner), [
+            {'owner_username': usernames[i], 'owner_name': names[i], 'age': 30 + i % 50, 'marital_status': 'single',
+             'gender': 'female' if i % 2 else 'male', 'medical_history_record_id': i + 1}
+            for i in range(n_devices)
+        ])
+        db.session.execute(insert(Device), [
+            {'device_id': device_ids[i], 'device_type': 'wearable', 'device_owner': usernames[i]}
+            for i in range(n_devices)
+        ])
+        db.session.execute(insert(DoctorDeviceMapping), [
+            {'device_id': device_id, 'doctor_id': doctor_email} for device_id in device_ids
+        ])
+        readings = generate_readings(device_ids, readings_per_device)
+        if interleaved:
+            readings.sort(key=lambda row: row['timestamp'])
+        db.session.execute(insert(DeviceRecords), readings)
+        db.session.commit()
+    return {'device_ids': device_ids, 'names': names, 'usernames': usernames}
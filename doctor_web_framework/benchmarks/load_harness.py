@@ -0,0 +1,425 @@
+"""
+End-to-end load harness: what doctors and patients experience while thousands of devices write readings.
+
+Runs locally without external services:
+  - Redis: a fakeredis TCP server in a child process; the KPI cache and the doctor -> patient message bus
+    go through it like they go through Redis (Socket.IO emits stay in-process and JSON-encoded: the test
+    clients of Flask-SocketIO can be used neither with a message queue nor with the msgpack serializer)
+  - database: a SQLite file shared by both apps (--dsn: a scratch Postgres database instead)
+  - doctor app: in this process; --doctors logged-in doctors connect with in-process Socket.IO test clients,
+    rejoin their dashboard room and select their patients (--devices split between them)
+  - patient app: uvicorn in a child process with --patients WebSocket clients
+  - devices: one writer inserting a reading per device every --interval seconds, or the readings of a
+    --replay file (CSV as written by --record) with their original spacing; both --speed times faster
+
+Reported after --warmup seconds, over --duration seconds:
+  reading -> dashboard  commit of a reading to the first dashboard frame computed by a poller tick started
+                        after it, received by the doctor's client
+  message -> patient    a doctor's 'send_patient_message' to the message arriving on the patient's WebSocket
+                        (--messages per second, to random connected patients)
+  CPU and peak RSS of the doctor process (which also runs the writer and the test clients) and of the patient
+  process, database statements per second issued by the doctor process
+
+Needs fakeredis (pip install fakeredis).
+
+    cd doctor_web_framework
+    python -m benchmarks.load_harness --devices 2000 --doctors 200 --patients 200 --duration 60
+    python -m benchmarks.load_harness --devices 500 --record /tmp/readings.csv
+    python -m benchmarks.load_harness --devices 500 --replay /tmp/readings.csv --speed 10
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+PATIENT_APP = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'patient_framework')
+
+ScheduledReading = Tuple[float, str, int, float, int, str] # due (seconds from start), device id, hr, temperature, spo2, original timestamp
+
+def percentiles(values:List[float]) -> dict:
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    pick = lambda p: round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1)
+    return {'count': len(ordered), 'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99), 'max_ms': round(ordered[-1], 1)}
+
+class ProcessUsage:
+    """CPU (percent of one core) and resident memory of the current process, sampled by the caller."""
+
+    def __init__(self):
+        self.samples:List[Tuple[float, float]] = [] # cpu %, rss MiB
+        self.last = self._cpu_clock()
+
+    @staticmethod
+    def _cpu_clock() -> Tuple[float, float]:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return time.monotonic(), usage.ru_utime + usage.ru_stime
+
+    @staticmethod
+    def rss_mib() -> float:
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+        except OSError: # not Linux: peak instead of current
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def sample(self):
+        now = self._cpu_clock()
+        wall, cpu = now[0] - self.last[0], now[1] - self.last[1]
+        self.last = now
+        if wall > 0:
+            self.samples.append((100 * cpu / wall, self.rss_mib()))
+
+    def report(self) -> dict:
+        if not self.samples:
+            return {}
+        cpu = [sample[0] for sample in self.samples]
+        return {
+            'cpu_mean_pct': round(statistics.mean(cpu), 1),
+            'cpu_max_pct': round(max(cpu), 1),
+            'rss_max_mib': round(max(sample[1] for sample in self.samples), 1)
+        }
+
+# Child processes (started before the doctor app is imported, i.e. before gevent patches this process)
+# =====================================================================================================
+
+def redis_server(port:int):
+    from fakeredis import TcpFakeServer
+    TcpFakeServer(('127.0.0.1', port), server_type='redis').serve_forever()
+
+def wait_for_port(port:int, timeout:float=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise SystemExit(f"nothing listens on port {port} after {timeout:.0f} s")
+            time.sleep(0.1)
+
+def patient_service(port:int, database_uri:str, bus_url:str, commands):
+    """
+    The patient app and its WebSocket clients. Commands from the parent: ('connect', usernames) opens one
+    WebSocket per patient; ('measure', None) starts recording latencies; ('stop', None) replies with the results.
+    """
+    # Its app package has no __init__.py, so the doctor app's must not be importable at all
+    doctor_app = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path[:] = [PATIENT_APP] + [path for path in sys.path if path not in ('', '.', doctor_app)]
+    os.chdir(PATIENT_APP) # templates are looked up relative to the app directory
+    os.environ.update(SQLALCHEMY_DATABASE_URI=database_uri, MESSAGE_BUS_URL=bus_url, MESSAGE_DELIVERY='push')
+    import asyncio
+    import uvicorn
+    import websockets
+    from app.main import app
+
+    usage = ProcessUsage()
+    latencies:List[float] = []
+    state = {'measuring': False}
+
+    async def patient(username:str, connected:asyncio.Event):
+        async with websockets.connect(f'ws://127.0.0.1:{port}/ws/{username}', open_timeout=60, ping_interval=None) as ws:
+            connected.set()
+            async for raw in ws: # until cancelled
+                text = json.loads(raw).get('message') or ''
+                if text.startswith('load:') and state['measuring']:
+                    latencies.append(time.time() * 1000 - float(text.split(':')[2]))
+
+    async def sample():
+        while True:
+            await asyncio.sleep(1)
+            if state['measuring']:
+                usage.sample()
+
+    async def control():
+        loop = asyncio.get_running_loop()
+        tasks = []
+        while True:
+            command, payload = await loop.run_in_executor(None, commands.recv)
+            if command == 'connect':
+                for start in range(0, len(payload), 200):
+                    events = []
+                    for username in payload[start:start + 200]:
+                        events.append(asyncio.Event())
+                        tasks.append(asyncio.create_task(patient(username, events[-1])))
+                    await asyncio.wait_for(asyncio.gather(*(event.wait() for event in events)), timeout=120)
+                commands.send(('connected', len(tasks)))
+            elif command == 'measure':
+                usage.sample()
+                state['measuring'] = True
+            elif command == 'stop':
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                commands.send(('results', {'latencies': latencies, 'usage': usage.report()}))
+                return
+
+    async def main():
+        server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', backlog=4096))
+        loop = asyncio.get_running_loop()
+        loop.create_task(sample())
+        controller = loop.create_task(control())
+        serving = loop.create_task(server.serve())
+        await controller
+        server.should_exit = True
+        await serving
+
+    asyncio.run(main())
+
+# Readings
+# ========
+
+def generated_readings(device_ids:List[str], interval:float, speed:float) -> Iterator[ScheduledReading]:
+    # One reading per device every interval seconds, devices spread evenly over the interval
+    rng = random.Random(11)
+    phases = sorted((i * interval / len(device_ids), device_id) for i, device_id in enumerate(device_ids))
+    for round_number in itertools.count():
+        for phase, device_id in phases:
+            due = (round_number * interval + phase) / speed
+            yield due, device_id, rng.randint(45, 170), round(rng.uniform(35.5, 39.0), 2), rng.randint(80, 100), ''
+
+def replayed_readings(path:str, device_ids:List[str], speed:float) -> Iterator[ScheduledReading]:
+    # Recorded devices are mapped in sorted order onto the populated ones
+    with open(path, newline='') as f:
+        rows = sorted(csv.DictReader(f), key=lambda row: row['timestamp'])
+    recorded = sorted({row['device_id'] for row in rows})
+    if len(recorded) > len(device_ids):
+        raise SystemExit(f"{path} holds {len(recorded)} devices, run with --devices {len(recorded)} or more")
+    mapping = dict(zip(recorded, device_ids))
+    start = datetime.fromisoformat(rows[0]['timestamp']) if rows else None
+    for row in rows:
+        due = (datetime.fromisoformat(row['timestamp']) - start).total_seconds() / speed
+        yield due, mapping[row['device_id']], int(row['heart_rate']), float(row['temperature']), int(row['spo2']), row['timestamp']
+
+# Load run (doctor process)
+# =========================
+
+def run(args, bus_url:str, commands) -> dict:
+    from benchmarks.fixtures import QueryCounter, populate
+    from benchmarks.bench_fleet_poller import add_doctors
+    from app import app, db, socketio
+    from app import routes
+    from app.dataModel import DeviceRecords
+    import gevent
+
+    per_doctor = args.devices // args.doctors
+    roster = populate(args.devices, args.history, interleaved=True)
+    selections = add_doctors(roster, args.doctors, per_doctor)
+    watched = {roster['device_ids'][i] for indexes in selections.values() for i in indexes}
+    with app.app_context():
+        engine = db.engine
+
+    # Doctors: log in, rejoin the dashboard room (what the page does after a reconnect) and select all their patients
+    doctors = []
+    for email, indexes in selections.items():
+        client = app.test_client()
+        response = client.post('/login', json={'email': email, 'password': 'password'})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        sio = socketio.test_client(app, flask_test_client=client, query_string=f'email={email}')
+        sio.emit('rejoin', {'email': email, 'page': '/dashboard'})
+        sio.emit('get_patient_data', {'email': email, 'patients': [
+            f"{routes.normalize_name(roster['names'][i])}_{roster['usernames'][i]}" for i in indexes
+        ]})
+        doctors.append((email, sio))
+    print(f"{len(doctors)} doctors watching {len(watched)} of {args.devices} devices")
+
+    patients = roster['usernames'][:args.patients]
+    owner_names = dict(zip(roster['usernames'], roster['names']))
+    commands.send(('connect', patients))
+    print(f"{commands.recv()[1]} patient WebSockets open")
+
+    # Ticks that computed dashboards: a frame reflects the readings committed before its tick started
+    tick_starts:List[float] = []
+    compute = routes.dashboard_poller.compute
+    def timed_compute(device_ids):
+        tick_starts.append(time.time())
+        return compute(device_ids)
+    routes.dashboard_poller.compute = timed_compute
+
+    pending:Dict[str, List[float]] = {device_id: [] for device_id in watched} # commit times not yet on a dashboard
+    dashboard_latencies:List[float] = []
+    state = {'measuring': False, 'stop': False, 'messages_sent': 0, 'readings': 0}
+    usage = ProcessUsage()
+    queries = QueryCounter()
+    source = replayed_readings(args.replay, roster['device_ids'], args.speed) if args.replay else generated_readings(roster['device_ids'], args.interval, args.speed)
+    record_file = open(args.record, 'w', newline='') if args.record else None
+    recorder = csv.writer(record_file) if record_file is not None else None
+    if recorder is not None:
+        recorder.writerow(['device_id', 'heart_rate', 'temperature', 'spo2', 'timestamp'])
+
+    def writer():
+        statement = DeviceRecords.__table__.insert()
+        start = time.monotonic()
+        upcoming = next(source, None)
+        while upcoming is not None and not state['stop']:
+            elapsed = time.monotonic() - start
+            batch = []
+            while upcoming is not None and upcoming[0] <= elapsed:
+                batch.append(upcoming)
+                upcoming = next(source, None)
+            if batch:
+                now = datetime.now()
+                with engine.begin() as conn:
+                    conn.execute(statement, [
+                        {'device_id': device_id, 'heart_rate': hr, 'temperature': temperature, 'spo2': spo2, 'timestamp': now}
+                        for _, device_id, hr, temperature, spo2, _ in batch
+                    ])
+                committed = time.time()
+                state['readings'] += len(batch)
+                for _, device_id, hr, temperature, spo2, original in batch:
+                    if state['measuring'] and device_id in pending:
+                        pending[device_id].append(committed)
+                    if recorder is not None:
+                        recorder.writerow([device_id, hr, temperature, spo2, original or now.isoformat()])
+            gevent.sleep(0.05 if upcoming is None else max(0.0, min(0.5, upcoming[0] - (time.monotonic() - start))))
+
+    def collector():
+        # Frames land in the test clients' queues when emitted; the queues are drained every --sample-ms
+        while not state['stop']:
+            received = time.time()
+            for email, sio in doctors:
+                for packet in sio.get_received():
+                    if packet['name'] == 'update_patient_data':
+                        frames = [packet['args'][0]]
+                    elif packet['name'] == 'update_patient_batch': # SOCKETIO_BATCH: a tick's frames at once
+                        frames = packet['args'][0]['frames']
+                    else:
+                        continue
+                    for frame in frames:
+                        if frame.get('ack'): # like dashboard.html, so the outbound queue keeps sending
+                            sio.emit('outbound_ack', {'email': email, 'event': 'update_patient_data', 'seq': frame['oseq']})
+                        commits = pending.get(frame.get('device_id'))
+                        if not commits:
+                            continue
+                        tick_start = next((start for start in reversed(tick_starts) if start <= received), None)
+                        if tick_start is None:
+                            continue
+                        reflected = [commit for commit in commits if commit < tick_start]
+                        dashboard_latencies.extend(1000 * (received - commit) for commit in reflected)
+                        commits[:] = commits[len(reflected):]
+            gevent.sleep(args.sample_ms / 1000)
+
+    def messenger():
+        rng = random.Random(13)
+        for seq in itertools.count():
+            if state['stop']:
+                return
+            gevent.sleep(rng.expovariate(args.messages) if args.messages > 0 else 1)
+            if args.messages <= 0 or not state['measuring'] or not patients:
+                continue
+            username = rng.choice(patients)
+            _, sio = rng.choice(doctors)
+            sio.emit('send_patient_message', {
+                'patient_name': owner_names[username], 'device_owner': username, 'publish_flag': 0,
+                'message': f'load:{seq}:{time.time() * 1000:.1f}'
+            })
+            state['messages_sent'] += 1
+
+    def sampler():
+        while not state['stop']:
+            gevent.sleep(1)
+            if state['measuring']:
+                usage.sample()
+
+    greenlets = [gevent.spawn(task) for task in (writer, collector, messenger, sampler)]
+    print(f"warming up for {args.warmup:.0f} s")
+    gevent.sleep(args.warmup)
+    with app.app_context(), queries.track():
+        state['measuring'] = True
+        usage.sample()
+        commands.send(('measure', None))
+        started = time.monotonic()
+        readings_before = state['readings']
+        gevent.sleep(args.duration)
+        elapsed = time.monotonic() - started
+        state['measuring'] = False
+        readings = state['readings'] - readings_before
+    gevent.sleep(args.drain) # frames and messages for what was written until the end
+    state['stop'] = True
+    gevent.joinall(greenlets, timeout=10)
+    if record_file is not None:
+        record_file.close()
+    commands.send(('stop', None))
+    _, patient_results = commands.recv()
+    for _, sio in doctors:
+        sio.disconnect()
+
+    return {
+        'devices': args.devices, 'watched_devices': len(watched), 'doctors': len(doctors), 'patients': len(patients),
+        'seconds': round(elapsed, 1),
+        'readings_per_second': round(readings / elapsed, 1),
+        'reading_to_dashboard': percentiles(dashboard_latencies),
+        'readings_not_yet_on_a_dashboard': sum(len(commits) for commits in pending.values()),
+        'message_to_patient': dict(percentiles(patient_results['latencies']), sent=state['messages_sent']),
+        'db_queries_per_second': round(queries.count / elapsed, 1),
+        'doctor_process': usage.report(),
+        'patient_process': patient_results['usage']
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=2000)
+    parser.add_argument('--doctors', type=int, default=100, help='the devices are split between them (remainder unwatched)')
+    parser.add_argument('--patients', type=int, default=100, help='patients with an open WebSocket')
+    parser.add_argument('--interval', type=float, default=10, help='seconds between two readings of a device')
+    parser.add_argument('--history', type=int, default=60, help='readings per device already stored at the start')
+    parser.add_argument('--speed', type=float, default=1.0, help='readings (generated or replayed) arrive this many times faster')
+    parser.add_argument('--replay', help='CSV of recorded readings (device_id,heart_rate,temperature,spo2,timestamp)')
+    parser.add_argument('--record', help='write the readings of this run to a CSV for --replay')
+    parser.add_argument('--messages', type=float, default=2.0, help='doctor -> patient messages per second')
+    parser.add_argument('--warmup', type=float, default=10)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--drain', type=float, default=6, help='seconds to wait for the frames and messages in flight at the end')
+    parser.add_argument('--sample-ms', type=float, default=20, help='how often the doctors\' test clients are read')
+    parser.add_argument('--dsn', help='scratch Postgres database (default: a temporary SQLite file)')
+    parser.add_argument('--redis-port', type=int, default=6391)
+    parser.add_argument('--patient-port', type=int, default=8766)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+    if args.doctors > args.devices:
+        parser.error('--doctors must not exceed --devices')
+
+    database_uri = args.dsn or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}?timeout=60"
+    redis_url = f'redis://127.0.0.1:{args.redis_port}'
+    context = multiprocessing.get_context('spawn')
+    children = [context.Process(target=redis_server, args=(args.redis_port,), daemon=True)]
+    children[0].start()
+    wait_for_port(args.redis_port)
+    commands, child_commands = context.Pipe()
+    children.append(context.Process(target=patient_service, args=(args.patient_port, database_uri, f'{redis_url}/2', child_commands), daemon=True))
+    children[1].start()
+    wait_for_port(args.patient_port)
+
+    # The doctor app reads its configuration when it is imported (in run)
+    os.environ.update(
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        CACHE_REDIS_URL=f'{redis_url}/0',
+        MESSAGE_BUS_URL=f'{redis_url}/2',
+        SOCKETIO_MESSAGE_QUEUE='',
+        SOCKETIO_SERIALIZER='default',
+        TASK_REGISTRY='local',
+        KPI_STREAMING='0'
+    )
+    try:
+        report = run(args, f'{redis_url}/2', commands)
+    finally:
+        for child in reversed(children):
+            child.terminate()
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
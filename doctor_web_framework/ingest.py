@@ -0,0 +1,41 @@
+"""
+Bulk ingest worker: Kafka health-data-records -> Postgres health_data_records (app/ingest.py).
+
+Starts --workers processes, each one a member of the Config.INGEST_GROUP consumer group, so Kafka spreads the
+topic's partitions over them. Run postgres/migrations/003_health_data_records_unique_readings.sql first.
+
+    python ingest.py --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from multiprocessing.connection import wait
+
+def work():
+    # The ingest processes only write readings: no compaction job, no stream consumer. They do not serve
+    # greenlets either, and psycopg2 refuses COPY (copy_expert) once the gevent wait callback is installed
+    os.environ['ROLLUP_COMPACTION'] = '0'
+    os.environ['KPI_STREAMING'] = '0'
+    os.environ['DB_GREEN'] = '0'
+    from app import app, db
+    from app.ingest import run_ingest
+    run_ingest(app, db)
+
+if __name__ == '__main__':
+    from config import Config
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=Config.INGEST_WORKERS)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn') # fresh interpreters: the app package monkey-patches on import
+    processes = [context.Process(target=work, name=f'ingest-{i}') for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    # A worker only returns by crashing: stop the others too and let the container restart the group,
+    # the unwritten batches are read again from the committed offsets
+    wait([process.sentinel for process in processes])
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    sys.exit(1)
@@ -1,16 +1,35 @@
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import AsyncIterator
 from config import Config
 
-engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async engine: asyncpg for Postgres, aiosqlite for local runs (sqlite:// URIs)
+def async_database_uri(uri:str) -> str:
+    if uri.startswith('postgresql://'):
+        return 'postgresql+asyncpg://' + uri[len('postgresql://'):]
+    if uri.startswith('sqlite://'):
+        return 'sqlite+aiosqlite://' + uri[len('sqlite://'):]
+    return uri
+
+def pool_options(uri:str) -> dict:
+    if uri.startswith('sqlite'):
+        # SQLite has a single writer: queue the sessions on one connection instead of failing with "database is locked"
+        return {'poolclass': AsyncAdaptedQueuePool, 'pool_size': 1, 'max_overflow': 0, 'pool_timeout': 120}
+    if not uri.startswith('postgresql'):
+        return {}
+    return {
+        'pool_size': Config.DB_POOL_SIZE,
+        'max_overflow': Config.DB_MAX_OVERFLOW,
+        'pool_pre_ping': True
+    }
+
+engine = create_async_engine(async_database_uri(Config.SQLALCHEMY_DATABASE_URI), **pool_options(Config.SQLALCHEMY_DATABASE_URI))
+AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncIterator[AsyncSession]:
+    # One pooled session per request, returned to the pool when the handler finishes
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
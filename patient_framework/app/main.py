@@ -1,13 +1,39 @@
 from fastapi import FastAPI, Depends, Request, Form, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.templating import Jinja2Templates
 from . import models, schemas, database
+from .message_router import MessageRouter
+from config import Config
+from contextlib import asynccontextmanager
 from fastapi.responses import HTMLResponse
 from fastapi.background import BackgroundTasks
 from datetime import datetime
 import asyncio
 
-app = FastAPI()
+async def mark_delivered(message_id:int):
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(
+            update(models.PatientMessage)
+            .where(models.PatientMessage.id == message_id, models.PatientMessage.status_flag == 0)
+            .values(status_flag=1)
+        )
+        await db.commit()
+
+async def latest_message(username:str):
+    async with database.AsyncSessionLocal() as db:
+        return await check_latest_message(username, db)
+
+router = MessageRouter(Config.MESSAGE_BUS_URL, Config.PATIENT_MESSAGE_CHANNEL, mark_delivered, latest_message)
+
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    listener = asyncio.create_task(router.listen()) if Config.MESSAGE_DELIVERY == 'push' else None
+    yield
+    if listener is not None:
+        listener.cancel()
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="app/templates")
 
 # Store the counter of consecutive publish_flag=1 for each user
@@ -30,42 +56,66 @@ async def login_post(request: Request, username: str = Form(...)):
     return templates.TemplateResponse("message_log.html", {"request": request, "username": username})
 
 # Function to check the latest message
-async def check_latest_message(username: str, db: Session):
+async def check_latest_message(username: str, db: AsyncSession):
     global consecutive_hits
 
     if username not in consecutive_hits:
         consecutive_hits[username] = 0
 
-    # Fetch the latest message for the user
-    latest_message = db.query(models.PatientMessage).filter_by(device_owner=username).order_by(models.PatientMessage.timestamp.desc()).first()
-    
-    if latest_message and latest_message.status_flag == 0:
-        latest_message.status_flag = 1  # Mark it as processed (publish_flag=1)
-        db.commit()
+    # Claim the latest message if it is still unread: one atomic UPDATE ... RETURNING, so two connections
+    # of the same patient can never both deliver it
+    latest_id = (
+        select(models.PatientMessage.id)
+        .where(models.PatientMessage.device_owner == username)
+        .order_by(models.PatientMessage.timestamp.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    claimed = (await db.execute(
+        select(models.PatientMessage).from_statement(
+            update(models.PatientMessage)
+            .where(models.PatientMessage.id == latest_id, models.PatientMessage.status_flag == 0)
+            .values(status_flag=1)  # Mark it as processed (publish_flag=1)
+            .returning(models.PatientMessage)
+        )
+    )).scalar_one_or_none()
+    await db.commit()
+
+    if claimed is not None:
         consecutive_hits[username] = 0  # Reset counter
         return {
-            "message": latest_message.message,
-            "patient_name": latest_message.patient_name,
-            "timestamp": latest_message.timestamp.isoformat()
+            "message": claimed.message,
+            "patient_name": claimed.patient_name,
+            "timestamp": claimed.timestamp.isoformat()
         }
-    else:
-        consecutive_hits[username] += 1
-        if consecutive_hits[username] >= 5:
-            # return None  # Stop showing messages if already marked for 5 hits
-            return {
-                "message": "No new messages",
-                "patient_name": latest_message.patient_name,
-                "timestamp": datetime.now().isoformat()
-             }
+
+    # Already read: the latest message is shown again until it is considered stale
+    latest_message = (await db.execute(
+        select(models.PatientMessage.message, models.PatientMessage.patient_name)
+        .where(models.PatientMessage.device_owner == username)
+        .order_by(models.PatientMessage.timestamp.desc())
+        .limit(1)
+    )).first()
+    if latest_message is None:
+        return None
+    consecutive_hits[username] += 1
+    if consecutive_hits[username] >= 5:
+        # return None  # Stop showing messages if already marked for 5 hits
         return {
-            "message": latest_message.message,
+            "message": "No new messages",
             "patient_name": latest_message.patient_name,
-            "timestamp":  datetime.now().isoformat()
-        }
+            "timestamp": datetime.now().isoformat()
+         }
+    return {
+        "message": latest_message.message,
+        "patient_name": latest_message.patient_name,
+        "timestamp":  datetime.now().isoformat()
+    }
 
 @app.get("/messages/{username}", response_class=HTMLResponse)
-async def messages_log(request: Request, username: str, db: Session = Depends(database.get_db)):
+async def messages_log(request: Request, username: str, db: AsyncSession = Depends(database.get_db)):
     result = await check_latest_message(username, db)
+    message, patient_name, timestamp = None, username, None
     if result:
         message = result["message"]
         patient_name = result["patient_name"]
@@ -82,11 +132,34 @@ async def messages_log(request: Request, username: str, db: Session = Depends(da
     )
 
 @app.websocket("/ws/{username}")
-async def websocket_endpoint(websocket: WebSocket, username: str, db: Session = Depends(database.get_db)):
+async def websocket_endpoint(websocket: WebSocket, username: str):
     await websocket.accept()
+    if Config.MESSAGE_DELIVERY == 'push':
+        await push_messages(websocket, username)
+    else:
+        await poll_messages(websocket, username)
+
+async def push_messages(websocket: WebSocket, username: str):
+    # Latest message once, then only what the doctor app publishes; no database session is held while idle.
+    # Registered before the check, so a message published in between is pushed rather than missed.
+    router.register(username, websocket)
+    try:
+        result = await latest_message(username)
+        if result:
+            await websocket.send_json(result)
+        while True:
+            await websocket.receive_text() # the page never sends; this only waits for the disconnect
+    except WebSocketDisconnect:
+        print(f"WebSocket disconnected for user: {username}")
+    finally:
+        router.unregister(username, websocket)
+
+async def poll_messages(websocket: WebSocket, username: str):
     try:
         while True:
-            result = await check_latest_message(username, db)
+            # A pooled session per check; nothing is held while the loop sleeps
+            async with database.AsyncSessionLocal() as db:
+                result = await check_latest_message(username, db)
             if result:
                 await websocket.send_json({
                     "message": result["message"],
@@ -96,9 +169,9 @@ async def websocket_endpoint(websocket: WebSocket, username: str, db: Session =
             else:
                 await websocket.send_json({
                     "message": "No new messages",
-                    "patient_name": result["patient_name"],
+                    "patient_name": username,
                     "timestamp": datetime.now().isoformat()
                 })
             await asyncio.sleep(10)
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for user: {username}")
\ No newline at end of file
+        print(f"WebSocket disconnected for user: {username}")
@@ -0,0 +1,124 @@
+from fastapi import WebSocket
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Optional, Set
+import redis.asyncio as redis
+import asyncio
+import json
+
+# Push delivery of doctor messages
+# ================================
+# The doctor app publishes every saved message on Config.PATIENT_MESSAGE_CHANNEL (see doctor_web_framework
+# app/message_bus.py). A single subscriber per process routes each event to the open WebSockets of its
+# device_owner, so an idle patient costs no queries at all and a message reaches the page within milliseconds.
+# Delivered messages are flagged as read (status_flag = 1) in patient_messages, as the polling loop did.
+# Publishes sent while the Redis subscription is down are lost; after a reconnect every connected patient gets
+# the result of the resync callback (check_latest_message), so an unread message sent meanwhile still arrives.
+
+class MessageRouter:
+    def __init__(self, url:str, channel:str, mark_delivered:Callable[[int], Awaitable[None]],
+                 resync:Optional[Callable[[str], Awaitable[Optional[dict]]]] = None):
+        self.url = url
+        self.channel = channel
+        self.mark_delivered = mark_delivered
+        self.resync = resync
+        self.connections:Dict[str, Set[WebSocket]] = defaultdict(set)
+        self.delivered = 0
+        self.pending:Set[asyncio.Task] = set()
+        self.local_queue:Optional[asyncio.Queue] = None # url 'memory://': events are handed over in-process (load tests)
+
+    def register(self, username:str, websocket:WebSocket):
+        self.connections[username].add(websocket)
+
+    def unregister(self, username:str, websocket:WebSocket):
+        sockets = self.connections.get(username)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del self.connections[username]
+
+    async def deliver(self, event:dict) -> int:
+        username = event['device_owner']
+        sent = 0
+        for websocket in list(self.connections.get(username, ())):
+            try:
+                await websocket.send_json({
+                    "message": event["message"],
+                    "patient_name": event["patient_name"],
+                    "timestamp": event["timestamp"]
+                })
+                sent += 1
+            except Exception:
+                self.unregister(username, websocket)
+        if sent:
+            self.delivered += 1
+            # Flagging the message as read must not hold up the routing of the next event
+            task = asyncio.create_task(self.mark_delivered(event['id']))
+            self.pending.add(task)
+            task.add_done_callback(self._marked)
+        return sent
+
+    async def resync_registered(self):
+        if self.resync is None:
+            return
+        for username in list(self.connections):
+            try:
+                result = await self.resync(username)
+            except Exception as e:
+                print(f"Could not resync messages for {username}: {str(e)}")
+                continue
+            if not result:
+                continue
+            for websocket in list(self.connections.get(username, ())):
+                try:
+                    await websocket.send_json(result)
+                except Exception:
+                    self.unregister(username, websocket)
+
+    def _marked(self, task:asyncio.Task):
+        self.pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Could not flag a delivered message: {str(task.exception())}")
+
+    async def publish_local(self, event:dict):
+        if self.local_queue is None:
+            self.local_queue = asyncio.Queue()
+        await self.local_queue.put(event)
+
+    async def listen(self):
+        if self.url == 'memory://':
+            if self.local_queue is None:
+                self.local_queue = asyncio.Queue()
+            while True:
+                event = await self.local_queue.get()
+                try:
+                    await self.deliver(event)
+                except Exception as e:
+                    print(f"Could not deliver message event: {str(e)}")
+        # Reconnects with a growing delay when Redis goes away; once subscribed again the connected patients are resynced
+        delay = 1
+        reconnecting = False
+        while True:
+            client = redis.from_url(self.url)
+            try:
+                pubsub = client.pubsub()
+                await pubsub.subscribe(self.channel)
+                delay = 1
+                if reconnecting:
+                    reconnecting = False
+                    await self.resync_registered()
+                async for message in pubsub.listen():
+                    if message['type'] != 'message':
+                        continue
+                    try:
+                        await self.deliver(json.loads(message['data']))
+                    except Exception as e:
+                        print(f"Could not deliver message event: {str(e)}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Message bus listener error, reconnecting in {delay}s: {str(e)}")
+                reconnecting = True
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                await client.aclose()
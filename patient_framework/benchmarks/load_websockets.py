@@ -0,0 +1,156 @@
+"""
+WebSocket load test for the patient service: holds N concurrent patient connections and reports the latency from
+a doctor message being committed and published to it arriving on the patient's socket (p50/p99).
+
+Local mode (default) starts the service in a child process on SQLite (aiosqlite) with the in-process message bus,
+so it runs without Postgres or Redis:
+
+    cd patient_framework
+    python -m benchmarks.load_websockets --patients 5000 --delivery push
+    python -m benchmarks.load_websockets --patients 5000 --delivery poll
+
+Remote mode targets a running deployment; messages are inserted into --dsn and published on --bus like the doctor
+app does, so the same run can be compared before and after an upgrade:
+
+    python -m benchmarks.load_websockets --url ws://localhost:8000 --dsn postgresql://... --bus redis://localhost:6380/2
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import websockets
+from sqlalchemy import create_engine, insert
+
+CHANNEL = 'patient-messages'
+
+def serve(port:int, database_uri:str, delivery:str, events):
+    # Child process: the service itself plus a forwarder from the parent's pipe into the in-process bus
+    os.environ.update(SQLALCHEMY_DATABASE_URI=database_uri, MESSAGE_BUS_URL='memory://', MESSAGE_DELIVERY=delivery)
+    import uvicorn
+    from app.main import app, router
+
+    async def forward():
+        loop = asyncio.get_running_loop()
+        while True:
+            event = await loop.run_in_executor(None, events.recv)
+            await router.publish_local(event)
+
+    async def main():
+        server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', backlog=8192))
+        asyncio.get_running_loop().create_task(forward())
+        await server.serve()
+
+    asyncio.run(main())
+
+def percentile(ordered:List[float], p:float) -> float:
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1)
+
+async def patient(url:str, username:str, received:Dict[int, float], published:Dict[int, float], connected:asyncio.Event):
+    async with websockets.connect(f'{url}/ws/{username}', open_timeout=60, ping_interval=None) as ws:
+        connected.set()
+        async for raw in ws: # runs until the task is cancelled at the end of the test
+            text = json.loads(raw).get('message') or ''
+            if text.startswith('load:'):
+                seq = int(text.split(':')[1])
+                received.setdefault(seq, (time.time() - published[seq]) * 1000)
+
+async def run(args, publish, save):
+    usernames = [f'loadpatient{i}' for i in range(args.patients)]
+    received:Dict[int, float] = {}
+    published:Dict[int, float] = {}
+    tasks = []
+    start = time.perf_counter()
+    for batch in range(0, len(usernames), 500):
+        events = []
+        for username in usernames[batch:batch + 500]:
+            connected = asyncio.Event()
+            events.append(connected)
+            tasks.append(asyncio.create_task(patient(args.url, username, received, published, connected)))
+        await asyncio.wait_for(asyncio.gather(*(event.wait() for event in events)), timeout=120)
+    print(f"{len(tasks)} WebSockets open after {time.perf_counter() - start:.1f} s")
+    # The handshake completes before the service has read each patient's latest message; let those settle
+    await asyncio.sleep(args.settle)
+
+    rng = random.Random(5)
+    loop = asyncio.get_running_loop()
+    interval = args.seconds / args.messages
+    for seq in range(args.messages):
+        username = rng.choice(usernames)
+        event = await loop.run_in_executor(None, save, username, f'load:{seq}') # keep the client sockets serviced
+        # Latency is measured from the publish, i.e. once the message is committed like in the doctor app
+        published[seq] = time.time()
+        publish(event)
+        await asyncio.sleep(interval)
+
+    # Polling clients only see a message on their next poll (every 10 seconds)
+    deadline = time.time() + args.drain
+    while len(received) < args.messages and time.time() < deadline:
+        await asyncio.sleep(0.2)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = sorted(received.values())
+    report = {'patients': args.patients, 'messages': args.messages, 'delivered': len(latencies)}
+    if latencies:
+        report.update(p50_ms=percentile(latencies, 0.50), p99_ms=percentile(latencies, 0.99), max_ms=round(latencies[-1], 1))
+    print(report)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--patients', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--seconds', type=float, default=20, help='messages are spread over this many seconds')
+    parser.add_argument('--settle', type=float, default=5, help='seconds between the last connection and the first message')
+    parser.add_argument('--drain', type=float, default=15, help='seconds to wait for late deliveries')
+    parser.add_argument('--delivery', choices=['push', 'poll'], default='push', help='local mode only')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--url', help='ws:// base URL of a running service (remote mode)')
+    parser.add_argument('--dsn', help='database the remote service reads (remote mode)')
+    parser.add_argument('--bus', help='redis:// URL the remote service subscribes to (remote mode)')
+    args = parser.parse_args()
+
+    child:Optional[multiprocessing.Process] = None
+    if args.url is None:
+        database_uri = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}?timeout=60" # the benchmark's inserts share the file
+        args.dsn = database_uri
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        child = multiprocessing.Process(target=serve, args=(args.port, database_uri, args.delivery, receiver), daemon=True)
+        args.url = f'ws://127.0.0.1:{args.port}'
+        publish = sender.send
+    else:
+        import redis
+        bus = redis.Redis.from_url(args.bus)
+        publish = lambda event: bus.publish(CHANNEL, json.dumps(event))
+
+    from app.models import PatientMessage
+    engine = create_engine(args.dsn)
+    PatientMessage.__table__.create(engine, checkfirst=True)
+
+    def save(username:str, text:str) -> dict:
+        # What handle_patient_message in the doctor app does: insert, then publish
+        timestamp = datetime.now()
+        with engine.begin() as conn:
+            message_id = conn.execute(insert(PatientMessage).values(
+                patient_name=username, device_owner=username, message=text, status_flag=0, timestamp=timestamp
+            )).inserted_primary_key[0]
+        return {'id': message_id, 'device_owner': username, 'patient_name': username, 'message': text, 'timestamp': timestamp.isoformat()}
+
+    if child is not None:
+        child.start()
+        time.sleep(3)
+    try:
+        asyncio.run(run(args, publish, save))
+    finally:
+        if child is not None:
+            child.terminate()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+-- health_data_records.timestamp: VARCHAR(20) -> TIMESTAMP, plus a (device_id, timestamp) index
+-- =============================================================================================
+-- Readings used to be stored as 'YYYY-MM-DD HH24:MI:SS' strings, so every freshness filter had to wrap the
+-- column in to_timestamp(...) and Postgres could only answer it with a sequential scan of the whole table.
+--
+-- Run this before deploying the updated DeviceSimulator and the ingest worker (doctor_web_framework/ingest.py,
+-- which replaced the JDBC sink), which write the Avro timestamp-millis value straight into the TIMESTAMP column.
+--
+--   psql -h localhost -U admin_user -d health_records -f postgres/migrations/001_health_data_records_timestamp.sql
+
+-- 1. Convert the existing string rows in place (rewrites the table under an ACCESS EXCLUSIVE lock;
+--    stop the ingest worker while it runs, it resumes from its committed offsets afterwards).
+BEGIN;
+ALTER TABLE public.health_data_records
+    ALTER COLUMN "timestamp" TYPE TIMESTAMP
+    USING to_timestamp("timestamp", 'YYYY-MM-DD HH24:MI:SS')::timestamp;
+COMMIT;
+
+-- 2. Composite index for the per-device range scans (built without blocking the resumed sink).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_health_data_records_device_id_timestamp
+    ON public.health_data_records (device_id, "timestamp");
+
+ANALYZE public.health_data_records;
@@ -0,0 +1,86 @@
+-- Day-partitioned raw readings + 1/2-minute rollup tables
+-- =======================================================
+-- Requires 001_health_data_records_timestamp.sql. health_data_records is rebuilt as a table partitioned by
+-- RANGE("timestamp") with one partition per day; the doctor app's compaction job (app/rollups.py) keeps
+-- creating the upcoming day partitions, fills the rollup tables and drops raw partitions older than
+-- RAW_RETENTION_DAYS once they are fully compacted.
+--
+-- Pause the JDBC sink connector while this runs.
+--
+--   psql -h localhost -U admin_user -d health_records -f postgres/migrations/002_health_data_records_rollups.sql
+
+BEGIN;
+
+-- 1. Partitioned replacement of health_data_records (identity columns are not allowed on partitioned
+--    tables before Postgres 17, so ids come from a plain sequence)
+CREATE SEQUENCE public.health_data_records_partitioned_id_seq AS BIGINT;
+CREATE TABLE public.health_data_records_partitioned (
+    id BIGINT NOT NULL DEFAULT nextval('public.health_data_records_partitioned_id_seq'),
+    device_id VARCHAR(50),
+    heart_rate INTEGER,
+    temperature DECIMAL NOT NULL,
+    spo2 INTEGER,
+    "timestamp" TIMESTAMP NOT NULL,
+    PRIMARY KEY (id, "timestamp")
+) PARTITION BY RANGE ("timestamp");
+ALTER SEQUENCE public.health_data_records_partitioned_id_seq OWNED BY public.health_data_records_partitioned.id;
+
+-- Safety net for readings outside every day partition (e.g. clock skew on a device)
+CREATE TABLE public.health_data_records_default PARTITION OF public.health_data_records_partitioned DEFAULT;
+
+DO $$
+DECLARE
+    day DATE;
+BEGIN
+    FOR day IN
+        SELECT generate_series(
+            COALESCE((SELECT min("timestamp")::date FROM public.health_data_records), current_date),
+            current_date + 2,
+            INTERVAL '1 day'
+        )::date
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE public.health_data_records_p%s PARTITION OF public.health_data_records_partitioned FOR VALUES FROM (%L) TO (%L)',
+            to_char(day, 'YYYYMMDD'), day, day + 1
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO public.health_data_records_partitioned (id, device_id, heart_rate, temperature, spo2, "timestamp")
+SELECT id, device_id, heart_rate, temperature, spo2, "timestamp"
+FROM public.health_data_records
+WHERE "timestamp" IS NOT NULL;
+
+SELECT setval(
+    'public.health_data_records_partitioned_id_seq',
+    COALESCE((SELECT max(id) FROM public.health_data_records), 0) + 1,
+    false
+);
+
+-- 2. Swap the tables; the old one is kept until the new layout has been verified
+ALTER INDEX IF EXISTS public.ix_health_data_records_device_id_timestamp RENAME TO ix_health_data_records_unpartitioned_device_id_timestamp;
+ALTER TABLE public.health_data_records RENAME TO health_data_records_unpartitioned;
+ALTER TABLE public.health_data_records_partitioned RENAME TO health_data_records;
+CREATE INDEX ix_health_data_records_device_id_timestamp ON public.health_data_records (device_id, "timestamp");
+
+-- 3. Rollups (mean = sum / count) and compaction watermarks
+CREATE TABLE IF NOT EXISTS public.health_data_rollup_1m (
+    device_id VARCHAR(50) NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    readings INTEGER NOT NULL,
+    hr_min INTEGER, hr_max INTEGER, hr_sum BIGINT, hr_count INTEGER,
+    spo2_min INTEGER, spo2_max INTEGER, spo2_sum BIGINT, spo2_count INTEGER,
+    temp_min NUMERIC, temp_max NUMERIC, temp_sum NUMERIC, temp_count INTEGER,
+    PRIMARY KEY (device_id, bucket_start)
+);
+CREATE TABLE IF NOT EXISTS public.health_data_rollup_2m (LIKE public.health_data_rollup_1m INCLUDING ALL);
+
+CREATE TABLE IF NOT EXISTS public.rollup_watermarks (
+    rollup_table VARCHAR(50) PRIMARY KEY,
+    compacted_until TIMESTAMP NOT NULL
+);
+
+COMMIT;
+
+-- After verifying the dashboards:
+--   DROP TABLE public.health_data_records_unpartitioned;
@@ -0,0 +1,33 @@
+-- One row per (device_id, "timestamp") in health_data_records
+-- ==========================================================
+-- Requires 002_health_data_records_rollups.sql. The JDBC sink inserted every delivery of a record, so Kafka
+-- redeliveries left duplicate readings behind that every KPI scan counted again. The Python ingest worker
+-- (doctor_web_framework/ingest.py) replaces the sink and writes with ON CONFLICT (device_id, "timestamp")
+-- DO NOTHING, which needs the (device_id, "timestamp") index to be unique. The index includes the partition
+-- key, so it can be unique on the partitioned table.
+--
+-- Stop the JDBC sink connector before running this and start the ingest worker afterwards; the worker's
+-- consumer group starts from the earliest retained offset and skips the readings that are already stored.
+--
+--   curl -X DELETE http://localhost:8083/connectors/jdbc-sink-connector
+--   psql -h localhost -U admin_user -d health_records -f postgres/migrations/003_health_data_records_unique_readings.sql
+
+BEGIN;
+
+-- 1. Keep the first copy of every reading
+DELETE FROM public.health_data_records duplicate
+USING public.health_data_records original
+WHERE duplicate.device_id = original.device_id
+  AND duplicate."timestamp" = original."timestamp"
+  AND duplicate.id > original.id;
+
+-- 2. Replace the lookup index with a unique one (same name, same columns)
+DROP INDEX IF EXISTS public.ix_health_data_records_device_id_timestamp;
+CREATE UNIQUE INDEX ix_health_data_records_device_id_timestamp ON public.health_data_records (device_id, "timestamp");
+
+COMMIT;
+
+ANALYZE public.health_data_records;
+
+-- Buckets compacted before this migration keep the duplicates in their rollup counts; they age out with
+-- the rollup tables or can be rebuilt by deleting their rows and resetting public.rollup_watermarks.
@@ -0,0 +1,24 @@
+-- device_latest_state: latest reading, alert-window means and severity per device
+-- ===============================================================================
+-- Requires 003_health_data_records_unique_readings.sql. The ingest worker (doctor_web_framework/ingest.py)
+-- upserts one row per device with every batch of readings it writes (app/latest_state.py); the doctor app's
+-- critical-condition poller reads the rows by primary key instead of scanning the last minute of
+-- health_data_records (ALERT_LATEST_STATE=0 switches back). Devices without a row yet are still scanned,
+-- so the table fills itself as readings arrive after the ingest worker is restarted.
+--
+--   psql -h localhost -U admin_user -d health_records -f postgres/migrations/004_device_latest_state.sql
+
+CREATE TABLE IF NOT EXISTS public.device_latest_state (
+    device_id VARCHAR(50) PRIMARY KEY,
+    last_timestamp TIMESTAMP NOT NULL,
+    heart_rate INTEGER,
+    temperature NUMERIC(10, 2),
+    spo2 INTEGER,
+    window_readings INTEGER NOT NULL,
+    temp_mean DOUBLE PRECISION,
+    hr_mean DOUBLE PRECISION,
+    spo2_mean DOUBLE PRECISION,
+    severity SMALLINT NOT NULL,
+    flagged_until TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL
+);
@@ -0,0 +1,24 @@
+-- alert_history: committed changes of the critical-condition alert state machine
+-- ==============================================================================
+-- The doctor app's critical-condition poller sends 'patient_notification' frames only when a device's alert
+-- state changes (app/alert_state.py, ALERT_TRANSITIONS=0 switches back to a full payload every tick) and appends
+-- every change to this table: severity before and after, the message code of each vital and the window means.
+--
+--   psql -h localhost -U admin_user -d health_records -f postgres/migrations/005_alert_history.sql
+
+CREATE TABLE IF NOT EXISTS public.alert_history (
+    id SERIAL PRIMARY KEY,
+    device_id VARCHAR(50) NOT NULL,
+    device_owner VARCHAR(100),
+    from_severity SMALLINT,
+    to_severity SMALLINT NOT NULL,
+    temperature_code SMALLINT NOT NULL,
+    heart_rate_code SMALLINT NOT NULL,
+    spo2_code SMALLINT NOT NULL,
+    temperature DOUBLE PRECISION,
+    heart_rate DOUBLE PRECISION,
+    spo2 DOUBLE PRECISION,
+    created_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_alert_history_device_id ON public.alert_history (device_id, created_at);
@@ -0,0 +1,10 @@
+-- rollup_watermarks.compacted_id: late readings after compaction
+-- =============================================================
+-- Requires 002_health_data_records_rollups.sql. The compaction job (doctor_web_framework app/rollups.py) records
+-- the highest health_data_records id each run has seen. The next run recomputes the already compacted buckets of
+-- the readings stored since then with a timestamp before the watermark (readings more than ROLLUP_GRACE_SECONDS
+-- late), which rollup reads would otherwise miss for good. The first run after this migration only sets the id.
+--
+--   psql -h localhost -U admin_user -d health_records -f postgres/migrations/006_rollup_watermarks_compacted_id.sql
+
+ALTER TABLE public.rollup_watermarks ADD COLUMN IF NOT EXISTS compacted_id BIGINT;
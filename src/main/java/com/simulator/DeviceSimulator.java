@@ -16,6 +16,7 @@ import java.util.concurrent.ExecutionException;
 import java.util.concurrent.Executors;
 import java.util.concurrent.ScheduledExecutorService;
 import java.util.concurrent.TimeUnit;
+import java.time.Instant;
 import java.time.ZonedDateTime;
 import java.time.format.DateTimeFormatter;
 
@@ -44,7 +45,7 @@ public class DeviceSimulator {
         int heartRate = random.nextInt(100) + 150;
         double temperature = random.nextDouble() + 37.0;
         int spo2 =  random.nextInt(30) + 70;
-        String received_timestamp = getCurrentTimestamp();
+        long received_timestamp = Instant.now().toEpochMilli();
 
         // Create a JSON object
         JSONObject jsonObject = new JSONObject();
@@ -105,7 +106,7 @@ public class DeviceSimulator {
                     .setHeartRate(data_generator.getInt("heart_rate"))
                     .setTemperature(data_generator.getDouble("temperature"))
                     .setSpo2(data_generator.getInt("spo2"))
-                    .setTimestamp(data_generator.getString("timestamp"))
+                    .setTimestamp(Instant.ofEpochMilli(data_generator.getLong("timestamp")))
                     .build();
                 //Create a Producer record
                 ProducerRecord<String, Object> record = new ProducerRecord<>(KAFKA_TOPIC, deviceId, avroRecord);
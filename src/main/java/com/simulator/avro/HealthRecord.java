@@ -17,10 +17,13 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
   private static final long serialVersionUID = 6767980100257165395L;
 
 
-  public static final org.apache.avro.Schema SCHEMA$ = new org.apache.avro.Schema.Parser().parse("{\"type\":\"record\",\"name\":\"HealthRecord\",\"namespace\":\"com.simulator.avro\",\"fields\":[{\"name\":\"device_id\",\"type\":\"string\"},{\"name\":\"heart_rate\",\"type\":\"int\"},{\"name\":\"temperature\",\"type\":\"double\"},{\"name\":\"spo2\",\"type\":\"int\"},{\"name\":\"timestamp\",\"type\":\"string\"}]}");
+  public static final org.apache.avro.Schema SCHEMA$ = new org.apache.avro.Schema.Parser().parse("{\"type\":\"record\",\"name\":\"HealthRecord\",\"namespace\":\"com.simulator.avro\",\"fields\":[{\"name\":\"device_id\",\"type\":\"string\"},{\"name\":\"heart_rate\",\"type\":\"int\"},{\"name\":\"temperature\",\"type\":\"double\"},{\"name\":\"spo2\",\"type\":\"int\"},{\"name\":\"timestamp\",\"type\":{\"type\":\"long\",\"logicalType\":\"timestamp-millis\"}}]}");
   public static org.apache.avro.Schema getClassSchema() { return SCHEMA$; }
 
   private static final SpecificData MODEL$ = new SpecificData();
+  static {
+    MODEL$.addLogicalTypeConversion(new org.apache.avro.data.TimeConversions.TimestampMillisConversion());
+  }
 
   private static final BinaryMessageEncoder<HealthRecord> ENCODER =
       new BinaryMessageEncoder<>(MODEL$, SCHEMA$);
@@ -77,7 +80,7 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
   private int heart_rate;
   private double temperature;
   private int spo2;
-  private java.lang.CharSequence timestamp;
+  private java.time.Instant timestamp;
 
   /**
    * Default constructor.  Note that this does not initialize fields
@@ -94,12 +97,12 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
    * @param spo2 The new value for spo2
    * @param timestamp The new value for timestamp
    */
-  public HealthRecord(java.lang.CharSequence device_id, java.lang.Integer heart_rate, java.lang.Double temperature, java.lang.Integer spo2, java.lang.CharSequence timestamp) {
+  public HealthRecord(java.lang.CharSequence device_id, java.lang.Integer heart_rate, java.lang.Double temperature, java.lang.Integer spo2, java.time.Instant timestamp) {
     this.device_id = device_id;
     this.heart_rate = heart_rate;
     this.temperature = temperature;
     this.spo2 = spo2;
-    this.timestamp = timestamp;
+    this.timestamp = timestamp.truncatedTo(java.time.temporal.ChronoUnit.MILLIS);
   }
 
   @Override
@@ -108,6 +111,21 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
   @Override
   public org.apache.avro.Schema getSchema() { return SCHEMA$; }
 
+  private static final org.apache.avro.Conversion<?>[] conversions =
+      new org.apache.avro.Conversion<?>[] {
+      null,
+      null,
+      null,
+      null,
+      new org.apache.avro.data.TimeConversions.TimestampMillisConversion(),
+      null
+  };
+
+  @Override
+  public org.apache.avro.Conversion<?> getConversion(int field$) {
+    return conversions[field$];
+  }
+
   // Used by DatumWriter.  Applications should not call.
   @Override
   public java.lang.Object get(int field$) {
@@ -130,7 +148,7 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
     case 1: heart_rate = (java.lang.Integer)value$; break;
     case 2: temperature = (java.lang.Double)value$; break;
     case 3: spo2 = (java.lang.Integer)value$; break;
-    case 4: timestamp = (java.lang.CharSequence)value$; break;
+    case 4: timestamp = (java.time.Instant)value$; break;
     default: throw new IndexOutOfBoundsException("Invalid index: " + field$);
     }
   }
@@ -207,7 +225,7 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
    * Gets the value of the 'timestamp' field.
    * @return The value of the 'timestamp' field.
    */
-  public java.lang.CharSequence getTimestamp() {
+  public java.time.Instant getTimestamp() {
     return timestamp;
   }
 
@@ -216,8 +234,8 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
    * Sets the value of the 'timestamp' field.
    * @param value the value to set.
    */
-  public void setTimestamp(java.lang.CharSequence value) {
-    this.timestamp = value;
+  public void setTimestamp(java.time.Instant value) {
+    this.timestamp = value.truncatedTo(java.time.temporal.ChronoUnit.MILLIS);
   }
 
   /**
@@ -265,7 +283,7 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
     private int heart_rate;
     private double temperature;
     private int spo2;
-    private java.lang.CharSequence timestamp;
+    private java.time.Instant timestamp;
 
     /** Creates a new Builder */
     private Builder() {
@@ -489,7 +507,7 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
       * Gets the value of the 'timestamp' field.
       * @return The value.
       */
-    public java.lang.CharSequence getTimestamp() {
+    public java.time.Instant getTimestamp() {
       return timestamp;
     }
 
@@ -499,9 +517,9 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
       * @param value The value of 'timestamp'.
       * @return This builder.
       */
-    public com.simulator.avro.HealthRecord.Builder setTimestamp(java.lang.CharSequence value) {
+    public com.simulator.avro.HealthRecord.Builder setTimestamp(java.time.Instant value) {
       validate(fields()[4], value);
-      this.timestamp = value;
+      this.timestamp = value.truncatedTo(java.time.temporal.ChronoUnit.MILLIS);
       fieldSetFlags()[4] = true;
       return this;
     }
@@ -520,7 +538,6 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
       * @return This builder.
       */
     public com.simulator.avro.HealthRecord.Builder clearTimestamp() {
-      timestamp = null;
       fieldSetFlags()[4] = false;
       return this;
     }
@@ -534,7 +551,7 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
         record.heart_rate = fieldSetFlags()[1] ? this.heart_rate : (java.lang.Integer) defaultValue(fields()[1]);
         record.temperature = fieldSetFlags()[2] ? this.temperature : (java.lang.Double) defaultValue(fields()[2]);
         record.spo2 = fieldSetFlags()[3] ? this.spo2 : (java.lang.Integer) defaultValue(fields()[3]);
-        record.timestamp = fieldSetFlags()[4] ? this.timestamp : (java.lang.CharSequence) defaultValue(fields()[4]);
+        record.timestamp = fieldSetFlags()[4] ? this.timestamp : (java.time.Instant) defaultValue(fields()[4]);
         return record;
       } catch (org.apache.avro.AvroMissingFieldException e) {
         throw e;
@@ -561,76 +578,4 @@ public class HealthRecord extends org.apache.avro.specific.SpecificRecordBase im
     throws java.io.IOException {
     READER$.read(this, SpecificData.getDecoder(in));
   }
-
-  @Override protected boolean hasCustomCoders() { return true; }
-
-  @Override public void customEncode(org.apache.avro.io.Encoder out)
-    throws java.io.IOException
-  {
-    out.writeString(this.device_id);
-
-    out.writeInt(this.heart_rate);
-
-    out.writeDouble(this.temperature);
-
-    out.writeInt(this.spo2);
-
-    out.writeString(this.timestamp);
-
-  }
-
-  @Override public void customDecode(org.apache.avro.io.ResolvingDecoder in)
-    throws java.io.IOException
-  {
-    org.apache.avro.Schema.Field[] fieldOrder = in.readFieldOrderIfDiff();
-    if (fieldOrder == null) {
-      this.device_id = in.readString(this.device_id instanceof Utf8 ? (Utf8)this.device_id : null);
-
-      this.heart_rate = in.readInt();
-
-      this.temperature = in.readDouble();
-
-      this.spo2 = in.readInt();
-
-      this.timestamp = in.readString(this.timestamp instanceof Utf8 ? (Utf8)this.timestamp : null);
-
-    } else {
-      for (int i = 0; i < 5; i++) {
-        switch (fieldOrder[i].pos()) {
-        case 0:
-          this.device_id = in.readString(this.device_id instanceof Utf8 ? (Utf8)this.device_id : null);
-          break;
-
-        case 1:
-          this.heart_rate = in.readInt();
-          break;
-
-        case 2:
-          this.temperature = in.readDouble();
-          break;
-
-        case 3:
-          this.spo2 = in.readInt();
-          break;
-
-        case 4:
-          this.timestamp = in.readString(this.timestamp instanceof Utf8 ? (Utf8)this.timestamp : null);
-          break;
-
-        default:
-          throw new java.io.IOException("Corrupt ResolvingDecoder.");
-        }
-      }
-    }
-  }
 }
-
-
-
-
-
-
-
-
-
-